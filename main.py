@@ -1,17 +1,19 @@
+import time
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query, Request
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
-from src.hybrid_model import get_hybrid_recommendations
-from src.database import create_tables
-from mysql.connector import Error
-
-# 1. Asegurarse de que las tablas existan al inicio
-try:
-    create_tables() 
-except Error as e:
-    print(f"ATENCIÓN: No se pudo conectar a la BD o crear tablas. Verifique MySQL. Error: {e}")
-except Exception as e:
-    print(f"Error inesperado al inicializar la BD: {e}")
+from fastapi.responses import JSONResponse, Response
+from src.hybrid_model import (
+    get_hybrid_recommendations_async, get_hybrid_recommendations_batch_async, get_user_recommendations_async,
+    update_user_preferences
+)
+from src.response_cache import recommendation_cache
+from src import model_registry, warmup, metrics
+from src.llm_processor import close_async_client, expansion_cache
+from src.concurrency import shutdown_executors, run_io
+from src.cf_model import add_rating, RATING_SCALE
 
 app = FastAPI(
     title="Sistema de Recomendación de Destinos Turísticos en México",
@@ -27,6 +29,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Duración por ruta para /metrics y, en las peticiones muestreadas (o con el
+    encabezado X-Recommender-Trace: 1), el desglose por etapa en Server-Timing.
+    """
+    trace = metrics.start_trace(force=request.headers.get(metrics.TRACE_HEADER) == '1')
+    start = time.perf_counter()
+    response = await call_next(request)
+    seconds = time.perf_counter() - start
+    # La plantilla de la ruta (no la URL) para no crear una serie por usuario
+    route = request.scope.get('route')
+    metrics.REQUEST_SECONDS.observe(seconds, route=getattr(route, 'path', 'unmatched'), method=request.method)
+    if trace is not None:
+        response.headers['Server-Timing'] = metrics.server_timing(trace, seconds)
+    return response
+
+@app.on_event("startup")
+def load_models():
+    """
+    Crea las tablas, carga los modelos y los calienta (ver src/warmup.py); luego
+    vigila `models/` para recargarlos en caliente.
+    """
+    warmup.start_warm_up()
+    model_registry.start_watcher()
+
+@app.on_event("shutdown")
+async def release_resources():
+    model_registry.stop_watcher()
+    await close_async_client()
+    shutdown_executors()
+
 @app.get("/status", tags=["Admin"])
 def get_status():
     """Verifica que la API esté funcionando"""
@@ -36,29 +70,85 @@ def get_status():
         "endpoints": {
             "docs": "/docs",
             "user_recommendations": "/recommend/user/{user_id}",
-            "query_recommendations": "/recommend/query"
-        }
+            "query_recommendations": "/recommend/query",
+            "batch_recommendations": "/recommend/batch",
+            "ratings": "/ratings",
+            "preferences": "/users/{user_id}/preferences",
+            "liveness": "/health/live",
+            "readiness": "/health/ready",
+            "metrics": "/metrics"
+        },
+        "llm_cache": expansion_cache.stats(),
+        "response_cache": recommendation_cache.stats()
     }
 
+@app.get("/health/live", tags=["Admin"])
+def health_live():
+    """El proceso está vivo (no depende de modelos ni de MySQL)."""
+    return {"status": "alive"}
+
+@app.get("/health/ready", tags=["Admin"])
+def health_ready():
+    """Listo para recibir tráfico: warm-up terminado y modelos cargados. Si no, 503."""
+    readiness = warmup.readiness()
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
+@app.get("/metrics", tags=["Admin"])
+def get_metrics():
+    """Histogramas de latencia por etapa y contadores en formato de texto de Prometheus."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# Cantidad de recomendaciones: n < 1 responde 422, no un 404 engañoso
+TOP_N_QUERY = Query(10, ge=1, description="Número de recomendaciones")
+# Filtro "cerca de mí" (opcional) de los endpoints de recomendación
+LAT_QUERY = Query(None, ge=-90, le=90, description="Latitud del usuario (con lng)")
+LNG_QUERY = Query(None, ge=-180, le=180, description="Longitud del usuario (con lat)")
+RADIUS_QUERY = Query(None, gt=0, description="Radio en km; sin radio se usan los destinos más cercanos")
+
+
+def _parse_location(lat: Optional[float], lng: Optional[float], radius_km: Optional[float]):
+    """(lat, lng, radius_km) para el modelo híbrido, o None si la petición no trae ubicación."""
+    if lat is None and lng is None:
+        if radius_km is not None:
+            raise HTTPException(status_code=400, detail="'radius_km' requiere 'lat' y 'lng'.")
+        return None
+    if lat is None or lng is None:
+        raise HTTPException(status_code=400, detail="Los parámetros 'lat' y 'lng' van juntos.")
+    return (lat, lng, radius_km)
+
+
+def _location_detail(location) -> str:
+    lat, lng, radius_km = location
+    area = f"a {radius_km:g} km de" if radius_km is not None else "cerca de"
+    return f"No hay destinos {area} ({lat:g}, {lng:g})."
+
+
 @app.get("/recommend/user/{user_id}", tags=["Recomendación"])
-async def get_user_recommendations(user_id: int, n: int = 10):
+async def get_user_recommendations(user_id: int, n: int = TOP_N_QUERY, lat: Optional[float] = LAT_QUERY,
+                                   lng: Optional[float] = LNG_QUERY, radius_km: Optional[float] = RADIUS_QUERY):
     """
     Genera recomendaciones basadas en el historial del usuario (prioriza CF/preferencias estáticas).
+    Las respuestas se cachean hasta que el usuario valore algo, cambie sus
+    preferencias o se publique un modelo nuevo.
     
     Args:
         user_id: ID del usuario en la base de datos
         n: Número de recomendaciones a devolver (default: 10)
+        lat, lng: Ubicación opcional; solo se recomiendan destinos cercanos
+        radius_km: Radio de búsqueda (sin radio, los destinos más cercanos)
     
     Returns:
         Lista de destinos recomendados con scores
     """
+    location = _parse_location(lat, lng, radius_km)
     try:
-        recommendations = get_hybrid_recommendations(user_id=user_id, top_n=n)
+        recommendations = await get_user_recommendations_async(user_id=user_id, top_n=n, location=location)
         
         if not recommendations:
             raise HTTPException(
                 status_code=404, 
-                detail=f"No se encontraron recomendaciones para el usuario {user_id}. Verifique que exista en la BD."
+                detail=_location_detail(location) if location else
+                f"No se encontraron recomendaciones para el usuario {user_id}. Verifique que exista en la BD."
             )
         
         return {
@@ -77,7 +167,8 @@ async def get_user_recommendations(user_id: int, n: int = 10):
         )
 
 @app.post("/recommend/query", tags=["Recomendación"])
-async def get_query_recommendations(query_text: str, user_id: int, n: int = 10):
+async def get_query_recommendations(query_text: str, user_id: int, n: int = TOP_N_QUERY, lat: Optional[float] = LAT_QUERY,
+                                    lng: Optional[float] = LNG_QUERY, radius_km: Optional[float] = RADIUS_QUERY):
     """
     Genera recomendaciones basadas en una consulta de lenguaje natural.
     Usa Ollama para expansión de query y prioriza CB sobre CF.
@@ -86,6 +177,8 @@ async def get_query_recommendations(query_text: str, user_id: int, n: int = 10):
         query_text: Consulta en lenguaje natural (ej: "playas tranquilas")
         user_id: ID del usuario (para personalización CF)
         n: Número de recomendaciones (default: 10)
+        lat, lng: Ubicación opcional; solo se recomiendan destinos cercanos
+        radius_km: Radio de búsqueda (sin radio, los destinos más cercanos)
     
     Returns:
         Lista de destinos recomendados con scores
@@ -95,18 +188,21 @@ async def get_query_recommendations(query_text: str, user_id: int, n: int = 10):
             status_code=400, 
             detail="El campo 'query_text' es obligatorio y no puede estar vacío."
         )
+    location = _parse_location(lat, lng, radius_km)
     
     try:
-        recommendations = get_hybrid_recommendations(
+        recommendations = await get_hybrid_recommendations_async(
             user_id=user_id, 
             top_n=n, 
-            query_text=query_text
+            query_text=query_text,
+            location=location
         )
         
         if not recommendations:
             raise HTTPException(
                 status_code=404, 
-                detail="No se encontraron destinos relevantes para esta consulta."
+                detail=_location_detail(location) if location else
+                "No se encontraron destinos relevantes para esta consulta."
             )
         
         return {
@@ -125,6 +221,111 @@ async def get_query_recommendations(query_text: str, user_id: int, n: int = 10):
             detail=f"Error al procesar consulta NLP: {str(e)}"
         )
 
+MAX_BATCH_SIZE = 1000
+
+class BatchRecommendationItem(BaseModel):
+    user_id: int
+    query_text: Optional[str] = None
+
+class BatchRecommendationRequest(BaseModel):
+    items: List[BatchRecommendationItem]
+    n: int = Field(10, ge=1)
+
+@app.post("/recommend/batch", tags=["Recomendación"])
+async def get_batch_recommendations(request: BatchRecommendationRequest):
+    """
+    Genera recomendaciones para muchos usuarios en una sola llamada (jobs de marketing).
+    
+    Args:
+        items: Lista de {user_id, query_text opcional}
+        n: Número de recomendaciones por usuario (default: 10)
+    
+    Returns:
+        Una entrada por usuario, en el mismo orden de la petición
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="El campo 'items' no puede estar vacío.")
+    if len(request.items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"El lote excede el máximo de {MAX_BATCH_SIZE} usuarios por llamada."
+        )
+    
+    try:
+        requests = [
+            {"user_id": item.user_id, "query_text": item.query_text.strip() if item.query_text else None}
+            for item in request.items
+        ]
+        results = await get_hybrid_recommendations_batch_async(requests, top_n=request.n)
+        return {
+            "total_users": len(results),
+            "results": results
+        }
+        
+    except Exception as e:
+        print(f"Error interno en get_batch_recommendations: {e}")
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Error al generar recomendaciones por lote: {str(e)}"
+        )
+
+class RatingRequest(BaseModel):
+    user_id: int
+    id_destino: int
+    puntuacion: float = Field(..., ge=RATING_SCALE[0], le=RATING_SCALE[1])
+
+@app.post("/ratings", tags=["Valoraciones"])
+async def post_rating(rating: RatingRequest):
+    """
+    Registra (o actualiza) la valoración de un usuario a un destino.
+    El usuario se incorpora al modelo CF en línea (fold-in), así que sus
+    siguientes recomendaciones ya la reflejan sin esperar al reentrenamiento.
+    
+    Args:
+        user_id: ID del usuario
+        id_destino: ID del destino valorado
+        puntuacion: Puntuación en la escala del modelo (1-5)
+    """
+    try:
+        return await run_io(add_rating, rating.user_id, rating.id_destino, rating.puntuacion)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error interno en post_rating: {e}")
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Error al registrar la valoración: {str(e)}"
+        )
+
+class PreferencesRequest(BaseModel):
+    preferencias_texto: str
+
+@app.put("/users/{user_id}/preferences", tags=["Usuarios"])
+async def put_preferences(user_id: int, request: PreferencesRequest):
+    """
+    Actualiza el texto de preferencias del usuario (consulta CB cuando no hay query).
+    Invalida sus recomendaciones cacheadas.
+    
+    Args:
+        user_id: ID del usuario
+        preferencias_texto: Temas de interés (ej: "playa, aventura, gastronomía")
+    """
+    preferencias_texto = request.preferencias_texto.strip()
+    if not preferencias_texto:
+        raise HTTPException(status_code=400, detail="El campo 'preferencias_texto' no puede estar vacío.")
+    try:
+        return await run_io(update_user_preferences, user_id, preferencias_texto)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        print(f"Error interno en put_preferences: {e}")
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Error al actualizar las preferencias: {str(e)}"
+        )
+
 if __name__ == "__main__":
     print("\n" + "="*60)
     print("  SISTEMA DE RECOMENDACIÓN HÍBRIDO - SERVIDOR INICIANDO")
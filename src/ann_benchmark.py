@@ -0,0 +1,129 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+import faiss
+from src.database import db_connection
+from src.cb_model import build_faiss_index, set_search_params, decode_embedding_blob
+
+# --- COMPARACIÓN DE ÍNDICES ANN CONTRA EL ÍNDICE EXACTO ---
+# Mide recall@k y latencia de cada tipo de índice (y de cada valor de
+# nprobe / efSearch) frente a IndexFlatIP, para elegir la configuración con datos.
+DEFAULT_CONFIGS = [
+    ('flat', {}, [{}]),
+    ('ivf_flat', {}, [{'nprobe': p} for p in (1, 4, 16, 64)]),
+    ('hnsw', {}, [{'ef_search': ef} for ef in (16, 64, 256)]),
+    ('ivf_pq', {}, [{'nprobe': p} for p in (4, 16, 64)]),
+    ('sq8', {}, [{}]),
+    ('sq_fp16', {}, [{}]),
+    ('pq', {}, [{}]),
+]
+
+
+def load_embeddings_from_db() -> np.ndarray:
+    """Lee los embeddings almacenados como BLOB en `destinos`."""
+    with db_connection() as conn:
+        df = pd.read_sql_query("SELECT embedding FROM destinos WHERE embedding IS NOT NULL", conn)
+    if df.empty:
+        raise ValueError("No hay embeddings en la BD. Ejecute primero generate_and_store_embeddings().")
+    return np.vstack([decode_embedding_blob(blob) for blob in df['embedding']])
+
+
+def synthetic_embeddings(n_vectors: int, dimension: int = 384, n_clusters: int = 64, seed: int = 42) -> np.ndarray:
+    """Embeddings sintéticos agrupados (más realistas que ruido uniforme) para probar a escala."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n_vectors)
+    return centers[labels] + 0.5 * rng.standard_normal((n_vectors, dimension)).astype(np.float32)
+
+
+def make_queries(embeddings: np.ndarray, n_queries: int, noise: float = 0.3, seed: int = 7) -> np.ndarray:
+    """Consultas cercanas a vectores del catálogo (como una búsqueda real), normalizadas."""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(embeddings), n_queries)
+    queries = embeddings[picks] + noise * rng.standard_normal((n_queries, embeddings.shape[1])).astype(np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    """Fracción promedio del top-k exacto que recupera el índice aproximado."""
+    k = exact_ids.shape[1]
+    hits = [len(np.intersect1d(a[a >= 0], e)) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits) / k)
+
+
+def _latencies_ms(index, queries: np.ndarray, k: int) -> np.ndarray:
+    """Latencia de consultas individuales (como llegan al API), en milisegundos."""
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        index.search(queries[i:i + 1], k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return latencies
+
+
+def run_benchmark(embeddings: np.ndarray, k: int = 50, n_queries: int = 200, configs: list = None) -> list:
+    """Construye cada configuración y la compara contra la búsqueda exacta."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    queries = make_queries(embeddings, n_queries)
+    k = min(k, len(embeddings))
+
+    exact = faiss.IndexFlatIP(embeddings.shape[1])
+    exact.add(embeddings)
+    _, exact_ids = exact.search(queries, k)
+
+    results = []
+    for index_type, build_params, search_grid in (configs or DEFAULT_CONFIGS):
+        start = time.perf_counter()
+        index = build_faiss_index(embeddings, index_type, **build_params)
+        build_seconds = time.perf_counter() - start
+        index_bytes = len(faiss.serialize_index(index))
+
+        for search_params in search_grid:
+            set_search_params(index, **search_params)
+            start = time.perf_counter()
+            _, approx_ids = index.search(queries, k)
+            batch_seconds = time.perf_counter() - start
+            latencies = _latencies_ms(index, queries, k)
+            results.append({
+                'index_type': index_type,
+                'build_params': build_params,
+                'search_params': search_params,
+                'n_vectors': len(embeddings),
+                'k': k,
+                f'recall@{k}': round(recall_at_k(approx_ids, exact_ids), 4),
+                'latency_p50_ms': round(float(np.percentile(latencies, 50)), 4),
+                'latency_p95_ms': round(float(np.percentile(latencies, 95)), 4),
+                'batch_qps': round(len(queries) / batch_seconds, 1),
+                'build_seconds': round(build_seconds, 3),
+                'index_mb': round(index_bytes / 2**20, 3),
+            })
+    return results
+
+
+def print_results(results: list):
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara índices FAISS (recall@k y latencia) contra el índice exacto.")
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help="Usar N embeddings sintéticos en lugar de los de la BD.")
+    parser.add_argument('--k', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--json', help="Ruta para guardar los resultados en JSON.")
+    args = parser.parse_args()
+
+    embeddings = synthetic_embeddings(args.synthetic) if args.synthetic else load_embeddings_from_db()
+    print(f"--- Benchmark ANN sobre {len(embeddings)} vectores (k={args.k}) ---")
+    results = run_benchmark(embeddings, k=args.k, n_queries=args.queries)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+from src import model_registry
+
+# --- ARTEFACTOS SIN PICKLE, MAPEADOS EN MEMORIA ---
+# Cada artefacto vive en models/<nombre>/<versión>/ con arreglos .npy (o archivos
+# binarios planos, como el índice FAISS) y un manifest.json con la versión y el
+# sha256 de cada archivo. models/<nombre>/CURRENT apunta a la versión vigente.
+# Los .npy se abren con mmap: todos los workers de uvicorn comparten la misma
+# copia en el page cache y la carga no deserializa nada.
+ARTIFACTS_DIR = 'models'
+CURRENT_FILENAME = 'CURRENT'
+MANIFEST_FILENAME = 'manifest.json'
+ARTIFACT_FORMAT = 1
+# Versiones anteriores que se conservan (un worker puede estar abriéndolas)
+ARTIFACT_KEEP_VERSIONS = int(os.environ.get('ARTIFACT_KEEP_VERSIONS', 2))
+# Verificar el sha256 al cargar lee todos los archivos; por defecto solo se
+# comprueban tamaño, dtype y forma contra el manifest.
+ARTIFACT_VERIFY_CHECKSUMS = os.environ.get('ARTIFACT_VERIFY_CHECKSUMS', '0') == '1'
+
+
+def artifact_dir(name: str) -> str:
+    return os.path.join(ARTIFACTS_DIR, name)
+
+
+def current_path(name: str) -> str:
+    """Archivo puntero a la versión vigente (es el que vigila el registro de modelos)."""
+    return os.path.join(artifact_dir(name), CURRENT_FILENAME)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_artifact(name: str, arrays: dict = None, files: dict = None, meta: dict = None) -> str:
+    """
+    Escribe una versión nueva del artefacto y la marca como vigente.
+    `arrays` mapea clave -> arreglo NumPy (se guarda como .npy, sin objetos);
+    `files` mapea nombre de archivo -> función que lo escribe en una ruta dada;
+    `meta` son valores escalares serializables a JSON. Devuelve la versión.
+    """
+    version = time.strftime('%Y%m%dT%H%M%S') + f'-{time.time_ns() % 10**9:09d}-{os.getpid()}'
+    base_dir = artifact_dir(name)
+    tmp_dir = os.path.join(base_dir, f'.tmp-{version}')
+    os.makedirs(tmp_dir)
+
+    manifest = {'name': name, 'version': version, 'format': ARTIFACT_FORMAT,
+                'created_at': time.time(), 'arrays': {}, 'files': {}, 'meta': meta or {}}
+    for key, array in (arrays or {}).items():
+        array = np.ascontiguousarray(array)
+        if array.dtype == object:
+            raise TypeError(f"El arreglo '{key}' es de tipo object y no se puede guardar sin pickle.")
+        filename = f'{key}.npy'
+        np.save(os.path.join(tmp_dir, filename), array, allow_pickle=False)
+        manifest['arrays'][key] = {'file': filename, 'dtype': array.dtype.str, 'shape': list(array.shape),
+                                   'sha256': _sha256(os.path.join(tmp_dir, filename))}
+    for filename, write_fn in (files or {}).items():
+        write_fn(os.path.join(tmp_dir, filename))
+        manifest['files'][filename] = {'file': filename, 'sha256': _sha256(os.path.join(tmp_dir, filename))}
+    with open(os.path.join(tmp_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(tmp_dir, os.path.join(base_dir, version))
+
+    def write_pointer(path):
+        with open(path, 'w') as f:
+            f.write(version)
+
+    model_registry.atomic_write({current_path(name): write_pointer})
+    _prune_versions(name, keep=version)
+    return version
+
+
+def _prune_versions(name: str, keep: str):
+    """Borra las versiones más viejas. Los workers que aún las tengan mapeadas no se ven afectados."""
+    base_dir = artifact_dir(name)
+    versions = sorted(
+        entry for entry in os.listdir(base_dir)
+        if entry != keep and not entry.startswith('.tmp-') and os.path.isfile(os.path.join(base_dir, entry, MANIFEST_FILENAME))
+    )
+    for version in versions[:max(len(versions) - ARTIFACT_KEEP_VERSIONS, 0)]:
+        shutil.rmtree(os.path.join(base_dir, version), ignore_errors=True)
+
+
+def current_version(name: str):
+    """Versión vigente del artefacto, o None si nunca se ha guardado."""
+    try:
+        with open(current_path(name)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_artifact(name: str, verify: bool = None) -> dict:
+    """
+    Abre la versión vigente del artefacto. Devuelve {'arrays', 'files', 'meta',
+    'version'}: los arreglos son memmaps de solo lectura y `files` trae la ruta
+    de cada archivo binario. Lanza FileNotFoundError si el artefacto no existe
+    y ValueError si el contenido no coincide con el manifest.
+    """
+    verify = ARTIFACT_VERIFY_CHECKSUMS if verify is None else verify
+    version = current_version(name)
+    if version is None:
+        raise FileNotFoundError(f"Artefacto '{name}' no encontrado en {artifact_dir(name)}.")
+    version_dir = os.path.join(artifact_dir(name), version)
+    with open(os.path.join(version_dir, MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"Formato de artefacto no soportado en {version_dir}: {manifest.get('format')}")
+
+    def checked_path(entry: dict) -> str:
+        path = os.path.join(version_dir, entry['file'])
+        if verify and _sha256(path) != entry['sha256']:
+            raise ValueError(f"Checksum inválido en {path}.")
+        return path
+
+    arrays = {}
+    for key, entry in manifest['arrays'].items():
+        array = np.load(checked_path(entry), mmap_mode='r', allow_pickle=False)
+        if array.dtype.str != entry['dtype'] or list(array.shape) != entry['shape']:
+            raise ValueError(f"El arreglo '{key}' de {version_dir} no coincide con el manifest.")
+        arrays[key] = array
+    files = {filename: checked_path(entry) for filename, entry in manifest['files'].items()}
+    return {'arrays': arrays, 'files': files, 'meta': manifest['meta'], 'version': version}
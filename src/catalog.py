@@ -0,0 +1,90 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from src.database import db_connection
+from src import model_registry
+from src.geo_index import build_geo_index, query_radius, query_nearest
+
+# --- CATÁLOGO DE DESTINOS EN MEMORIA ---
+# Arreglos columnares alineados por índice denso (posición en `ids`, ordenado
+# por id_destino). Solo cambia cuando corre el ETL, que toca el archivo de
+# versión para que el registro lo recargue en todos los procesos.
+CATALOG_ARTIFACT = 'catalog'
+CATALOG_VERSION_FILE = os.path.join('models', 'catalog.version')
+# Búsquedas "cerca de mí" sin radio: cuántos destinos más cercanos se puntúan
+GEO_NEAREST_K = int(os.environ.get('GEO_NEAREST_K', 300))
+
+
+def load_catalog() -> dict:
+    """Carga `destinos` (sin descripciones ni embeddings) a arreglos NumPy."""
+    with db_connection() as conn:
+        destinos_df = pd.read_sql_query(
+            "SELECT id_destino, city, state, lat, lng FROM destinos ORDER BY id_destino", conn
+        )
+    catalog = {
+        'ids': destinos_df['id_destino'].to_numpy(dtype=np.int64),
+        'city': destinos_df['city'].to_numpy(dtype=object),
+        'state': destinos_df['state'].to_numpy(dtype=object),
+        # DECIMAL llega como Decimal/None desde MySQL
+        'lat': pd.to_numeric(destinos_df['lat'], errors='coerce').to_numpy(dtype=np.float64),
+        'lng': pd.to_numeric(destinos_df['lng'], errors='coerce').to_numpy(dtype=np.float64),
+    }
+    # Índice espacial (src/geo_index.py): se publica junto con el catálogo
+    catalog['geo'] = build_geo_index(catalog['lat'], catalog['lng'])
+    return catalog
+
+
+model_registry.register_artifact(CATALOG_ARTIFACT, load_catalog, [CATALOG_VERSION_FILE])
+
+
+def get_catalog() -> dict:
+    return model_registry.get_artifact(CATALOG_ARTIFACT)
+
+
+def positions_of(catalog: dict, destino_ids) -> tuple:
+    """Mapea id_destino -> índice denso. Devuelve (posiciones, máscara de encontrados)."""
+    destino_ids = np.asarray(destino_ids, dtype=np.int64)
+    ids = catalog['ids']
+    if len(ids) == 0:
+        return np.zeros(len(destino_ids), dtype=np.int64), np.zeros(len(destino_ids), dtype=bool)
+    pos = np.clip(np.searchsorted(ids, destino_ids), 0, len(ids) - 1)
+    return pos, ids[pos] == destino_ids
+
+
+def nearby_positions(catalog: dict, lat: float, lng: float, radius_km: float = None,
+                     k: int = GEO_NEAREST_K) -> np.ndarray:
+    """
+    Posiciones (ordenadas) de los destinos a `radius_km` o menos de (lat, lng);
+    sin radio, las de los `k` más cercanos. Son los candidatos de una
+    recomendación "cerca de mí".
+    """
+    if radius_km is None:
+        return query_nearest(catalog['geo'], lat, lng, k)[0]
+    return query_radius(catalog['geo'], lat, lng, radius_km)[0]
+
+
+def get_metadata_frame(catalog: dict, destino_ids) -> pd.DataFrame:
+    """Equivalente en memoria a `SELECT id_destino, city, state, lat, lng ... WHERE id_destino IN (...)`."""
+    pos, found = positions_of(catalog, destino_ids)
+    pos = np.unique(pos[found])
+    return pd.DataFrame({
+        'id_destino': catalog['ids'][pos],
+        'city': catalog['city'][pos],
+        'state': catalog['state'][pos],
+        'lat': catalog['lat'][pos],
+        'lng': catalog['lng'][pos],
+    })
+
+
+def mark_catalog_changed():
+    """
+    Llamar tras recargar `destinos` (ETL). Actualiza el archivo de versión para
+    que los procesos del API recarguen el catálogo, y lo recarga en este proceso.
+    """
+    def write_version(path):
+        with open(path, 'w') as f:
+            f.write(str(time.time()))
+
+    model_registry.atomic_write({CATALOG_VERSION_FILE: write_version})
+    model_registry.refresh_artifact(CATALOG_ARTIFACT)
@@ -1,64 +1,488 @@
+import asyncio
 import pandas as pd
 import numpy as np
 import os
 import pickle
-from sentence_transformers import SentenceTransformer
-import faiss
-from src.database import get_db_connection
+import argparse
+import json
+import threading
+from src.database import db_connection
+from src import model_registry, artifacts
+from src.catalog import get_catalog, positions_of
+from src.concurrency import run_cpu
+from src import metrics
+from src.lazy_imports import lazy_import
 from mysql.connector import Error
 
+faiss = lazy_import('faiss')
+
 # --- CONFIGURACIÓN DE EMBEDDINGS ---
 EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2' 
-model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+# El SentenceTransformer se construye la primera vez que se usa (o en el warm-up)
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """Modelo de embeddings compartido por el proceso; se carga una sola vez."""
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                from sentence_transformers import SentenceTransformer
+                _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _embedding_model
+
 
 # --- ARCHIVOS DE PERSISTENCIA FAISS (BD Vectorial) ---
+# Los vectores se indexan con id_destino como ID de FAISS. El índice se guarda
+# como artefacto en models/faiss/ (ver src/artifacts.py) y se abre con mmap.
+# `faiss_index.idx` y `dest_ids_map.pkl` (mapeo posicional) solo existen en
+# índices generados por versiones anteriores.
 FAISS_INDEX_FILENAME = 'faiss_index.idx'
 DEST_IDS_FILENAME = 'dest_ids_map.pkl'
 MODEL_DIR = 'models'
+FAISS_ARTIFACT = 'faiss'
+# Abrir el índice con IO_FLAG_MMAP_IFC (FAISS >= 1.8): los códigos de todos los
+# tipos de FAISS_INDEX_TYPES quedan en páginas del archivo, compartidas entre
+# workers por el page cache. IO_FLAG_MMAP solo mapea listas invertidas en disco
+# (OnDiskInvertedLists); con flat/HNSW/SQ/PQ lee todo a memoria privada sin error.
+# Medido con 2 procesos y un IDMap2(FlatIP) de 100k x 384 (147 MiB): PSS de 156 a
+# 84 MiB por proceso, sin páginas privadas. Con FAISS anterior (sin el flag) cada
+# worker tiene su propia copia; solo los .npy de src/artifacts.py se comparten.
+FAISS_MMAP = os.environ.get('FAISS_MMAP', '1') == '1'
+
+# --- MANTENIMIENTO INCREMENTAL ---
+# Hash del contenido con el que se generó cada embedding (modelo + descripción).
+# Se calcula en MySQL para no transferir las descripciones que no cambiaron.
+# La comparación de hashes hace de registro de cambios, en lugar de una columna
+# updated_at o una tabla de cambios: recorre todo `destinos` (O(catálogo)), pero
+# solo viajan id_destino y 64 caracteres por fila, y la parte cara (codificar y
+# tocar el índice FAISS) queda proporcional a lo que cambió. A cambio detecta
+# cualquier vía de escritura (REPLACE, upsert o swap de tablas del ETL, UPDATE
+# manual) sin triggers ni disciplina en los escritores, y nunca marca como
+# cambiada una descripción reescrita con el mismo texto. Si el recorrido llegara
+# a pesar, la columna updated_at serviría para acotarlo, no para sustituirlo.
+CONTENT_HASH_SQL = "SHA2(CONCAT(%s, '|', COALESCE(full_description, '')), 256)"
+# Si cambia más de esta fracción del catálogo, se reconstruye el índice completo
+# (los centroides IVF entrenados con el catálogo anterior pierden calidad).
+INCREMENTAL_REBUILD_FRACTION = float(os.environ.get('FAISS_REBUILD_FRACTION', 0.3))
 
-def generate_and_store_embeddings():
+# --- GENERACIÓN POR BLOQUES ---
+# Las descripciones se leen, codifican y escriben por bloques de EMBEDDING_CHUNK_SIZE
+# filas, así la memoria no crece con el catálogo. El checkpoint permite reanudar
+# una generación completa interrumpida sin volver a codificar lo ya guardado.
+EMBEDDING_CHUNK_SIZE = int(os.environ.get('EMBEDDING_CHUNK_SIZE', 2048))
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+CHECKPOINT_FILENAME = 'embeddings.checkpoint.json'
+
+# --- FORMATO DE LOS EMBEDDINGS EN MYSQL ---
+# float32 (4 bytes por dimensión) o float16 (2 bytes, la mitad del BLOB). Los
+# BLOB float16 terminan en un byte de formato (longitud impar) y los float32 no,
+# así conviven filas de ambos formatos sin columna extra: cambiar la variable
+# solo afecta a los embeddings que se escriban desde entonces.
+EMBEDDING_STORAGE_DTYPES = ('float32', 'float16')
+EMBEDDING_STORAGE_DTYPE = os.environ.get('EMBEDDING_STORAGE_DTYPE', 'float32')
+FLOAT16_BLOB_TAG = b'\x10'
+
+# --- TIPO DE ÍNDICE FAISS ---
+# flat: búsqueda exacta. ivf_flat / hnsw / ivf_pq: búsqueda aproximada (ANN)
+# para catálogos grandes. sq8 / sq_fp16 / pq: búsqueda exhaustiva sobre vectores
+# comprimidos (1 byte o 2 bytes por dimensión, o pq_m bytes por vector).
+# Ver src/ann_benchmark.py (recall, latencia) y src/compression_report.py
+# (memoria frente a concordancia del ranking CB).
+FAISS_INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq', 'sq8', 'sq_fp16', 'pq')
+FAISS_INDEX_TYPE = os.environ.get('FAISS_INDEX_TYPE', 'flat')
+FAISS_INDEX_PARAMS = {
+    'nlist': int(os.environ.get('FAISS_NLIST', 256)),       # listas invertidas (IVF)
+    'hnsw_m': int(os.environ.get('FAISS_HNSW_M', 32)),      # vecinos por nodo (HNSW)
+    'ef_construction': int(os.environ.get('FAISS_EF_CONSTRUCTION', 200)),
+    'pq_m': int(os.environ.get('FAISS_PQ_M', 48)),          # sub-vectores (PQ)
+    'pq_nbits': int(os.environ.get('FAISS_PQ_NBITS', 8)),
+}
+# Parámetros de búsqueda (se aplican en tiempo de ejecución, sin reconstruir)
+FAISS_NPROBE = int(os.environ.get('FAISS_NPROBE', 16))
+FAISS_EF_SEARCH = int(os.environ.get('FAISS_EF_SEARCH', 64))
+# Vectores usados para entrenar los índices IVF al construirlos por bloques
+FAISS_TRAIN_SAMPLE = int(os.environ.get('FAISS_TRAIN_SAMPLE', 50000))
+
+
+def create_faiss_index(dimension: int, n_vectors: int, index_type: str = None, ids: bool = False, **params):
     """
-    1. Genera embeddings de las descripciones de destino.
-    2. Almacena los embeddings como BLOBs en MySQL.
-    3. Construye y guarda el índice FAISS (BD Vectorial).
+    Crea un índice FAISS de producto interno vacío (sin entrenar). Los parámetros
+    se ajustan a `n_vectors`: p. ej. nlist nunca supera el número de vectores.
+    Con `ids=True` el índice devuelve id_destino en lugar de posiciones: los IVF
+    los guardan de forma nativa y flat/hnsw se envuelven en IndexIDMap2.
     """
-    conn = None
-    try:
-        conn = get_db_connection()
-        destinos_df = pd.read_sql_query("SELECT id_destino, full_description FROM destinos", conn)
-        
-        if destinos_df.empty:
-            print("Error: No se encontraron destinos en la base de datos para generar embeddings.")
+    index_type = index_type or FAISS_INDEX_TYPE
+    if index_type not in FAISS_INDEX_TYPES:
+        raise ValueError(f"Tipo de índice FAISS desconocido: '{index_type}'. Opciones: {FAISS_INDEX_TYPES}")
+    params = {**FAISS_INDEX_PARAMS, **params}
+    # FAISS recomienda ~39 puntos de entrenamiento por centroide
+    nlist = max(1, min(params['nlist'], n_vectors // 39 or 1))
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatIP(dimension)
+    elif index_type == 'ivf_flat':
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, params['hnsw_m'], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = params['ef_construction']
+    elif index_type in ('sq8', 'sq_fp16'):
+        qtype = faiss.ScalarQuantizer.QT_8bit if index_type == 'sq8' else faiss.ScalarQuantizer.QT_fp16
+        index = faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+    else:
+        pq_m = params['pq_m']
+        if dimension % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} debe dividir la dimensión {dimension}.")
+        # Cada sub-cuantizador necesita al menos 2^nbits puntos de entrenamiento
+        pq_nbits = max(1, min(params['pq_nbits'], int(np.log2(max(n_vectors, 2)))))
+        if index_type == 'pq':
+            index = faiss.IndexPQ(dimension, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        else:
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+
+    if ids and not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap2(index)
+    return index
+
+
+def build_faiss_index(embeddings: np.ndarray, index_type: str = None, ids=None, **params):
+    """
+    Construye (y entrena, si aplica) un índice FAISS sobre `embeddings` ya
+    normalizados. Con `ids` (id_destino) las búsquedas devuelven esos IDs.
+    """
+    index = create_faiss_index(embeddings.shape[1], len(embeddings), index_type, ids=ids is not None, **params)
+    if not index.is_trained:
+        index.train(embeddings)
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+    set_search_params(index)
+    return index
+
+
+class StreamingIndexBuilder:
+    """
+    Construye un índice con IDs a medida que llegan bloques de embeddings.
+    Flat/HNSW agregan cada bloque de inmediato; los IVF acumulan hasta
+    FAISS_TRAIN_SAMPLE vectores, entrenan con ellos y después agregan directo.
+    """
+
+    def __init__(self, n_vectors: int, index_type: str = None, train_sample: int = FAISS_TRAIN_SAMPLE, **params):
+        self.n_vectors = n_vectors
+        self.index_type = index_type
+        self.train_sample = min(train_sample, max(n_vectors, 1))
+        self.params = params
+        self.index = None
+        self._pending = []   # (ids, embeddings) en espera del entrenamiento
+        self._pending_count = 0
+
+    def add(self, ids: np.ndarray, embeddings: np.ndarray):
+        if len(ids) == 0:
+            return
+        if self.index is None:
+            self.index = create_faiss_index(
+                embeddings.shape[1], self.n_vectors, self.index_type, ids=True, **self.params
+            )
+        if self.index.is_trained:
+            self.index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
             return
+        self._pending.append((np.asarray(ids, dtype=np.int64), embeddings))
+        self._pending_count += len(ids)
+        if self._pending_count >= self.train_sample:
+            self._train_and_flush()
 
-        print(f"Generando embeddings para {len(destinos_df)} destinos usando {EMBEDDING_MODEL_NAME}...")
-        
-        descriptions = destinos_df['full_description'].tolist()
-        embeddings = model.encode(descriptions, convert_to_numpy=True)
-        embeddings = embeddings.astype('float32')
+    def _train_and_flush(self):
+        embeddings = np.vstack([block for _, block in self._pending])
+        ids = np.concatenate([block_ids for block_ids, _ in self._pending])
+        self._pending, self._pending_count = [], 0
+        self.index.train(embeddings)
+        self.index.add_with_ids(embeddings, ids)
 
-        cursor = conn.cursor()
-        
-        for index, row in destinos_df.iterrows():
-            embedding_blob = embeddings[index].tobytes()
-            cursor.execute(
-                "UPDATE destinos SET embedding = %s WHERE id_destino = %s",
-                (embedding_blob, row['id_destino'])
+    def finish(self):
+        """Entrena con lo acumulado (catálogos pequeños) y devuelve el índice listo."""
+        if self._pending:
+            self._train_and_flush()
+        if self.index is not None:
+            set_search_params(self.index)
+        return self.index
+
+
+def _base_index(index):
+    """Índice subyacente (sin envoltorios como IndexIDMap) con su clase concreta."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Ajusta nprobe (IVF) y efSearch (HNSW) del índice en caliente."""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(nprobe or FAISS_NPROBE, base.nlist)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search or FAISS_EF_SEARCH
+
+
+def index_type_of(index) -> str:
+    """Tipo de índice (uno de FAISS_INDEX_TYPES) de un índice FAISS."""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return 'sq8' if base.sq.qtype == faiss.ScalarQuantizer.QT_8bit else 'sq_fp16'
+    for cls, name in ((faiss.IndexIVFPQ, 'ivf_pq'), (faiss.IndexIVFFlat, 'ivf_flat'),
+                      (faiss.IndexHNSW, 'hnsw'), (faiss.IndexFlat, 'flat'), (faiss.IndexPQ, 'pq')):
+        if isinstance(base, cls):
+            return name
+    return type(base).__name__
+
+
+def is_id_mapped(index) -> bool:
+    """True si el índice devuelve id_destino (formato actual) y no posiciones."""
+    index = faiss.downcast_index(index)
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexIVF))
+
+
+def get_index_ids(index) -> np.ndarray:
+    """IDs (id_destino) presentes en un índice con IDs, ordenados."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return np.sort(faiss.vector_to_array(index.id_map).astype(np.int64))
+    invlists = index.invlists
+    parts = [
+        faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+        for list_no in range(index.nlist) if invlists.list_size(list_no) > 0
+    ]
+    return np.sort(np.concatenate(parts).astype(np.int64)) if parts else np.empty(0, dtype=np.int64)
+
+
+def _save_faiss_index(index):
+    """Guarda el índice como nueva versión del artefacto y lo publica en el registro de este proceso."""
+    artifacts.save_artifact(
+        FAISS_ARTIFACT,
+        files={FAISS_INDEX_FILENAME: lambda path: faiss.write_index(index, path)},
+        meta={'index_type': index_type_of(index), 'ntotal': int(index.ntotal), 'dimension': int(index.d)},
+    )
+    for legacy_file in (FAISS_INDEX_FILENAME, DEST_IDS_FILENAME):
+        legacy_path = os.path.join(MODEL_DIR, legacy_file)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+    model_registry.publish_artifact(FAISS_ARTIFACT, load_faiss_index())
+
+
+def _stored_index_path():
+    """Ruta del índice vigente en disco (artefacto o archivo anterior), o None."""
+    try:
+        return artifacts.load_artifact(FAISS_ARTIFACT)['files'][FAISS_INDEX_FILENAME]
+    except FileNotFoundError:
+        legacy_path = os.path.join(MODEL_DIR, FAISS_INDEX_FILENAME)
+        return legacy_path if os.path.exists(legacy_path) else None
+
+
+def _read_index_mmap(path: str):
+    """
+    Lee el índice con IO_FLAG_MMAP_IFC (páginas de solo lectura compartidas entre
+    workers). Si la versión de FAISS no tiene el flag, lo lee a memoria privada.
+    El índice queda de solo lectura: no se le agregan ni quitan vectores en sitio.
+    """
+    if FAISS_MMAP and hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    return faiss.read_index(path)
+
+
+# --- CHECKPOINT DE GENERACIÓN ---
+
+def _checkpoint_path() -> str:
+    return os.path.join(MODEL_DIR, CHECKPOINT_FILENAME)
+
+
+def _read_checkpoint(mode: str):
+    """Checkpoint de una generación `mode` interrumpida con el mismo modelo, o None."""
+    try:
+        with open(_checkpoint_path()) as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if checkpoint.get('mode') != mode or checkpoint.get('embedding_model') != EMBEDDING_MODEL_NAME:
+        return None
+    return checkpoint
+
+
+def _write_checkpoint(mode: str, **state):
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump({'mode': mode, 'embedding_model': EMBEDDING_MODEL_NAME, **state}, f)
+
+    model_registry.atomic_write({_checkpoint_path(): write})
+
+
+def _clear_checkpoint():
+    if os.path.exists(_checkpoint_path()):
+        os.remove(_checkpoint_path())
+
+
+# --- LECTURA, CODIFICACIÓN Y ESCRITURA POR BLOQUES ---
+
+def _iter_destino_chunks(conn, columns_sql: str, params: tuple = (), destino_ids=None,
+                         after_id: int = None, up_to_id: int = None, chunk_size: int = None):
+    """
+    Lee `destinos` por bloques. Sin `destino_ids` usa paginación por llave
+    (id_destino > último visto), que no se degrada como OFFSET; con
+    `destino_ids` recorre esa lista por bloques.
+    """
+    chunk_size = chunk_size or EMBEDDING_CHUNK_SIZE
+    if destino_ids is not None:
+        destino_ids = [int(i) for i in destino_ids]
+        for start in range(0, len(destino_ids), chunk_size):
+            chunk_ids = destino_ids[start:start + chunk_size]
+            placeholders = ', '.join(['%s'] * len(chunk_ids))
+            yield pd.read_sql_query(
+                f"SELECT {columns_sql} FROM destinos WHERE id_destino IN ({placeholders}) ORDER BY id_destino",
+                conn, params=(*params, *chunk_ids)
             )
-        conn.commit()
-        
-        dimension = embeddings.shape[1]
-        faiss.normalize_L2(embeddings) 
-        index = faiss.IndexFlatIP(dimension) 
-        index.add(embeddings)
-        
-        os.makedirs(MODEL_DIR, exist_ok=True)
-        faiss.write_index(index, os.path.join(MODEL_DIR, FAISS_INDEX_FILENAME))
+        return
+
+    last_id = after_id
+    while True:
+        conditions, bounds = [], []
+        if last_id is not None:
+            conditions.append("id_destino > %s")
+            bounds.append(last_id)
+        if up_to_id is not None:
+            conditions.append("id_destino <= %s")
+            bounds.append(up_to_id)
+        where_sql = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        chunk_df = pd.read_sql_query(
+            f"SELECT {columns_sql} FROM destinos {where_sql}ORDER BY id_destino LIMIT %s",
+            conn, params=(*params, *bounds, chunk_size)
+        )
+        if chunk_df.empty:
+            return
+        yield chunk_df
+        last_id = int(chunk_df['id_destino'].iloc[-1])
+
+
+def _iter_encoded_chunks(conn, destino_ids=None, after_id: int = None):
+    """
+    Codifica por bloques las descripciones (todas, las posteriores a `after_id`
+    o solo `destino_ids`) y guarda cada bloque en la BD antes de devolverlo.
+    Produce (ids, embeddings sin normalizar).
+    """
+    columns_sql = (
+        f"id_destino, COALESCE(full_description, '') AS full_description, {CONTENT_HASH_SQL} AS content_hash"
+    )
+    for chunk_df in _iter_destino_chunks(conn, columns_sql, (EMBEDDING_MODEL_NAME,), destino_ids, after_id):
+        embeddings = get_embedding_model().encode(
+            chunk_df['full_description'].tolist(), convert_to_numpy=True, batch_size=EMBEDDING_BATCH_SIZE
+        ).astype('float32')
+        ids = chunk_df['id_destino'].to_numpy(dtype=np.int64)
+        store_embeddings_bulk(conn, ids, embeddings, chunk_df['content_hash'].tolist())
+        yield ids, embeddings
+
+
+def _iter_stored_chunks(conn, destino_ids=None, up_to_id: int = None):
+    """Lee de la BD los embeddings vigentes (sin volver a codificar). Produce (ids, embeddings)."""
+    if destino_ids is not None and len(destino_ids) == 0:
+        return
+    for chunk_df in _iter_destino_chunks(conn, "id_destino, embedding", destino_ids=destino_ids, up_to_id=up_to_id):
+        embeddings = np.vstack([decode_embedding_blob(blob) for blob in chunk_df['embedding']])
+        yield chunk_df['id_destino'].to_numpy(dtype=np.int64), embeddings
+
+
+def encode_embedding_blob(embedding: np.ndarray, dtype: str = None) -> bytes:
+    """Serializa un embedding para `destinos.embedding` en el formato configurado."""
+    dtype = dtype or EMBEDDING_STORAGE_DTYPE
+    if dtype not in EMBEDDING_STORAGE_DTYPES:
+        raise ValueError(f"Formato de embedding desconocido: '{dtype}'. Opciones: {EMBEDDING_STORAGE_DTYPES}")
+    if dtype == 'float16':
+        return np.asarray(embedding, dtype=np.float16).tobytes() + FLOAT16_BLOB_TAG
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def decode_embedding_blob(blob: bytes) -> np.ndarray:
+    """Lee un BLOB de `destinos.embedding` (float32 o float16) como float32."""
+    if len(blob) % 2 == 1:
+        return np.frombuffer(blob, dtype=np.float16, count=(len(blob) - 1) // 2).astype(np.float32)
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def store_embeddings_bulk(conn, destino_ids, embeddings: np.ndarray, content_hashes: list):
+    """
+    Escribe un bloque de embeddings con una tabla temporal y un solo UPDATE ... JOIN
+    (el INSERT multi-fila lo arma `executemany`), en lugar de un UPDATE por fila.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_embeddings")
+    cursor.execute(
+        "CREATE TEMPORARY TABLE tmp_embeddings ("
+        " id_destino INT PRIMARY KEY, embedding BLOB, embedding_hash CHAR(64))"
+    )
+    cursor.executemany(
+        "INSERT INTO tmp_embeddings (id_destino, embedding, embedding_hash) VALUES (%s, %s, %s)",
+        [(int(destino_id), encode_embedding_blob(embedding), content_hash)
+         for destino_id, embedding, content_hash in zip(destino_ids, embeddings, content_hashes)]
+    )
+    cursor.execute(
+        "UPDATE destinos d JOIN tmp_embeddings t ON d.id_destino = t.id_destino "
+        "SET d.embedding = t.embedding, d.embedding_hash = t.embedding_hash"
+    )
+    cursor.execute("DROP TEMPORARY TABLE tmp_embeddings")
+    conn.commit()
+
+
+def _normalized(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def generate_and_store_embeddings(resume: bool = True):
+    """
+    Reconstrucción completa, por bloques de EMBEDDING_CHUNK_SIZE destinos:
+    1. Genera los embeddings de cada bloque de descripciones.
+    2. Los almacena (con su hash de contenido) como BLOBs en MySQL, en bloque.
+    3. Los agrega al índice FAISS (BD Vectorial), con id_destino como ID.
+    Si una ejecución anterior se interrumpió, los bloques ya guardados se leen
+    de la BD en lugar de volver a codificarse (`resume=False` lo desactiva).
+    Para refrescos tras cambios puntuales usar `update_embeddings_incremental()`.
+    """
+    checkpoint = _read_checkpoint('full') if resume else None
+    resume_after = checkpoint['last_id'] if checkpoint else None
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM destinos")
+            n_destinos = cursor.fetchone()[0]
         
-        with open(os.path.join(MODEL_DIR, DEST_IDS_FILENAME), 'wb') as f:
-            pickle.dump(destinos_df['id_destino'].tolist(), f)
+            if not n_destinos:
+                print("Error: No se encontraron destinos en la base de datos para generar embeddings.")
+                return
+
+            builder = StreamingIndexBuilder(n_destinos)
+            done = 0
+            if resume_after is not None:
+                print(f"Reanudando generación interrumpida: destinos hasta id_destino={resume_after} ya codificados.")
+                for ids, embeddings in _iter_stored_chunks(conn, up_to_id=resume_after):
+                    builder.add(ids, _normalized(embeddings))
+                    done += len(ids)
+
+            print(f"Generando embeddings para {n_destinos - done} destinos usando {EMBEDDING_MODEL_NAME}...")
+            for ids, embeddings in _iter_encoded_chunks(conn, after_id=resume_after):
+                _write_checkpoint('full', last_id=int(ids[-1]))
+                builder.add(ids, _normalized(embeddings))
+                done += len(ids)
+                print(f"  {done}/{n_destinos} destinos procesados.")
+
+            index = builder.finish()
+            print(f"Índice FAISS '{FAISS_INDEX_TYPE}' construido con {index.ntotal} vectores.")
+            _save_faiss_index(index)
+            _clear_checkpoint()
             
-        print("Embeddings y Índice FAISS (BD Vectorial) construidos y guardados.")
+            print("Embeddings y Índice FAISS (BD Vectorial) construidos y guardados.")
 
     except Error as e:
         print(f"Error de MySQL en generate_and_store_embeddings: {e}")
@@ -66,57 +490,344 @@ def generate_and_store_embeddings():
     except Exception as e:
         print(f"Error general en generate_and_store_embeddings: {e}")
         raise e
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
+
+
+def compute_embedding_changes(conn, index) -> dict:
+    """
+    Registro de cambios entre la BD y el índice, a partir de los hashes de
+    contenido (un recorrido de id_destino + hash; ver CONTENT_HASH_SQL):
+    - added: destinos que no están en el índice.
+    - updated: destinos indexados cuya descripción (o modelo) cambió. Incluye los
+      que una actualización interrumpida ya guardó en la BD pero no en el índice.
+    - removed: IDs del índice que ya no existen en `destinos`.
+    - to_encode: destinos que hay que volver a codificar (sin embedding vigente).
+    """
+    hashes_df = pd.read_sql_query(
+        f"SELECT id_destino, {CONTENT_HASH_SQL} AS content_hash, embedding_hash FROM destinos",
+        conn, params=(EMBEDDING_MODEL_NAME,)
+    )
+    db_ids = hashes_df['id_destino'].to_numpy(dtype=np.int64)
+    index_ids = get_index_ids(index)
+    stale = (hashes_df['embedding_hash'] != hashes_df['content_hash']).to_numpy()
+    checkpoint = _read_checkpoint('incremental')
+    if checkpoint:
+        stale_in_index = stale | np.isin(db_ids, checkpoint['refresh_ids'])
+    else:
+        stale_in_index = stale
+    in_index = np.isin(db_ids, index_ids)
+    return {
+        'added': db_ids[~in_index],
+        'updated': db_ids[stale_in_index & in_index],
+        'removed': np.setdiff1d(index_ids, db_ids),
+        'to_encode': db_ids[stale],
+        'total': len(db_ids),
+    }
+
+
+def update_embeddings_incremental() -> dict:
+    """
+    Actualiza embeddings e índice FAISS solo para los destinos que cambiaron:
+    re-codifica descripciones nuevas o modificadas, reutiliza los BLOBs vigentes
+    y quita/agrega vectores en el índice por id_destino. Hace una reconstrucción
+    completa si no hay índice compatible o si el cambio es demasiado grande.
+    """
+    index_path = _stored_index_path()
+    try:
+        # Copia propia del índice (sin mmap): el que sirve el API no se modifica en sitio
+        index = faiss.read_index(index_path) if index_path else None
+    except RuntimeError:
+        index = None
+    if (index is None or not is_id_mapped(index)
+            or index_type_of(index) != FAISS_INDEX_TYPE or _read_checkpoint('full')):
+        print("ATENCIÓN: No hay un índice FAISS compatible con IDs; se hace reconstrucción completa.")
+        generate_and_store_embeddings()
+        return None
+
+    try:
+        with db_connection() as conn:
+            changes = compute_embedding_changes(conn, index)
+            print(
+                f"Cambios detectados: {len(changes['added'])} nuevos, {len(changes['updated'])} modificados, "
+                f"{len(changes['removed'])} eliminados ({len(changes['to_encode'])} por codificar)."
+            )
+            to_remove = np.concatenate([changes['updated'], changes['removed']])
+            to_add = np.union1d(changes['added'], changes['updated'])
+            n_changed = len(changes['added']) + len(to_remove)
+            if n_changed == 0:
+                print("El índice FAISS ya está al día.")
+                return changes
+
+            # IndexHNSW no admite borrado de vectores
+            must_rebuild = index_type_of(index) == 'hnsw' and len(to_remove) > 0
+            if must_rebuild or n_changed > INCREMENTAL_REBUILD_FRACTION * max(changes['total'], 1):
+                print("El cambio no se puede aplicar en sitio (HNSW o demasiados destinos); "
+                      "se hace reconstrucción completa.")
+                generate_and_store_embeddings(resume=False)
+                return changes
+
+            # Si el proceso se interrumpe, estos destinos se vuelven a agregar aunque
+            # su hash en la BD ya esté al día
+            _write_checkpoint('incremental', refresh_ids=[int(i) for i in to_add])
+            if len(to_remove):
+                index.remove_ids(to_remove)
+            for ids, embeddings in _iter_encoded_chunks(conn, destino_ids=changes['to_encode']):
+                index.add_with_ids(_normalized(embeddings), ids)
+            for ids, embeddings in _iter_stored_chunks(conn, destino_ids=np.setdiff1d(to_add, changes['to_encode'])):
+                index.add_with_ids(_normalized(embeddings), ids)
+    except Error as e:
+        print(f"Error de MySQL en update_embeddings_incremental: {e}")
+        raise e
+
+    set_search_params(index)
+    _save_faiss_index(index)
+    _clear_checkpoint()
+    print(f"Índice FAISS actualizado: {index.ntotal} vectores.")
+    return changes
+
+
+def _migrate_legacy_index(index, dest_ids_map: list):
+    """Convierte en memoria un índice posicional (con dest_ids_map.pkl) a uno con IDs."""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.make_direct_map()
+    embeddings = index.reconstruct_n(0, index.ntotal)
+    return build_faiss_index(embeddings, index_type_of(index), ids=dest_ids_map)
 
 
 def load_faiss_index():
-    """Carga el índice FAISS y el mapeo de IDs."""
+    """Carga el índice FAISS con mmap si FAISS lo admite (los resultados de búsqueda son id_destino)."""
+    index_path = _stored_index_path()
     try:
-        index = faiss.read_index(os.path.join(MODEL_DIR, FAISS_INDEX_FILENAME))
+        index = _read_index_mmap(index_path) if index_path else None
+    except RuntimeError:
+        index = None
+    if index is None:
+        raise FileNotFoundError(f"Índice FAISS no encontrado en {MODEL_DIR}. Por favor, ejecute la generación.") 
+
+    if not is_id_mapped(index):
         with open(os.path.join(MODEL_DIR, DEST_IDS_FILENAME), 'rb') as f:
             dest_ids_map = pickle.load(f)
-        return index, dest_ids_map
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Índice FAISS no encontrado en {MODEL_DIR}. Por favor, ejecute la generación.") 
+        print("ATENCIÓN: Índice FAISS en formato posicional; se convierte en memoria. "
+              "Ejecute la generación de embeddings para actualizarlo en disco.")
+        index = _migrate_legacy_index(index, dest_ids_map)
+    set_search_params(index)
+    return index
 
 
-def get_cb_scores(query_expanded_text: str, top_k: int = 50) -> pd.DataFrame:
+model_registry.register_artifact(
+    FAISS_ARTIFACT,
+    load_faiss_index,
+    [artifacts.current_path(FAISS_ARTIFACT)]
+)
+
+
+def configure_faiss_search(nprobe: int = None, ef_search: int = None):
     """
-    Calcula los scores de similitud (CB) usando el índice FAISS (BD Vectorial).
+    Cambia nprobe/efSearch del índice servido sin reconstruirlo. Los nuevos
+    valores también se aplican a las versiones que cargue el watcher.
     """
-    index, dest_ids_map = load_faiss_index()
-    
-    query_embedding = model.encode(query_expanded_text, convert_to_numpy=True).astype('float32')
-    faiss.normalize_L2(query_embedding.reshape(1, -1))
+    global FAISS_NPROBE, FAISS_EF_SEARCH
+    FAISS_NPROBE = nprobe or FAISS_NPROBE
+    FAISS_EF_SEARCH = ef_search or FAISS_EF_SEARCH
+    set_search_params(model_registry.get_artifact(FAISS_ARTIFACT))
 
-    D, I = index.search(query_embedding.reshape(1, -1), top_k) 
 
-    similarities = D.flatten() 
-    recommended_ids = [dest_ids_map[i] for i in I.flatten()]
-    
+def _normalize_similarities(similarities: np.ndarray) -> np.ndarray:
+    """Normaliza las similitudes de una consulta a la escala 1-5 (sin Inf/NaN)."""
+    if len(similarities) == 0:
+        return similarities.astype(np.float64)
+
     min_score = similarities.min()
     max_score = similarities.max()
     
     normalized_scores = 1 + 4 * (similarities - min_score) / (max_score - min_score + 1e-6)
-
-    cb_scores_df = pd.DataFrame({
-        'id_destino': recommended_ids,
-        'score_contenido': normalized_scores
-    })
-    
-    # CORRECCIÓN FINAL: Limpiar el DataFrame de salida de Inf/NaN
-    cb_scores_df.replace([np.inf, -np.inf, np.nan], 3.0, inplace=True)
     
-    return cb_scores_df.set_index('id_destino')
+    # CORRECCIÓN FINAL: Limpiar la salida de Inf/NaN
+    return np.where(np.isfinite(normalized_scores), normalized_scores, 3.0).astype(np.float64)
+
+
+def _subset_search_params(base, selector):
+    """Parámetros de búsqueda con `selector` del tipo que exige cada índice FAISS."""
+    if isinstance(base, faiss.IndexIVF):
+        # Los destinos del subconjunto pueden estar en cualquier lista: se revisan todas
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nlist)
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_subset(index, query_embeddings: np.ndarray, subset_ids: np.ndarray, k: int) -> tuple:
+    """
+    `index.search` restringido a los id_destino de `subset_ids`: solo se calcula
+    la similitud de esos vectores (IDSelector). En HNSW el grafo pierde recall
+    con filtros muy selectivos e IndexPQ no admite selectores, así que ahí se
+    reconstruyen los vectores del subconjunto y se comparan de forma exhaustiva
+    (en PQ es el mismo producto con el vector decodificado). Devuelve (D, I)
+    como `search`.
+    """
+    subset_ids = np.ascontiguousarray(subset_ids, dtype=np.int64)
+    base = _base_index(index)
+    if not isinstance(base, (faiss.IndexHNSW, faiss.IndexPQ)):
+        params = _subset_search_params(base, faiss.IDSelectorBatch(subset_ids))
+        return index.search(query_embeddings, k, params=params)
+
+    try:
+        vectors = index.reconstruct_batch(subset_ids)
+    except RuntimeError:
+        # Algún destino del catálogo aún no está en el índice: se omiten
+        present = []
+        for destino_id in subset_ids.tolist():
+            try:
+                present.append((destino_id, index.reconstruct(destino_id)))
+            except RuntimeError:
+                pass
+        subset_ids = np.array([destino_id for destino_id, _ in present], dtype=np.int64)
+        vectors = np.vstack([vector for _, vector in present]) if present else np.zeros((0, index.d), dtype=np.float32)
+    D = np.full((len(query_embeddings), k), -np.inf, dtype=np.float32)
+    I = np.full((len(query_embeddings), k), -1, dtype=np.int64)
+    found = min(k, len(subset_ids))
+    if found:
+        similarities = query_embeddings @ vectors.T
+        top = np.argsort(-similarities, axis=1, kind='stable')[:, :found]
+        D[:, :found] = np.take_along_axis(similarities, top, axis=1)
+        I[:, :found] = subset_ids[top]
+    return D, I
+
+
+def get_cb_score_arrays_batch(query_texts: list, top_k=50, index=None, positions=None) -> list:
+    """
+    Calcula los scores CB de varias consultas con un solo `encode` y un solo
+    `index.search`. `top_k` puede ser un entero o una lista (uno por consulta);
+    se busca con el máximo y cada resultado se recorta a su propio k.
+    `index` permite usar otro índice en lugar del publicado (comparaciones).
+    `positions` (una por consulta, o None) restringe la búsqueda de esa consulta
+    a esas posiciones del catálogo (p. ej. destinos cercanos); esas consultas se
+    buscan por separado con `search_subset`.
+    Devuelve, por consulta, (posiciones en el catálogo, scores normalizados 1-5).
+    """
+    if index is None:
+        index = model_registry.get_artifact(FAISS_ARTIFACT)
+    top_ks = list(top_k) if isinstance(top_k, (list, tuple)) else [top_k] * len(query_texts)
+    positions = list(positions) if positions is not None else [None] * len(query_texts)
+
+    with metrics.span('query_encode'):
+        query_embeddings = get_embedding_model().encode(
+            list(query_texts), convert_to_numpy=True, batch_size=max(len(query_texts), 1)
+        ).astype('float32')
+        faiss.normalize_L2(query_embeddings)
+    catalog = get_catalog()
+
+    D = np.full((len(query_texts), max(top_ks, default=0)), -np.inf, dtype=np.float32)
+    I = np.full(D.shape, -1, dtype=np.int64)
+    with metrics.span('faiss_search'):
+        unrestricted = [i for i, subset in enumerate(positions) if subset is None]
+        if unrestricted:
+            D[unrestricted], I[unrestricted] = index.search(query_embeddings[unrestricted], max(top_ks))
+        for i, subset in enumerate(positions):
+            if subset is not None and len(subset) and top_ks[i] > 0:
+                k = min(top_ks[i], len(subset))
+                subset_D, subset_I = search_subset(index, query_embeddings[i:i + 1], catalog['ids'][subset], k)
+                D[i, :k], I[i, :k] = subset_D[0], subset_I[0]
+
+    results = []
+    for similarities, recommended_ids, k in zip(D, I, top_ks):
+        # FAISS devuelve -1 cuando hay menos de k vectores en el índice
+        valid = recommended_ids[:k] >= 0
+        similarities = similarities[:k][valid]
+        recommended_ids = recommended_ids[:k][valid]
+        # Destinos eliminados del catálogo desde que se construyó el índice
+        catalog_pos, in_catalog = positions_of(catalog, recommended_ids)
+        results.append((catalog_pos[in_catalog], _normalize_similarities(similarities[in_catalog])))
+    return results
+
+
+def get_cb_scores_batch(query_texts: list, top_k=50) -> list:
+    """Igual que `get_cb_score_arrays_batch`, pero con un DataFrame (id_destino -> score_contenido) por consulta."""
+    catalog_ids = get_catalog()['ids']
+    return [
+        pd.DataFrame({'id_destino': catalog_ids[positions], 'score_contenido': scores}).set_index('id_destino')
+        for positions, scores in get_cb_score_arrays_batch(query_texts, top_k)
+    ]
+
+
+def get_cb_scores(query_expanded_text: str, top_k: int = 50) -> pd.DataFrame:
+    """
+    Calcula los scores de similitud (CB) usando el índice FAISS (BD Vectorial).
+    """
+    return get_cb_scores_batch([query_expanded_text], top_k)[0]
+
+
+# --- MICRO-BATCHING DE CONSULTAS CB ---
+# Las consultas concurrentes del API se agrupan durante una ventana corta (o hasta
+# llenar el lote) y se resuelven con un solo encode + search.
+CB_BATCH_WINDOW_SECONDS = float(os.environ.get('CB_BATCH_WINDOW_MS', 5)) / 1000
+CB_MAX_BATCH_SIZE = int(os.environ.get('CB_MAX_BATCH_SIZE', 32))
+
+
+class CBBatcher:
+    """Agrupa llamadas asíncronas de scoring CB y reparte los resultados a cada llamador."""
+
+    def __init__(self, window: float = CB_BATCH_WINDOW_SECONDS, max_batch_size: int = CB_MAX_BATCH_SIZE):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = []   # (texto, top_k, posiciones o None, future)
+        self._timer = None
+        self._tasks = set()
+
+    async def get_cb_score_arrays(self, query_expanded_text: str, top_k: int = 50, positions=None) -> tuple:
+        """Equivalente asíncrono de `get_cb_score_arrays_batch([texto], positions=[positions])[0]`."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query_expanded_text, top_k, positions, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list):
+        # El lote es de varias peticiones: encode/search van solo a los histogramas,
+        # no a la traza de la petición que disparó el flush
+        metrics.clear_trace()
+        texts = [text for text, _, _, _ in batch]
+        top_ks = [top_k for _, top_k, _, _ in batch]
+        positions = [subset for _, _, subset, _ in batch]
+        try:
+            results = await run_cpu(get_cb_score_arrays_batch, texts, top_ks, None, positions)
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+cb_batcher = CBBatcher()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genera embeddings y el índice FAISS de destinos.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Solo re-codifica destinos nuevos o modificados y actualiza el índice en sitio.")
+    args = parser.parse_args()
     test_query_expanded = "cultura, historia, pirámides, arquitectura prehispánica"
     
     print("--- INICIANDO GENERACIÓN DE EMBEDDINGS Y FAISS ---")
     try:
-        generate_and_store_embeddings() 
+        if args.incremental:
+            update_embeddings_incremental()
+        else:
+            generate_and_store_embeddings() 
         print("--- GENERACIÓN DE EMBEDDINGS COMPLETADA ---")
     except Exception as e:
         print(f"\nERROR CRÍTICO DURANTE LA GENERACIÓN DE EMBEDDINGS. Causa: {e}")
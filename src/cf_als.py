@@ -0,0 +1,178 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# --- MOTOR CF ALTERNATIVO: ALS CON SESGOS SOBRE MATRIZ DISPERSA ---
+# Mínimos cuadrados alternados: con los destinos fijos, cada usuario es un
+# problema ridge independiente (y viceversa). Las filas se agrupan en bloques
+# de tamaño parecido y cada bloque se resuelve con operaciones apiladas
+# (matmul y np.linalg.solve sobre (n, k, k)), sin bucle de Python por fila, así
+# los hilos pasan el tiempo en BLAS/LAPACK y no compiten por el GIL.
+# Minimiza el mismo objetivo que el SVD de Surprise:
+#   sum (r - media - bu - bi - pu·qi)^2 + reg * (bu^2 + bi^2 + |pu|^2 + |qi|^2)
+# (regularización por valoración) y produce los mismos arreglos de factores.
+ALS_FACTORS = int(os.environ.get('CF_ALS_FACTORS', 100))
+ALS_REG = float(os.environ.get('CF_ALS_REG', 0.1))
+ALS_MAX_ITERATIONS = int(os.environ.get('CF_ALS_MAX_ITERATIONS', 15))
+ALS_HOLDOUT_FRACTION = float(os.environ.get('CF_ALS_HOLDOUT', 0.05))
+ALS_PATIENCE = int(os.environ.get('CF_ALS_PATIENCE', 2))
+ALS_THREADS = int(os.environ.get('CF_ALS_THREADS', os.cpu_count() or 2))
+# Tope de elementos float64 por bloque (factores rellenados + matrices k x k)
+ALS_BLOCK_ELEMENTS = int(os.environ.get('CF_ALS_BLOCK_ELEMENTS', 4_000_000))
+
+
+def build_ratings_matrix(ratings_df: pd.DataFrame) -> tuple:
+    """
+    Matriz CSR (usuarios x destinos) con las puntuaciones, más los IDs crudos de
+    cada fila y columna (ordenados, para mapearlos con searchsorted).
+    """
+    user_ids, user_idx = np.unique(ratings_df['id_usuario'].to_numpy(dtype=np.int64), return_inverse=True)
+    item_ids, item_idx = np.unique(ratings_df['id_destino'].to_numpy(dtype=np.int64), return_inverse=True)
+    ratings = ratings_df['puntuacion'].to_numpy(dtype=np.float64)
+    matrix = sparse.csr_matrix((ratings, (user_idx, item_idx)), shape=(len(user_ids), len(item_ids)))
+    matrix.sum_duplicates()
+    return matrix, user_ids, item_ids
+
+
+def _row_blocks(counts: np.ndarray, rows: np.ndarray, n_cols: int) -> list:
+    """
+    Parte `rows` (ordenadas por número de valoraciones, de menor a mayor) en
+    bloques cuyo costo en memoria, n * (m + k) * k con m el máximo del bloque,
+    no pase de ALS_BLOCK_ELEMENTS. Al ir ordenadas, el relleno hasta m es poco.
+    """
+    blocks = []
+    start = 0
+    while start < len(rows):
+        # Como mucho tantas filas como caben con m = 1
+        window = counts[rows[start:start + max(ALS_BLOCK_ELEMENTS // ((1 + n_cols) * n_cols), 1)]]
+        cost = np.arange(1, len(window) + 1) * (window + n_cols) * n_cols
+        size = max(int(np.searchsorted(cost, ALS_BLOCK_ELEMENTS, side='right')), 1)
+        blocks.append(rows[start:start + size])
+        start += size
+    return blocks
+
+
+def _solve_block(matrix: sparse.csr_matrix, fixed: np.ndarray, fixed_bias: np.ndarray, global_mean: float,
+                 reg: float, out: np.ndarray, rows: np.ndarray):
+    """
+    Resuelve las filas `rows` de un medio paso de ALS de una vez. `fixed` trae
+    una columna de unos al inicio, así cada fila obtiene [sesgo, factores] juntos.
+    Las valoraciones de cada fila se rellenan con ceros hasta el máximo del bloque.
+    """
+    counts = matrix.indptr[rows + 1] - matrix.indptr[rows]
+    slots = np.arange(counts.max())
+    valid = slots < counts[:, None]
+    entries = np.where(valid, matrix.indptr[rows][:, None] + slots, 0)
+    cols = matrix.indices[entries]
+    F = fixed[cols] * valid[:, :, None]
+    target = (matrix.data[entries] - global_mean - fixed_bias[cols]) * valid
+    A = np.matmul(F.transpose(0, 2, 1), F)
+    A += (reg * counts)[:, None, None] * np.eye(fixed.shape[1])
+    b = np.matmul(F.transpose(0, 2, 1), target[:, :, None])
+    out[rows] = np.linalg.solve(A, b)[:, :, 0]
+
+
+def _half_step(matrix: sparse.csr_matrix, fixed_factors: np.ndarray, fixed_bias: np.ndarray,
+               global_mean: float, reg: float, executor: ThreadPoolExecutor) -> tuple:
+    """Recalcula (factores, sesgos) de todas las filas de `matrix` con el otro lado fijo."""
+    fixed = np.hstack([np.ones((len(fixed_factors), 1)), fixed_factors])
+    out = np.zeros((matrix.shape[0], fixed.shape[1]))
+    counts = np.diff(matrix.indptr)
+    # Las filas sin valoraciones quedan en cero
+    rows = np.flatnonzero(counts)
+    rows = rows[np.argsort(counts[rows], kind='stable')]
+    futures = [
+        executor.submit(_solve_block, matrix, fixed, fixed_bias, global_mean, reg, out, block)
+        for block in _row_blocks(counts, rows, fixed.shape[1])
+    ]
+    for future in futures:
+        future.result()
+    return out[:, 1:], out[:, 0]
+
+
+def _rmse(matrix: sparse.coo_matrix, pu, qi, bu, bi, global_mean: float, rating_scale: tuple) -> float:
+    if matrix.nnz == 0:
+        return float('nan')
+    est = global_mean + bu[matrix.row] + bi[matrix.col] + np.einsum('ij,ij->i', pu[matrix.row], qi[matrix.col])
+    est = np.clip(est, *rating_scale)
+    return float(np.sqrt(np.mean((matrix.data - est) ** 2)))
+
+
+def _fit(train: sparse.csr_matrix, n_factors: int, reg: float, iterations: int, seed: int,
+         holdout: sparse.coo_matrix = None, rating_scale: tuple = (1, 5), patience: int = ALS_PATIENCE,
+         threads: int = ALS_THREADS, verbose: bool = False) -> tuple:
+    """ALS con parada temprana: se conservan los factores de la mejor iteración en `holdout`."""
+    rng = np.random.default_rng(seed)
+    n_users, n_items = train.shape
+    global_mean = float(train.data.mean()) if train.nnz else 0.0
+    # Misma inicialización que Surprise (normal, desviación 0.1)
+    qi = rng.normal(0.0, 0.1, (n_items, n_factors))
+    bi = np.zeros(n_items)
+    train_t = train.T.tocsr()
+
+    best = None
+    history = []
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='cf-als') as executor:
+        for iteration in range(1, iterations + 1):
+            pu, bu = _half_step(train, qi, bi, global_mean, reg, executor)
+            qi, bi = _half_step(train_t, pu, bu, global_mean, reg, executor)
+            if holdout is None or holdout.nnz == 0:
+                best = (iteration, pu, qi, bu, bi)
+                continue
+            rmse = _rmse(holdout, pu, qi, bu, bi, global_mean, rating_scale)
+            history.append(rmse)
+            if verbose:
+                print(f"  ALS iteración {iteration}: RMSE holdout = {rmse:.4f}")
+            if best is None or rmse < min(history[:-1], default=np.inf):
+                best = (iteration, pu, qi, bu, bi)
+            elif iteration - best[0] >= patience:
+                break
+    return best, global_mean, history
+
+
+def train_als(ratings_df: pd.DataFrame, n_factors: int = ALS_FACTORS, reg: float = ALS_REG,
+              max_iterations: int = ALS_MAX_ITERATIONS, holdout_fraction: float = ALS_HOLDOUT_FRACTION,
+              rating_scale: tuple = (1, 5), seed: int = 42, threads: int = ALS_THREADS,
+              verbose: bool = True) -> dict:
+    """
+    Entrena el modelo ALS. Con `holdout_fraction` > 0 separa esa fracción de
+    valoraciones para elegir el número de iteraciones (parada temprana) y luego
+    reentrena con todas las valoraciones ese número de iteraciones.
+    Devuelve el diccionario de factores que usa el serving (ver `extract_cf_factors`).
+    """
+    matrix, user_ids, item_ids = build_ratings_matrix(ratings_df)
+    iterations = max_iterations
+    history = []
+    if holdout_fraction > 0 and matrix.nnz >= 20:
+        coo = matrix.tocoo()
+        is_holdout = np.random.default_rng(seed).random(coo.nnz) < holdout_fraction
+        train = sparse.csr_matrix((coo.data[~is_holdout], (coo.row[~is_holdout], coo.col[~is_holdout])),
+                                  shape=matrix.shape)
+        holdout = sparse.coo_matrix((coo.data[is_holdout], (coo.row[is_holdout], coo.col[is_holdout])),
+                                    shape=matrix.shape)
+        (iterations, *_), _, history = _fit(train, n_factors, reg, max_iterations, seed, holdout,
+                                            rating_scale, threads=threads, verbose=verbose)
+        if verbose:
+            print(f"ALS: mejor iteración {iterations} (RMSE holdout {min(history):.4f}); "
+                  f"reentrenando con todas las valoraciones.")
+
+    (_, pu, qi, bu, bi), global_mean, _ = _fit(matrix, n_factors, reg, iterations, seed,
+                                               rating_scale=rating_scale, threads=threads)
+    # Mismo formato que `extract_cf_factors`; build_ratings_matrix ya devuelve IDs ordenados
+    return {
+        'pu': pu,
+        'qi': qi,
+        'bu': bu,
+        'bi': bi,
+        'global_mean': global_mean,
+        'biased': True,
+        'rating_scale': rating_scale,
+        'user_ids_sorted': user_ids,
+        'user_order': np.arange(len(user_ids)),
+        'item_ids_sorted': item_ids,
+        'item_order': np.arange(len(item_ids)),
+        'engine': 'als',
+        'holdout_rmse_history': history,
+    }
@@ -0,0 +1,77 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from src.cf_model import train_cf_model, extract_cf_factors, _gather_item_terms, _gather_user_terms
+from src.synthetic_data import SyntheticConfig, generate_destinos, iter_ratings
+
+# --- COMPARACIÓN DE MOTORES CF (SURPRISE SVD vs ALS) ---
+# Tiempo de entrenamiento y RMSE en un conjunto de prueba, a medida que crece
+# el número de valoraciones (datos de src/synthetic_data.py).
+DEFAULT_USER_COUNTS = (1_000, 10_000, 50_000)
+
+
+def predict_pairs(factors: dict, user_ids, item_ids) -> np.ndarray:
+    """Predicción vectorizada para pares (usuario, destino), igual que `SVD.predict`."""
+    pu, bu, user_known = _gather_user_terms(factors, user_ids)
+    qi, bi, item_known = _gather_item_terms(factors, item_ids)
+    dot = np.einsum('ij,ij->i', pu, qi)
+    if factors['biased']:
+        est = factors['global_mean'] + bu + bi + dot
+    else:
+        est = np.where(user_known & item_known, dot, factors['global_mean'])
+    return np.clip(est, *factors['rating_scale'])
+
+
+def rmse(factors: dict, test_df: pd.DataFrame) -> float:
+    est = predict_pairs(factors, test_df['id_usuario'].to_numpy(), test_df['id_destino'].to_numpy())
+    return float(np.sqrt(np.mean((test_df['puntuacion'].to_numpy() - est) ** 2)))
+
+
+def make_dataset(num_users: int, num_destinos: int, ratings_mean: float, seed: int = 42) -> pd.DataFrame:
+    config = SyntheticConfig(num_users=num_users, num_destinos=num_destinos, ratings_mean=ratings_mean,
+                             max_ratings=num_destinos, num_clusters=4, seed=seed)
+    destino_ids = generate_destinos(config)['id_destino'].to_numpy()
+    return pd.concat(iter_ratings(config, destino_ids), ignore_index=True)
+
+
+def run_benchmark(user_counts=DEFAULT_USER_COUNTS, num_destinos: int = 2000, ratings_mean: float = 20.0,
+                  test_fraction: float = 0.2, engines=('surprise', 'als')) -> list:
+    results = []
+    for num_users in user_counts:
+        ratings_df = make_dataset(num_users, num_destinos, ratings_mean)
+        is_test = np.random.default_rng(0).random(len(ratings_df)) < test_fraction
+        train_df, test_df = ratings_df[~is_test], ratings_df[is_test]
+
+        for engine in engines:
+            start = time.perf_counter()
+            model = train_cf_model(train_df, save_model=False, engine=engine)
+            train_seconds = time.perf_counter() - start
+            factors = model if isinstance(model, dict) else extract_cf_factors(model)
+            results.append({
+                'engine': engine,
+                'users': num_users,
+                'ratings': len(train_df),
+                'train_seconds': round(train_seconds, 2),
+                'test_rmse': round(rmse(factors, test_df), 4),
+            })
+            print(results[-1])
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara tiempo de entrenamiento y RMSE de los motores CF.")
+    parser.add_argument('--users', type=int, nargs='+', default=list(DEFAULT_USER_COUNTS))
+    parser.add_argument('--destinos', type=int, default=2000)
+    parser.add_argument('--ratings-mean', type=float, default=20.0)
+    parser.add_argument('--engines', nargs='+', default=['surprise', 'als'], choices=['surprise', 'als'])
+    parser.add_argument('--json', help="Ruta para guardar los resultados en JSON.")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.users, args.destinos, args.ratings_mean, engines=args.engines)
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
@@ -1,42 +1,64 @@
 import pandas as pd
-import numpy as np # Importación necesaria para manejar np.nan y np.inf
+import numpy as np # Importación necesaria para manejar np.nan y np.inf y el scoring vectorizado
 import os
 import pickle
-from surprise import Dataset, Reader
-from surprise import SVD
-from src.database import get_db_connection
-from mysql.connector import Error
+import threading
+from src.database import db_connection
+from src import model_registry, artifacts
+from src.catalog import get_catalog, positions_of
+from src import ratings_index
+from src.user_versions import bump_user_version
+from mysql.connector import Error, errorcode
 
 # --- CONFIGURACIÓN ---
-MODEL_FILENAME = 'cf_svd_model.pkl'
-MODEL_PATH = os.path.join('models', MODEL_FILENAME)
+# El modelo se guarda como factores .npy en models/cf/ (ver src/artifacts.py).
+# cf_svd_model.pkl solo existe en modelos generados por versiones anteriores.
+LEGACY_MODEL_PATH = os.path.join('models', 'cf_svd_model.pkl')
 RATING_SCALE = (1, 5) 
+CF_ARTIFACT = 'cf'
+# Motor de entrenamiento: 'surprise' (SVD por SGD) o 'als' (ALS multihilo, ver src/cf_als.py)
+CF_ENGINE = os.environ.get('CF_ENGINE', 'surprise')
+NEUTRAL_SCORE = 3.0
+# Regularización del fold-in, por valoración (igual que reg_all del entrenamiento)
+FOLD_IN_REG = float(os.environ.get('CF_FOLD_IN_REG', 0.02))
 
-def load_ratings_data():
+def load_ratings_data(conn=None):
     """
     Carga los datos de valoraciones (Usuario, Destino, Puntuación) desde MySQL.
+    Si se recibe `conn`, reutiliza esa conexión del pool.
     """
-    conn = None
     try:
-        conn = get_db_connection()
-        ratings_df = pd.read_sql_query("SELECT id_usuario, id_destino, puntuacion FROM valoraciones", conn)
+        with db_connection(conn) as conn:
+            ratings_df = pd.read_sql_query("SELECT id_usuario, id_destino, puntuacion FROM valoraciones", conn)
         return ratings_df
     except Error as e:
         print(f"Error al cargar datos de valoraciones: {e}")
         return pd.DataFrame() 
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
 
 
-def train_cf_model(data_df: pd.DataFrame, save_model: bool = True):
+def train_cf_model(data_df: pd.DataFrame, save_model: bool = True, engine: str = None):
     """
-    Entrena el modelo SVD (Factorización de Matrices).
+    Entrena el modelo CF (Factorización de Matrices) con el motor `engine`
+    (por defecto CF_ENGINE). Con 'surprise' devuelve el SVD entrenado; con
+    'als', directamente el diccionario de factores.
     """
     if data_df.empty:
         print("No hay datos para entrenar el modelo CF.")
         return None
+
+    engine = engine or CF_ENGINE
+    if engine == 'als':
+        # Solo el entrenamiento necesita scipy/surprise; el API sirve desde los factores
+        from src.cf_als import train_als
+        factors = train_als(data_df, rating_scale=RATING_SCALE)
+        if save_model:
+            save_cf_factors(factors)
+            print(f"Modelo CF (ALS) entrenado y guardado en {artifacts.artifact_dir(CF_ARTIFACT)}")
+        return factors
+    if engine != 'surprise':
+        raise ValueError(f"Motor CF desconocido: '{engine}'. Opciones: 'surprise', 'als'.")
         
+    from surprise import Dataset, Reader, SVD
     reader = Reader(rating_scale=RATING_SCALE)
     data = Dataset.load_from_df(data_df[['id_usuario', 'id_destino', 'puntuacion']], reader)
     trainset = data.build_full_trainset()
@@ -45,72 +67,370 @@ def train_cf_model(data_df: pd.DataFrame, save_model: bool = True):
     algo.fit(trainset)
     
     if save_model:
-        os.makedirs('models', exist_ok=True)
-        with open(MODEL_PATH, 'wb') as f:
-            pickle.dump(algo, f)
-        print(f"Modelo CF (SVD) entrenado y guardado en models/{MODEL_FILENAME}")
+        save_cf_factors(extract_cf_factors(algo))
+        print(f"Modelo CF (SVD) entrenado y guardado en {artifacts.artifact_dir(CF_ARTIFACT)}")
         
     return algo
 
 
-def load_cf_model():
-    """Carga el modelo SVD entrenado; si no existe, lo entrena."""
+def extract_cf_factors(algo) -> dict:
+    """
+    Extrae los factores latentes y sesgos del SVD entrenado a arreglos NumPy
+    (pu, qi, bu, bi y media global), junto con los IDs crudos de usuarios y
+    destinos ordenados para poder mapearlos de forma vectorizada.
+    """
+    if algo is None:
+        return None
+
+    trainset = algo.trainset
+    user_ids = np.array([trainset.to_raw_uid(u) for u in range(trainset.n_users)], dtype=np.int64)
+    item_ids = np.array([trainset.to_raw_iid(i) for i in range(trainset.n_items)], dtype=np.int64)
+    user_order = np.argsort(user_ids)
+    item_order = np.argsort(item_ids)
+
+    return {
+        'pu': np.asarray(algo.pu, dtype=np.float64),
+        'qi': np.asarray(algo.qi, dtype=np.float64),
+        'bu': np.asarray(algo.bu, dtype=np.float64),
+        'bi': np.asarray(algo.bi, dtype=np.float64),
+        'global_mean': float(trainset.global_mean),
+        'biased': bool(algo.biased),
+        'rating_scale': RATING_SCALE,
+        # IDs crudos ordenados + permutación al índice interno (para searchsorted)
+        'user_ids_sorted': user_ids[user_order],
+        'user_order': user_order,
+        'item_ids_sorted': item_ids[item_order],
+        'item_order': item_order,
+    }
+
+
+CF_ARRAY_KEYS = ('pu', 'qi', 'bu', 'bi', 'user_ids_sorted', 'user_order', 'item_ids_sorted', 'item_order')
+
+
+def save_cf_factors(factors: dict):
+    """Guarda los factores como artefacto .npy (sin pickle) y los publica en este proceso."""
+    meta = {
+        'global_mean': float(factors['global_mean']),
+        'biased': bool(factors['biased']),
+        'rating_scale': list(factors['rating_scale']),
+        'engine': factors.get('engine', 'surprise'),
+    }
+    artifacts.save_artifact(CF_ARTIFACT, arrays={key: factors[key] for key in CF_ARRAY_KEYS}, meta=meta)
+    model_registry.publish_artifact(CF_ARTIFACT, load_cf_artifact())
+
+
+def load_cf_artifact() -> dict:
+    """Factores CF desde models/cf/, mapeados en memoria (compartidos entre workers)."""
+    stored = artifacts.load_artifact(CF_ARTIFACT)
+    meta = stored['meta']
+    return {
+        **stored['arrays'],
+        'global_mean': meta['global_mean'],
+        'biased': meta['biased'],
+        'rating_scale': tuple(meta['rating_scale']),
+        'engine': meta['engine'],
+        'version': stored['version'],
+    }
+
+
+def _migrate_legacy_model() -> dict:
+    """Convierte una única vez el modelo serializado con pickle al formato de artefactos."""
+    print("ATENCIÓN: Modelo CF en formato pickle (cf_svd_model.pkl); se convierte a models/cf/.")
+    with open(LEGACY_MODEL_PATH, 'rb') as f:
+        model = pickle.load(f)
+    save_cf_factors(model if isinstance(model, dict) else extract_cf_factors(model))
+    os.remove(LEGACY_MODEL_PATH)
+    return load_cf_artifact()
+
+
+def load_cf_factors() -> dict:
+    """
+    Loader del registro: factores CF listos para servir, mapeados desde disco.
+    Si no hay artefacto, migra el modelo pickle anterior o entrena uno nuevo.
+    """
     try:
-        with open(MODEL_PATH, 'rb') as f:
-            print("Modelo CF cargado desde disco.")
-            return pickle.load(f)
+        factors = load_cf_artifact()
+        print("Modelo CF cargado desde disco.")
+        return factors
     except FileNotFoundError:
-        print("Modelo CF no encontrado. Entrenando uno nuevo...")
-        ratings_df = load_ratings_data()
-        return train_cf_model(ratings_df, save_model=True)
+        pass
+    if os.path.exists(LEGACY_MODEL_PATH):
+        return _migrate_legacy_model()
+    print("Modelo CF no encontrado. Entrenando uno nuevo...")
+    if train_cf_model(load_ratings_data(), save_model=True) is None:
+        return None
+    return load_cf_artifact()
 
 
-def get_cf_scores(user_id: int) -> pd.DataFrame:
+model_registry.register_artifact(CF_ARTIFACT, load_cf_factors, [artifacts.current_path(CF_ARTIFACT)])
+
+
+def _lookup_inner_ids(sorted_ids, order, raw_ids):
+    """Mapea IDs crudos a índices internos del modelo. Devuelve (índices, máscara de conocidos)."""
+    raw_ids = np.asarray(raw_ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.zeros(len(raw_ids), dtype=np.int64), np.zeros(len(raw_ids), dtype=bool)
+    pos = np.clip(np.searchsorted(sorted_ids, raw_ids), 0, len(sorted_ids) - 1)
+    known = sorted_ids[pos] == raw_ids
+    return order[pos], known
+
+
+def _gather_item_terms(factors: dict, item_ids):
+    """Factores y sesgos de los destinos alineados con `item_ids` (ceros si son desconocidos)."""
+    inner, known = _lookup_inner_ids(factors['item_ids_sorted'], factors['item_order'], item_ids)
+    qi = np.where(known[:, None], factors['qi'][inner], 0.0) if len(factors['qi']) else np.zeros((len(inner), 0))
+    bi = np.where(known, factors['bi'][inner], 0.0) if len(factors['bi']) else np.zeros(len(inner))
+    return qi, bi, known
+
+
+def _gather_user_terms(factors: dict, user_ids):
     """
-    Genera predicciones (scores_cf) para todos los destinos no calificados por el usuario.
+    Factores y sesgos de los usuarios alineados con `user_ids` (ceros si son
+    desconocidos). Los usuarios incorporados con fold-in usan su vector nuevo.
+    """
+    inner, known = _lookup_inner_ids(factors['user_ids_sorted'], factors['user_order'], user_ids)
+    n_factors = factors['qi'].shape[1]
+    pu = np.where(known[:, None], factors['pu'][inner], 0.0) if len(factors['pu']) else np.zeros((len(inner), n_factors))
+    bu = np.where(known, factors['bu'][inner], 0.0) if len(factors['bu']) else np.zeros(len(inner))
+    folded = _folded_users(factors)
+    if folded:
+        for i, user_id in enumerate(np.asarray(user_ids).tolist()):
+            if user_id in folded:
+                pu[i], bu[i], _ = folded[user_id]
+                known[i] = True
+    return pu, bu, known
+
+
+# --- FOLD-IN DE VALORACIONES NUEVAS (SIN REENTRENAR) ---
+# Los factores de los destinos (qi, bi) quedan fijos y se resuelve en forma
+# cerrada (ridge) el vector y sesgo del usuario con todas sus valoraciones.
+# Los resultados viven en memoria sobre el modelo cargado; al publicarse un
+# modelo reentrenado se descartan, porque ya incluye esas valoraciones. Cada
+# vector guarda la versión del usuario (src/user_versions.py) con la que se
+# leyeron sus valoraciones: si el índice de valoraciones relee una fila más
+# nueva (cambio hecho en otro proceso), el usuario se vuelve a incorporar.
+_fold_in_lock = threading.Lock()
+_folded = {'factors': None, 'users': {}}  # id_usuario -> (pu, bu, versión)
+
+
+def _folded_users(factors: dict) -> dict:
+    """Usuarios incorporados con fold-in sobre `factors` (vacío si el modelo cambió)."""
+    folded = _folded
+    return folded['users'] if folded['factors'] is factors else {}
+
+
+def _store_folded_user(factors: dict, user_id: int, pu: np.ndarray, bu: float, version=None):
+    global _folded
+    with _fold_in_lock:
+        if _folded['factors'] is not factors:
+            _folded = {'factors': factors, 'users': {}}
+        _folded['users'][user_id] = (pu, bu, version)
+
+
+def fold_in_user(factors: dict, item_ids, ratings) -> tuple:
+    """
+    Calcula (pu, bu) de un usuario a partir de sus valoraciones, con los factores
+    de los destinos fijos: mínimos cuadrados regularizados sobre
+    r - media - bi = bu + qi·pu. Los destinos que el modelo no conoce se ignoran.
+    """
+    qi, bi, known = _gather_item_terms(factors, item_ids)
+    qi, bi = qi[known], bi[known]
+    ratings = np.asarray(ratings, dtype=np.float64)[known]
+    n_factors = factors['qi'].shape[1]
+    if len(ratings) == 0:
+        return np.zeros(n_factors), 0.0
+
+    reg = FOLD_IN_REG * len(ratings)
+    if factors['biased']:
+        A = np.hstack([np.ones((len(ratings), 1)), qi])
+        y = ratings - factors['global_mean'] - bi
+    else:
+        A, y = qi, ratings
+    x = np.linalg.solve(A.T @ A + reg * np.eye(A.shape[1]), A.T @ y)
+    if factors['biased']:
+        return x[1:], float(x[0])
+    return x, 0.0
+
+
+def _fold_in_changed_users(factors: dict, rated: dict):
+    """
+    Incorpora a los usuarios cuyas valoraciones no reflejan los factores en
+    memoria: los que el modelo no conoce y los que cambiaron (p. ej. valoraron
+    en otro proceso del API) desde el entrenamiento o desde su último fold-in.
+    `rated` mapea id_usuario -> (destinos, puntuaciones).
+    """
+    user_ids = np.fromiter(rated.keys(), dtype=np.int64, count=len(rated))
+    _, known = _lookup_inner_ids(factors['user_ids_sorted'], factors['user_order'], user_ids)
+    folded = _folded_users(factors)
+    for user_id, is_known in zip(user_ids.tolist(), known.tolist()):
+        version = ratings_index.user_version(user_id)
+        if is_known and version is None:
+            continue  # Sus valoraciones son las del entrenamiento (o ya están incorporadas)
+        if user_id in folded and folded[user_id][2] == version:
+            continue
+        pu, bu = fold_in_user(factors, *rated[user_id])
+        _store_folded_user(factors, user_id, pu, bu, version)
+
+
+def add_rating(user_id: int, destino_id: int, puntuacion: float, conn=None) -> dict:
+    """
+    Guarda (o actualiza) una valoración y la incorpora de inmediato al modelo CF
+    con fold-in: la siguiente recomendación del usuario ya la refleja, sin
+    reentrenar. Lanza LookupError si el usuario o el destino no existen.
+    """
+    low, high = RATING_SCALE
+    if not low <= puntuacion <= high:
+        raise ValueError(f"La puntuación debe estar entre {low} y {high}.")
+    _, found = positions_of(get_catalog(), [destino_id])
+    if not found[0]:
+        raise LookupError(f"El destino {destino_id} no existe.")
+
+    with db_connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "INSERT INTO valoraciones (id_usuario, id_destino, puntuacion) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE puntuacion = VALUES(puntuacion)",
+                (user_id, destino_id, puntuacion)
+            )
+            # Visible para todos los procesos del API junto con la valoración
+            # (invalida su top-K precalculado y sus respuestas cacheadas)
+            version = bump_user_version(cursor, user_id)
+            conn.commit()
+        except Error as e:
+            conn.rollback()
+            if e.errno == errorcode.ER_NO_REFERENCED_ROW_2:
+                raise LookupError(f"El usuario {user_id} no existe.")
+            raise
+    ratings_index.record_rating(user_id, destino_id, puntuacion)
+    # La versión nueva obliga a releer la fila completa (incluye cambios de otros procesos)
+    item_ids, ratings = ratings_index.user_ratings([user_id], versions={user_id: version})[user_id]
+
+    factors = model_registry.get_artifact(CF_ARTIFACT)
+    if factors is not None:
+        pu, bu = fold_in_user(factors, item_ids, ratings)
+        _store_folded_user(factors, user_id, pu, bu, ratings_index.user_version(user_id))
+    return {
+        'user_id': user_id,
+        'id_destino': destino_id,
+        'puntuacion': puntuacion,
+        'total_ratings': len(ratings),
+        'folded_in': factors is not None,
+    }
+
+
+def score_user(factors: dict, user_id: int, item_ids) -> np.ndarray:
+    """
+    Predice la puntuación de un usuario para todos los `item_ids` con un solo
+    producto matriz-vector. Reproduce `SVD.predict`: los términos de usuarios o
+    destinos desconocidos se omiten y el resultado se recorta a la escala.
+    """
+    qi, bi, item_known = _gather_item_terms(factors, item_ids)
+    pu, bu, user_known = _gather_user_terms(factors, [user_id])
+
+    est = qi @ pu[0]
+    if factors['biased']:
+        est = factors['global_mean'] + bu[0] + bi + est
+    else:
+        est = np.where(item_known & user_known[0], est, factors['global_mean'])
+    return np.clip(est, *factors['rating_scale'])
+
+
+def score_users(factors: dict, user_ids, item_ids) -> np.ndarray:
+    """
+    Versión por lotes de `score_user`: una matriz (usuarios x destinos) calculada
+    con un solo producto matriz-matriz.
     """
-    algo = load_cf_model()
-    conn = None
+    qi, bi, item_known = _gather_item_terms(factors, item_ids)
+    pu, bu, user_known = _gather_user_terms(factors, user_ids)
+
+    est = pu @ qi.T
+    if factors['biased']:
+        est += factors['global_mean'] + bu[:, None] + bi[None, :]
+    else:
+        est = np.where(user_known[:, None] & item_known[None, :], est, factors['global_mean'])
+    return np.clip(est, *factors['rating_scale'])
+
+
+def get_cf_score_arrays(user_ids: list, conn=None, positions=None, versions: dict = None) -> tuple:
+    """
+    Scores CF de varios usuarios alineados con el catálogo (índice denso), con
+    un solo producto matriz-matriz. Las valoraciones previas y la media global
+    salen del índice en memoria (src/ratings_index.py), no de MySQL.
+    Devuelve (scores, presentes), matrices (usuarios x destinos) en el orden de
+    `user_ids`. `presentes` marca los destinos que el CF aporta: los no
+    calificados por el usuario o, en Cold Start, todo el catálogo con la media.
+    Con `positions` (posiciones del catálogo ordenadas, p. ej. destinos
+    cercanos) solo se puntúan esos destinos y las columnas siguen su orden.
+    `versions`: versiones de los usuarios ya leídas por el llamador (ver
+    `ratings_index.user_ratings`).
+    """
+    factors = model_registry.get_artifact(CF_ARTIFACT)
+    user_ids = list(user_ids)
+    unique_users = list(dict.fromkeys(user_ids))
     
     try:
-        conn = get_db_connection()
-        all_destinos_df = pd.read_sql_query("SELECT id_destino FROM destinos", conn)
-        all_destinos = all_destinos_df['id_destino'].tolist()
-        
-        rated_destinos = pd.read_sql_query(f"SELECT id_destino FROM valoraciones WHERE id_usuario = {user_id}", conn)
-        rated_destinos_ids = rated_destinos['id_destino'].tolist()
+        # El catálogo se sirve desde memoria (se recarga cuando corre el ETL)
+        catalog = get_catalog()
+        all_destinos = catalog['ids'] if positions is None else catalog['ids'][positions]
+        scores = np.full((len(user_ids), len(all_destinos)), NEUTRAL_SCORE)
+        present = np.zeros((len(user_ids), len(all_destinos)), dtype=bool)
+        if not unique_users:
+            return scores, present
         
+        # Solo relee `valoraciones` de usuarios desconocidos o que cambiaron
+        rated = ratings_index.user_ratings(unique_users, conn=conn, versions=versions)
+        # --- Datos para el manejo del Cold Start (Usuario Nuevo) ---
+        mean_rating = ratings_index.global_mean(default=NEUTRAL_SCORE)
     except Error as e:
-        print(f"Error al obtener datos en get_cf_scores: {e}")
-        return pd.DataFrame()
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
-
-    unrated_destinos = [d for d in all_destinos if d not in rated_destinos_ids]
-    predictions = []
+        print(f"Error al obtener datos en get_cf_score_arrays: {e}")
+        return np.zeros((len(user_ids), 0)), np.zeros((len(user_ids), 0), dtype=bool)
     
-    for destino_id in unrated_destinos:
-        pred = algo.predict(uid=user_id, iid=destino_id)
-        predictions.append({'id_destino': destino_id, 'score_cf': pred.est})
-        
-    cf_scores_df = pd.DataFrame(predictions)
+    # Máscara (usuarios x destinos) de destinos ya calificados
+    user_pos = {user_id: i for i, user_id in enumerate(unique_users)}
+    rated_mask = np.zeros((len(unique_users), len(all_destinos)), dtype=bool)
+    # id_destino -> columna (los ids del subconjunto siguen ordenados)
+    columns = catalog if positions is None else {'ids': all_destinos}
+    for user_id, (item_ids, _) in rated.items():
+        item_pos, found = positions_of(columns, item_ids)
+        rated_mask[user_pos[user_id], item_pos[found]] = True
     
-    # --- Manejo del problema Cold Start (Usuario Nuevo) ---
-    full_ratings_data = load_ratings_data()
+    rows = [user_pos[user_id] for user_id in user_ids]
+    if factors is not None:
+        _fold_in_changed_users(factors, rated)
+        # Todos los destinos (o el subconjunto) en un solo producto; los ya calificados se enmascaran
+        scores[:] = score_users(factors, unique_users, all_destinos)[rows]
+    present = ~rated_mask[rows]
     
-    if cf_scores_df.empty or user_id not in full_ratings_data['id_usuario'].unique():
+    # --- Manejo del problema Cold Start (Usuario Nuevo) ---
+    has_ratings = np.array([user_id in rated for user_id in user_ids], dtype=bool)
+    cold_start = ~has_ratings | (factors is None)
+    if positions is None:
+        # Calificó todo el catálogo (en un subconjunto solo significa que ya conoce la zona)
+        cold_start |= ~present.any(axis=1)
+    for user_id in dict.fromkeys(np.asarray(user_ids)[cold_start].tolist()):
         print(f"Advertencia: Usuario {user_id} es un usuario nuevo (Cold Start). CF devolverá scores promedio.")
-        mean_rating = full_ratings_data['puntuacion'].mean() if not full_ratings_data.empty else 3.0
-        all_destinos_df['score_cf'] = mean_rating
-        
-        # Corrección: Asegurar que el DataFrame devuelto no tenga Inf/NaN
-        all_destinos_df.replace([np.inf, -np.inf, np.nan], 3.0, inplace=True)
-        return all_destinos_df.set_index('id_destino')
+    scores[cold_start] = mean_rating
+    present[cold_start] = True
     
-    # CORRECCIÓN FINAL: Limpiar el DataFrame de salida de Inf/NaN
-    cf_scores_df.replace([np.inf, -np.inf, np.nan], 3.0, inplace=True)
-    return cf_scores_df.set_index('id_destino')
+    # Asegurar que no haya Inf/NaN
+    scores[~np.isfinite(scores)] = NEUTRAL_SCORE
+    return scores, present
+
+
+def get_cf_scores(user_id: int, conn=None) -> pd.DataFrame:
+    """
+    Genera predicciones (scores_cf) para todos los destinos no calificados por el usuario.
+    Si se recibe `conn`, todas las consultas se hacen sobre esa conexión.
+    """
+    scores, present = get_cf_score_arrays([user_id], conn=conn)
+    if scores.shape[1] == 0:
+        return pd.DataFrame()
+    all_destinos = get_catalog()['ids']
+    return pd.DataFrame({
+        'id_destino': all_destinos[present[0]],
+        'score_cf': scores[0][present[0]]
+    }).set_index('id_destino')
 
 
 if __name__ == '__main__':
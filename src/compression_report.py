@@ -0,0 +1,150 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+import faiss
+from src.database import db_connection
+from src.cb_model import (
+    build_faiss_index, decode_embedding_blob, encode_embedding_blob, get_cb_score_arrays_batch
+)
+from src.hybrid_model import DEFAULT_PREFERENCES
+
+# --- MEMORIA VS. CONCORDANCIA DEL RANKING CB ---
+# Compara formatos comprimidos de los embeddings (BLOB float16, índices FAISS
+# sq_fp16 / sq8 / pq / ivf_pq) contra la referencia float32 (IndexFlatIP) sobre
+# la salida real de `get_cb_score_arrays_batch` (posiciones y scores 1-5), con
+# las preferencias de los usuarios como consultas. Para cada formato informa
+# bytes por vector, MB por millón de destinos y cuánto se parece el ranking.
+DEFAULT_CONFIGS = [
+    # (nombre, formato del BLOB, tipo de índice)
+    ('float32 (referencia)', 'float32', 'flat'),
+    ('blob float16 + flat', 'float16', 'flat'),
+    ('sq_fp16', 'float32', 'sq_fp16'),
+    ('sq8', 'float32', 'sq8'),
+    ('pq', 'float32', 'pq'),
+    ('ivf_pq', 'float32', 'ivf_pq'),
+]
+
+
+def load_stored_embeddings() -> tuple:
+    """(id_destino, embeddings float32, formatos de BLOB encontrados) desde `destinos`."""
+    with db_connection() as conn:
+        df = pd.read_sql_query(
+            "SELECT id_destino, embedding FROM destinos WHERE embedding IS NOT NULL ORDER BY id_destino", conn
+        )
+    if df.empty:
+        raise ValueError("No hay embeddings en la BD. Ejecute primero generate_and_store_embeddings().")
+    formats = sorted({'float16' if len(blob) % 2 == 1 else 'float32' for blob in df['embedding']})
+    embeddings = np.vstack([decode_embedding_blob(blob) for blob in df['embedding']])
+    return df['id_destino'].to_numpy(dtype=np.int64), embeddings, formats
+
+
+def load_queries(n_queries: int) -> list:
+    """Textos de preferencias distintos (lo que /recommend/user manda al CB) más el valor por defecto."""
+    with db_connection() as conn:
+        df = pd.read_sql_query(
+            "SELECT DISTINCT preferencias_texto FROM usuarios WHERE preferencias_texto IS NOT NULL LIMIT %s",
+            conn, params=(n_queries,)
+        )
+    return list(dict.fromkeys([DEFAULT_PREFERENCES] + df['preferencias_texto'].tolist()))[:n_queries]
+
+
+def _spearman(ranks_a: np.ndarray, ranks_b: np.ndarray) -> float:
+    """Correlación de Spearman entre dos órdenes de los mismos elementos (1.0 si hay menos de 2)."""
+    if len(ranks_a) < 2:
+        return 1.0
+    a = np.argsort(np.argsort(ranks_a)).astype(np.float64)
+    b = np.argsort(np.argsort(ranks_b)).astype(np.float64)
+    return float(np.corrcoef(a, b)[0, 1]) if a.std() and b.std() else 1.0
+
+
+def ranking_agreement(reference: list, candidate: list, top_n: int = 10) -> dict:
+    """
+    Concordancia entre dos salidas de `get_cb_score_arrays_batch` (una tupla
+    (posiciones, scores) por consulta), promediada sobre las consultas.
+    """
+    overlap_k, overlap_n, top1, spearman, score_mae = [], [], [], [], []
+    for (ref_pos, ref_scores), (cand_pos, cand_scores) in zip(reference, candidate):
+        if len(ref_pos) == 0:
+            continue
+        overlap_k.append(len(np.intersect1d(ref_pos, cand_pos)) / len(ref_pos))
+        overlap_n.append(len(np.intersect1d(ref_pos[:top_n], cand_pos[:top_n])) / len(ref_pos[:top_n]))
+        top1.append(float(len(cand_pos) > 0 and cand_pos[0] == ref_pos[0]))
+        # Orden y score de los destinos que aparecen en ambas listas
+        common, ref_idx, cand_idx = np.intersect1d(ref_pos, cand_pos, return_indices=True)
+        spearman.append(_spearman(ref_idx, cand_idx))
+        if len(common):
+            score_mae.append(float(np.abs(ref_scores[ref_idx] - cand_scores[cand_idx]).mean()))
+    return {
+        'overlap@k': round(float(np.mean(overlap_k)), 4) if overlap_k else None,
+        f'overlap@{top_n}': round(float(np.mean(overlap_n)), 4) if overlap_n else None,
+        'top1_match': round(float(np.mean(top1)), 4) if top1 else None,
+        'spearman': round(float(np.mean(spearman)), 4) if spearman else None,
+        'score_mae': round(float(np.mean(score_mae)), 4) if score_mae else None,
+    }
+
+
+def run_report(ids: np.ndarray, embeddings: np.ndarray, queries: list, k: int = 50, top_n: int = 10,
+               configs: list = None) -> list:
+    """Construye cada formato, consulta con `get_cb_score_arrays_batch` y lo compara con el primero."""
+    dimension = embeddings.shape[1]
+    results, reference = [], None
+    for name, blob_dtype, index_type in (configs or DEFAULT_CONFIGS):
+        # Lo que leería la generación desde un BLOB en ese formato
+        vectors = embeddings.astype(np.float16) if blob_dtype == 'float16' else embeddings
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+
+        start = time.perf_counter()
+        index = build_faiss_index(vectors, index_type, ids=ids)
+        build_seconds = time.perf_counter() - start
+        index_bytes = len(faiss.serialize_index(index))
+
+        start = time.perf_counter()
+        output = get_cb_score_arrays_batch(queries, top_k=k, index=index)
+        search_seconds = time.perf_counter() - start
+        if reference is None:
+            reference = output
+
+        blob_bytes = len(encode_embedding_blob(embeddings[0], blob_dtype))
+        index_bytes_per_vector = index_bytes / len(ids)
+        results.append({
+            'config': name,
+            'blob_dtype': blob_dtype,
+            'index_type': index_type,
+            'n_vectors': len(ids),
+            'dimension': dimension,
+            'blob_bytes_per_vector': blob_bytes,
+            'index_bytes_per_vector': round(index_bytes_per_vector, 1),
+            'blob_mb_per_million': round(blob_bytes * 1e6 / 2**20, 1),
+            'index_mb_per_million': round(index_bytes_per_vector * 1e6 / 2**20, 1),
+            **ranking_agreement(reference, output, top_n),
+            'build_seconds': round(build_seconds, 3),
+            'search_ms_per_query': round(search_seconds * 1000 / max(len(queries), 1), 3),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Memoria de los embeddings comprimidos frente a la concordancia del ranking CB con float32."
+    )
+    parser.add_argument('--queries', type=int, default=200, help="Textos de preferencias distintos a consultar.")
+    parser.add_argument('--k', type=int, default=50, help="top_k de get_cb_scores (como en el API).")
+    parser.add_argument('--top-n', type=int, default=10, help="N para overlap@N (lo que ve el usuario).")
+    parser.add_argument('--json', help="Ruta para guardar los resultados en JSON.")
+    args = parser.parse_args()
+
+    ids, embeddings, formats = load_stored_embeddings()
+    if formats != ['float32']:
+        print(f"ATENCIÓN: La BD tiene BLOBs {formats}; la referencia no es float32 puro.")
+    queries = load_queries(args.queries)
+    print(f"--- Compresión de embeddings: {len(ids)} vectores, {len(queries)} consultas (k={args.k}) ---")
+    results = run_report(ids, embeddings, queries, k=min(args.k, len(ids)), top_n=args.top_n)
+    print(pd.DataFrame(results).to_string(index=False))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
@@ -0,0 +1,34 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# --- EJECUTORES ACOTADOS PARA EL PIPELINE ASÍNCRONO ---
+# IO: consultas MySQL y fusión de scores (bloqueantes, pero casi siempre esperando).
+# CPU: codificación SentenceTransformer y búsqueda FAISS (liberan el GIL).
+IO_WORKERS = int(os.environ.get('IO_EXECUTOR_WORKERS', 16))
+CPU_WORKERS = int(os.environ.get('CPU_EXECUTOR_WORKERS', os.cpu_count() or 2))
+
+_io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='recommender-io')
+_cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='recommender-cpu')
+
+
+async def run_io(fn, *args, **kwargs):
+    """Ejecuta una función bloqueante de E/S sin bloquear el event loop."""
+    loop = asyncio.get_running_loop()
+    # Con el contexto del llamador (como asyncio.to_thread): la traza de métricas sigue a la petición
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_io_executor, partial(context.run, fn, *args, **kwargs))
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Ejecuta una función intensiva en CPU en el ejecutor acotado."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_cpu_executor, partial(context.run, fn, *args, **kwargs))
+
+
+def shutdown_executors():
+    _io_executor.shutdown(wait=False)
+    _cpu_executor.shutdown(wait=False)
@@ -1,5 +1,11 @@
-import mysql.connector
-from mysql.connector import Error
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from mysql.connector import Error, errorcode, pooling
+from src.concurrency import IO_WORKERS
+from src.metrics import DB_CONNECTIONS
 
 
 DB_CONFIG = {
@@ -9,67 +15,172 @@ DB_CONFIG = {
     'password': ''    
 }
 
+# --- POOL DE CONEXIONES ---
+# mysql-connector crea las `pool_size` conexiones al construir el pool (pre-calentado).
+# Por defecto una por hilo del ejecutor de E/S (con el tope de mysql-connector):
+# cada hilo retiene a lo sumo una conexión (ver `db_connection`), así ninguno
+# espera por el pool mientras otro hilo de E/S está libre.
+POOL_NAME = 'recommender_pool'
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', min(IO_WORKERS, pooling.CNX_POOL_MAXSIZE)))
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5.0))
+
+_pool = None
+_pool_lock = threading.Lock()
+# Conexión que el hilo (o la tarea) ya tiene tomada con `db_connection`
+_held_connection = contextvars.ContextVar('held_connection', default=None)
+
+# 'mysql' (producción) o 'sqlite' (sustituto local para benchmarks y desarrollo,
+# ver src/sqlite_backend.py)
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mysql')
+
+
+def get_pool():
+    """Devuelve el pool compartido de conexiones; lo crea la primera vez."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=POOL_NAME,
+                    pool_size=POOL_SIZE,
+                    pool_reset_session=True,
+                    **DB_CONFIG
+                )
+                print(f"Pool de conexiones MySQL creado ({POOL_SIZE} conexiones).")
+    return _pool
+
+
 def get_db_connection():
-    """Establece y devuelve la conexión a MySQL."""
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        if conn.is_connected():
+    """
+    Toma una conexión del pool y verifica que siga viva (ping con reconexión).
+    `conn.close()` la devuelve al pool en lugar de cerrarla.
+    """
+    if DB_BACKEND == 'sqlite':
+        from src.sqlite_backend import connect
+        try:
+            conn = connect()
+        except Error:
+            DB_CONNECTIONS.inc(backend=DB_BACKEND, result='error')
+            raise
+        DB_CONNECTIONS.inc(backend=DB_BACKEND, result='ok')
+        return conn
+    pool = get_pool()
+    deadline = time.monotonic() + POOL_CHECKOUT_TIMEOUT
+    while True:
+        try:
+            conn = pool.get_connection()
+        except pooling.errors.PoolError:
+            # Pool agotado: esperar a que otra petición devuelva su conexión
+            if time.monotonic() >= deadline:
+                DB_CONNECTIONS.inc(backend=DB_BACKEND, result='pool_exhausted')
+                print(f"Error al conectar a MySQL: pool agotado tras {POOL_CHECKOUT_TIMEOUT}s.")
+                raise
+            time.sleep(0.01)
+            continue
+        try:
+            conn.ping(reconnect=True, attempts=1, delay=0)
+            DB_CONNECTIONS.inc(backend=DB_BACKEND, result='ok')
             return conn
-    except Error as e:
-        print(f"Error al conectar a MySQL: {e}")
-        raise e
+        except Error as e:
+            DB_CONNECTIONS.inc(backend=DB_BACKEND, result='error')
+            conn.close()
+            print(f"Error al conectar a MySQL: {e}")
+            raise e
 
-def create_tables():
-    """Crea las tablas en MySQL."""
-    conn = None
+
+@contextmanager
+def db_connection(conn=None):
+    """
+    Context manager sobre el pool. Si se recibe `conn`, se reutiliza sin
+    devolverla (para compartir una sola conexión durante toda la petición).
+    Sin `conn`, las llamadas anidadas reutilizan la conexión que el hilo ya tiene
+    tomada (p. ej. la carga perezosa de un artefacto del registro durante una
+    petición): un hilo nunca retiene dos conexiones, así no agota el pool.
+    """
+    if conn is None:
+        conn = _held_connection.get()
+    if conn is not None:
+        token = _held_connection.set(conn)
+        try:
+            yield conn
+        finally:
+            _held_connection.reset(token)
+        return
+    conn = get_db_connection()
+    token = _held_connection.set(conn)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        yield conn
+    finally:
+        _held_connection.reset(token)
+        conn.close()
+
+# Tablas en orden de dependencia (padres primero). `{suffix}` permite crear
+# copias "sombra" (p. ej. destinos_new) que el ETL llena y luego intercambia.
+TABLES = ('destinos', 'usuarios', 'valoraciones')
+
 
-        # Usar ENGINE=InnoDB para soportar claves foráneas
-        
+def table_ddl(suffix: str = '') -> list:
+    """Sentencias CREATE TABLE (nombre, sql) con el sufijo dado, en orden de dependencia."""
+    return [
         # 1. Tabla de Destinos
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS destinos (
+        (f"destinos{suffix}", f"""
+            CREATE TABLE IF NOT EXISTS destinos{suffix} (
                 id_destino INT PRIMARY KEY,
                 city VARCHAR(255) NOT NULL,
                 state VARCHAR(255) NOT NULL,
                 lat DECIMAL(10, 8),
                 lng DECIMAL(11, 8),
                 full_description TEXT, 
-                embedding BLOB 
+                embedding BLOB,
+                embedding_hash CHAR(64)
             ) ENGINE=InnoDB;
-        """)
-        
+        """),
         # 2. Tabla de Usuarios
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
+        (f"usuarios{suffix}", f"""
+            CREATE TABLE IF NOT EXISTS usuarios{suffix} (
                 id_usuario INT PRIMARY KEY,
                 nombre VARCHAR(255) NOT NULL,
-                preferencias_texto TEXT
+                preferencias_texto TEXT,
+                version_datos DOUBLE
             ) ENGINE=InnoDB;
-        """)
-        
+        """),
         # 3. Tabla de Valoraciones (CF)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS valoraciones (
+        (f"valoraciones{suffix}", f"""
+            CREATE TABLE IF NOT EXISTS valoraciones{suffix} (
                 id_usuario INT,
                 id_destino INT,
                 puntuacion DECIMAL(3, 2),
                 PRIMARY KEY (id_usuario, id_destino),
-                FOREIGN KEY (id_usuario) REFERENCES usuarios(id_usuario),
-                FOREIGN KEY (id_destino) REFERENCES destinos(id_destino)
+                FOREIGN KEY (id_usuario) REFERENCES usuarios{suffix}(id_usuario),
+                FOREIGN KEY (id_destino) REFERENCES destinos{suffix}(id_destino)
             ) ENGINE=InnoDB;
-        """)
+        """),
+    ]
+
+
+def create_tables():
+    """Crea las tablas en MySQL."""
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+
+            # Usar ENGINE=InnoDB para soportar claves foráneas
+            for _, ddl in table_ddl():
+                cursor.execute(ddl)
 
-        conn.commit()
-        print("Tablas de la BD creadas o verificadas en MySQL.")
+            # Migración de tablas creadas antes de existir estas columnas
+            for table, column in (('destinos', 'embedding_hash CHAR(64)'), ('usuarios', 'version_datos DOUBLE')):
+                try:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+                except Error as e:
+                    if e.errno != errorcode.ER_DUP_FIELDNAME:
+                        raise
+
+            conn.commit()
+            print("Tablas de la BD creadas o verificadas en MySQL.")
 
     except Error as e:
         print(f"Error al crear tablas: {e}")
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
 
 if __name__ == '__main__':
     create_tables()
\ No newline at end of file
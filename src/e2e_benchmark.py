@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# --- BENCHMARK DE EXTREMO A EXTREMO ---
+# Corre el pipeline real (`main.app`, ETL, embeddings, entrenamiento CF) con
+# sustitutos locales: SQLite en lugar de MySQL (src/sqlite_backend.py) y un
+# Ollama simulado con latencia configurable (src/ollama_stub.py), sobre datos
+# de src/synthetic_data.py. Cada escala corre en un proceso aparte para que el
+# pico de RSS sea el de esa escala; además cada fase reporta cuánto creció ese
+# pico durante ella (`rss_delta_mb`, 0 si no superó el máximo anterior).
+# /recommend/user se mide dos veces: con la caché de respuestas apagada (el
+# pipeline completo) y luego repitiendo los mismos usuarios con la caché llena.
+# El resultado es JSON para comparar commits.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCALES = (1_000, 10_000)
+DEFAULT_QUERY_POOL = 50
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso hasta ahora (ru_maxrss está en KB en Linux)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize_latencies(latencies: list, wall_seconds: float, errors: int, rss_before: float = None) -> dict:
+    latencies_ms = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies_ms) else (None, None, None)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': None if p50 is None else round(float(p50), 2),
+        'p95_ms': None if p95 is None else round(float(p95), 2),
+        'p99_ms': None if p99 is None else round(float(p99), 2),
+        'mean_ms': round(float(latencies_ms.mean()), 2) if len(latencies_ms) else None,
+        'throughput_rps': round(len(latencies) / wall_seconds, 2) if wall_seconds > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_delta_mb': None if rss_before is None else round(peak_rss_mb() - rss_before, 1),
+    }
+
+
+def timed(fn, *args, rows: int = None, **kwargs) -> tuple:
+    """Ejecuta `fn` una vez; devuelve (resultado, métricas)."""
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    metrics = {'seconds': round(seconds, 3), 'peak_rss_mb': peak_rss_mb(),
+               'rss_delta_mb': round(peak_rss_mb() - rss_before, 1)}
+    if rows is not None:
+        metrics['rows'] = rows
+        metrics['rows_per_second'] = round(rows / seconds, 1) if seconds > 0 else None
+    return result, metrics
+
+
+async def load_test(app, make_request, total: int, concurrency: int) -> dict:
+    """`total` peticiones contra la app ASGI en proceso, con `concurrency` en vuelo."""
+    import httpx
+
+    rss_before = peak_rss_mb()
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=None) as client:
+        async def one(i):
+            nonlocal errors
+            method, url, params = make_request(i)
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.request(method, url, params=params)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        wall = time.perf_counter() - start
+    return summarize_latencies(latencies, wall, errors, rss_before)
+
+
+def run_scale(num_users: int, num_destinos: int, ratings_mean: float, requests: int, concurrency: int,
+              ollama_latency_ms: float, query_pool: int, workdir: str, seed: int = 42) -> dict:
+    """
+    Una escala completa dentro de este proceso: ETL -> entrenamiento CF ->
+    embeddings -> warm-up -> carga sobre los endpoints. `workdir` aísla la BD
+    SQLite, `models/` y la caché del LLM.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from src.ollama_stub import start_stub
+    stub = start_stub(latency_ms=ollama_latency_ms)
+    # Deben fijarse antes de importar los módulos que las leen
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['SQLITE_DB_PATH'] = os.path.join(workdir, 'benchmark.sqlite3')
+    os.environ['OLLAMA_API_URL'] = stub.url
+    os.environ['WARMUP_IN_BACKGROUND'] = '0'
+
+    from src.database import create_tables
+    from src.synthetic_data import SyntheticConfig, PREFERENCE_CLUSTERS, MEXICO_STATES, load_to_db
+    from src.cf_model import load_ratings_data, train_cf_model
+    from src.cb_model import generate_and_store_embeddings
+    from src import warmup
+    from src.response_cache import recommendation_cache
+    import main
+
+    config = SyntheticConfig(num_users=num_users, num_destinos=num_destinos, ratings_mean=ratings_mean,
+                             max_ratings=num_destinos, num_clusters=len(PREFERENCE_CLUSTERS), seed=seed)
+    operations = {}
+    create_tables()
+    etl_report, operations['etl'] = timed(load_to_db, config, method='insert')
+    n_ratings = etl_report.get('load:valoraciones', {}).get('rows', 0)
+    operations['etl']['rows'] = sum(entry['rows'] for stage, entry in etl_report.items() if stage.startswith('load:'))
+    operations['etl']['rows_per_second'] = round(operations['etl']['rows'] / max(operations['etl']['seconds'], 1e-9), 1)
+    operations['etl']['stages'] = etl_report
+
+    ratings_df = load_ratings_data()
+    _, operations['train_cf_model'] = timed(train_cf_model, ratings_df, rows=len(ratings_df))
+    _, operations['generate_and_store_embeddings'] = timed(
+        generate_and_store_embeddings, resume=False, rows=num_destinos
+    )
+    _, operations['warm_up'] = timed(warmup.warm_up)
+
+    rng = random.Random(seed)
+    user_ids = [rng.randint(1, num_users) for _ in range(requests)]
+    queries = [f"{PREFERENCE_CLUSTERS[i % len(PREFERENCE_CLUSTERS)]} en {MEXICO_STATES[i % len(MEXICO_STATES)]}"
+               for i in range(query_pool)]
+    query_choices = [rng.choice(queries) for _ in range(requests)]
+
+    def user_request(i):
+        return 'GET', f"/recommend/user/{user_ids[i]}", {'n': 10}
+
+    # Pipeline completo: sin caché de respuestas, cada petición calcula
+    cache_enabled = recommendation_cache.enabled
+    recommendation_cache.enabled = False
+    operations['/recommend/user'] = asyncio.run(load_test(main.app, user_request, requests, concurrency))
+    # Los mismos usuarios otra vez con la caché encendida: la primera pasada la
+    # llena y la segunda mide solo aciertos
+    recommendation_cache.enabled = True
+    asyncio.run(load_test(main.app, user_request, requests, concurrency))
+    stats_before = recommendation_cache.stats()
+    operations['/recommend/user (caché)'] = asyncio.run(load_test(main.app, user_request, requests, concurrency))
+    stats_after = recommendation_cache.stats()
+    operations['/recommend/user (caché)']['cache_hits'] = stats_after['hits'] - stats_before['hits']
+    operations['/recommend/user (caché)']['cache_misses'] = stats_after['misses'] - stats_before['misses']
+    recommendation_cache.enabled = cache_enabled
+    operations['/recommend/query'] = asyncio.run(load_test(
+        main.app,
+        lambda i: ('POST', "/recommend/query", {'query_text': query_choices[i], 'user_id': user_ids[i], 'n': 10}),
+        requests, concurrency
+    ))
+    operations['/recommend/query']['ollama_calls'] = stub.requests_served
+    stub.shutdown()
+    return {
+        'users': num_users,
+        'destinos': num_destinos,
+        'ratings': n_ratings,
+        'operations': operations,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scales=DEFAULT_SCALES, num_destinos: int = 2000, ratings_mean: float = 20.0,
+                  requests: int = 200, concurrency: int = 16, ollama_latency_ms: float = 200.0,
+                  query_pool: int = DEFAULT_QUERY_POOL, workdir: str = None) -> dict:
+    """Corre cada escala en un subproceso y junta los resultados."""
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix='e2e-benchmark-'))
+    results = []
+    for num_users in scales:
+        scale_dir = os.path.join(workdir, f"users-{num_users}")
+        os.makedirs(scale_dir, exist_ok=True)
+        output_path = os.path.join(scale_dir, 'result.json')
+        child_args = {
+            'num_users': num_users, 'num_destinos': num_destinos, 'ratings_mean': ratings_mean,
+            'requests': requests, 'concurrency': concurrency, 'ollama_latency_ms': ollama_latency_ms,
+            'query_pool': query_pool, 'workdir': scale_dir,
+        }
+        print(f"Escala {num_users} usuarios (log en {scale_dir}/benchmark.log)...")
+        with open(os.path.join(scale_dir, 'benchmark.log'), 'w') as log:
+            completed = subprocess.run(
+                [sys.executable, '-m', 'src.e2e_benchmark', '--child', json.dumps(child_args), '--json', output_path],
+                cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT
+            )
+        if completed.returncode != 0:
+            print(f"ATENCIÓN: La escala {num_users} falló (código {completed.returncode}); ver benchmark.log.")
+            results.append({'users': num_users, 'error': f"exit code {completed.returncode}"})
+            continue
+        with open(output_path) as f:
+            results.append(json.load(f))
+
+    return {
+        'benchmark': 'e2e',
+        'commit': _git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'destinos': num_destinos, 'ratings_mean': ratings_mean, 'requests': requests,
+            'concurrency': concurrency, 'ollama_latency_ms': ollama_latency_ms, 'query_pool': query_pool,
+        },
+        'scales': results,
+    }
+
+
+def print_summary(report: dict):
+    print(f"\n--- Benchmark E2E (commit {report['commit'] or '?'}) ---")
+    for scale in report['scales']:
+        if 'error' in scale:
+            print(f"{scale['users']} usuarios: ERROR ({scale['error']})")
+            continue
+        print(f"\n{scale['users']} usuarios, {scale['destinos']} destinos, {scale['ratings']} valoraciones")
+        for name, metrics in scale['operations'].items():
+            if 'p50_ms' in metrics:
+                print(f"  {name:<32} p50 {metrics['p50_ms']:>8} ms  p95 {metrics['p95_ms']:>8} ms  "
+                      f"p99 {metrics['p99_ms']:>8} ms  {metrics['throughput_rps']:>8} req/s  "
+                      f"errores {metrics['errors']}  RSS {metrics['peak_rss_mb']} MB (+{metrics['rss_delta_mb']})")
+            else:
+                print(f"  {name:<32} {metrics['seconds']:>8} s  RSS {metrics['peak_rss_mb']} MB (+{metrics['rss_delta_mb']})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo con SQLite y Ollama simulado.")
+    parser.add_argument('--users', type=int, nargs='+', default=list(DEFAULT_SCALES),
+                        help="Escalas (número de usuarios sintéticos).")
+    parser.add_argument('--destinos', type=int, default=2000)
+    parser.add_argument('--ratings-mean', type=float, default=20.0)
+    parser.add_argument('--requests', type=int, default=200, help="Peticiones por endpoint.")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--ollama-latency-ms', type=float, default=200.0)
+    parser.add_argument('--query-pool', type=int, default=DEFAULT_QUERY_POOL,
+                        help="Consultas distintas (las repetidas salen de la caché del LLM).")
+    parser.add_argument('--workdir', help="Directorio de trabajo (por defecto, uno temporal).")
+    parser.add_argument('--json', help="Ruta para guardar los resultados en JSON.")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_scale(**json.loads(args.child))
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        sys.exit(0)
+
+    report = run_benchmark(args.users, args.destinos, args.ratings_mean, args.requests, args.concurrency,
+                           args.ollama_latency_ms, args.query_pool, args.workdir)
+    print_summary(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados guardados en {args.json}")
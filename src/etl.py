@@ -1,13 +1,27 @@
 import pandas as pd
 import numpy as np
 import os
-from src.database import get_db_connection, create_tables
+import argparse
+import tempfile
+import time
+from contextlib import contextmanager
+from src.database import db_connection, get_db_connection, create_tables, table_ddl, TABLES, DB_CONFIG
+from src.catalog import mark_catalog_changed
+from src.ratings_index import mark_ratings_changed
 import mysql.connector
 from mysql.connector import Error
 
 # --- CONFIGURACIÓN DE ARCHIVOS ---
 INPUT_CSV = os.path.join('data', 'pueblosmagicos.csv')
 
+# --- CONFIGURACIÓN DEL ETL EN STREAMING ---
+ETL_CHUNK_SIZE = int(os.environ.get('ETL_CHUNK_SIZE', 10000))   # filas del CSV por bloque
+ETL_BATCH_SIZE = int(os.environ.get('ETL_BATCH_SIZE', 1000))    # filas por INSERT multi-fila
+# 'insert' (INSERT multi-fila) o 'load_data' (LOAD DATA LOCAL INFILE; requiere local_infile=1 en el servidor)
+ETL_LOAD_METHOD = os.environ.get('ETL_LOAD_METHOD', 'insert')
+SHADOW_SUFFIX = '_new'
+OLD_SUFFIX = '_old'
+
 def load_and_clean_data():
     """
     1. Extracción (E): Carga el CSV.
@@ -19,6 +33,23 @@ def load_and_clean_data():
     except FileNotFoundError:
         print(f"Error: No se encuentra el archivo {INPUT_CSV}. Asegúrate de que esté en la carpeta 'data'.")
         raise
+    return transform_destinos(df)
+
+
+def iter_clean_chunks(csv_path: str = INPUT_CSV, chunk_size: int = ETL_CHUNK_SIZE):
+    """Versión en streaming de `load_and_clean_data`: lee y transforma el CSV por bloques."""
+    try:
+        reader = pd.read_csv(csv_path, chunksize=chunk_size)
+    except FileNotFoundError:
+        print(f"Error: No se encuentra el archivo {csv_path}. Asegúrate de que esté en la carpeta 'data'.")
+        raise
+    for chunk in reader:
+        yield transform_destinos(chunk)
+
+
+def transform_destinos(df: pd.DataFrame) -> pd.DataFrame:
+    """Transformaciones (T) del CSV de destinos; vectorizadas, aplicables por bloque."""
+    df = df.copy()
     
     # --- Tareas de Transformación ---
     
@@ -84,6 +115,8 @@ def clear_data_for_reload(conn, cursor):
     """
     Borra los datos de las tablas en el orden inverso de la dependencia
     para evitar errores de Foreign Key. Usamos TRUNCATE para reiniciar los IDs.
+    `destinos` no se trunca: se actualiza en sitio (ver `upsert_destinos`) para
+    conservar los embeddings de las descripciones que no cambiaron.
     """
     print("\n--- Limpieza de Datos (TRUNCATE) ---")
     
@@ -99,73 +132,273 @@ def clear_data_for_reload(conn, cursor):
     try:
         cursor.execute("TRUNCATE TABLE usuarios")
         print("TRUNCATE TABLE usuarios: OK")
-        cursor.execute("TRUNCATE TABLE destinos")
-        print("TRUNCATE TABLE destinos: OK")
         cursor.execute("SET FOREIGN_KEY_CHECKS = 1;")
     except Error as e:
-        print(f"Error en TRUNCATE destinos/usuarios: {e}")
+        print(f"Error en TRUNCATE usuarios: {e}")
         
     conn.commit()
 
 
+def _clean_rows(df) -> list:
+    """Filas del DataFrame como tuplas con NaN -> None y tipos NumPy -> Python (vectorizado)."""
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def upsert_destinos(cursor, destinos_df):
+    """
+    Inserta o actualiza `destinos` sin tocar `embedding`/`embedding_hash` y borra
+    los destinos que ya no vienen en el CSV. La actualización incremental de
+    embeddings (`python -m src.cb_model --incremental`) detecta después qué
+    descripciones cambiaron comparando hashes, así que aquí no hace falta marcar
+    las filas modificadas (por eso `destinos` no tiene updated_at).
+    """
+    columns = destinos_df.columns.tolist()
+    updates = ', '.join(f"{col} = VALUES({col})" for col in columns if col != 'id_destino')
+    sql = (
+        f"INSERT INTO destinos ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON DUPLICATE KEY UPDATE {updates}"
+    )
+    cursor.executemany(sql, _clean_rows(destinos_df))
+
+    cursor.execute("SELECT id_destino FROM destinos")
+    stale_ids = set(row[0] for row in cursor.fetchall()) - set(destinos_df['id_destino'].tolist())
+    if stale_ids:
+        cursor.executemany("DELETE FROM destinos WHERE id_destino = %s", [(i,) for i in sorted(stale_ids)])
+    print(f"Carga en 'destinos': {len(destinos_df)} filas ({len(stale_ids)} eliminadas).")
+
+
 def load_data_to_db(destinos_df, users_df, valoraciones_df):
     """
     3. Carga (L): Limpia las tablas y carga los DataFrames en MySQL.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    # **********************************************
-    # PASO A: Limpieza Forzada
-    # **********************************************
-    clear_data_for_reload(conn, cursor) 
+        # **********************************************
+        # PASO A: Limpieza Forzada
+        # **********************************************
+        clear_data_for_reload(conn, cursor) 
     
-    def insert_data(df, table_name):
-        """Función genérica para insertar/reemplazar datos en MySQL."""
-        columns = df.columns.tolist()
+        def insert_data(df, table_name):
+            """Función genérica para insertar/reemplazar datos en MySQL."""
+            columns = df.columns.tolist()
         
-        # --- CORRECCIÓN CRÍTICA DE MANEJO DE NaN (Mantenemos esta lógica) ---
-        data = []
-        for index, row in df.iterrows():
-            clean_row = []
-            for value in row.values:
-                if pd.isna(value):
-                    clean_row.append(None)
-                elif isinstance(value, np.generic):
-                    clean_row.append(value.item())
-                else:
-                    clean_row.append(value)
-            data.append(tuple(clean_row))
-        # ----------------------------------------------
+            # --- CORRECCIÓN CRÍTICA DE MANEJO DE NaN (Mantenemos esta lógica) ---
+            data = _clean_rows(df)
         
-        sql = f"REPLACE INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
-        try:
-            cursor.executemany(sql, data)
-            print(f"Carga en '{table_name}': {len(df)} filas.")
-        except Error as e:
-            print(f"Error al ejecutar execuremany en {table_name}: {e}")
-            raise e
+            sql = f"REPLACE INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+            try:
+                cursor.executemany(sql, data)
+                print(f"Carga en '{table_name}': {len(df)} filas.")
+            except Error as e:
+                print(f"Error al ejecutar execuremany en {table_name}: {e}")
+                raise e
 
-    print("\n--- Carga de Datos (Orden de Dependencia) ---")
+        print("\n--- Carga de Datos (Orden de Dependencia) ---")
 
-    # **********************************************
-    # PASO B: Carga en orden (Padres primero)
-    # **********************************************
-    print("Cargando tabla 'destinos' (Padre 1)...")
-    insert_data(destinos_df, 'destinos')
+        # **********************************************
+        # PASO B: Carga en orden (Padres primero)
+        # **********************************************
+        print("Cargando tabla 'destinos' (Padre 1)...")
+        upsert_destinos(cursor, destinos_df)
     
-    print("Cargando tabla 'usuarios' (Padre 2)...")
-    insert_data(users_df, 'usuarios')
+        print("Cargando tabla 'usuarios' (Padre 2)...")
+        insert_data(users_df, 'usuarios')
     
-    # 3. Cargar la tabla "hijo" (Valoraciones) al final
-    print("Cargando tabla 'valoraciones' (Hijo)...")
-    insert_data(valoraciones_df, 'valoraciones')
+        # 3. Cargar la tabla "hijo" (Valoraciones) al final
+        print("Cargando tabla 'valoraciones' (Hijo)...")
+        insert_data(valoraciones_df, 'valoraciones')
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+    # Los procesos del API recargan el catálogo de destinos en memoria
+    mark_catalog_changed()
+    mark_ratings_changed()
+    print("\nTodos los datos de ETL cargados exitosamente a MySQL.")
+
+# --- ETL EN STREAMING CON TABLAS SOMBRA ---
+
+class ETLStats:
+    """Contadores de filas y tiempo por etapa del ETL."""
+
+    def __init__(self):
+        self.stages = {}  # etapa -> {'rows': ..., 'seconds': ...}
+
+    def add(self, stage: str, rows: int = 0, seconds: float = 0.0):
+        entry = self.stages.setdefault(stage, {'rows': 0, 'seconds': 0.0})
+        entry['rows'] += rows
+        entry['seconds'] += seconds
+
+    @contextmanager
+    def stage(self, stage: str, rows: int = 0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, rows, time.perf_counter() - start)
+
+    def timed_chunks(self, stage: str, chunks):
+        """Recorre un iterable de DataFrames midiendo el tiempo de producir cada bloque."""
+        iterator = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                self.add(stage, 0, time.perf_counter() - start)
+                return
+            self.add(stage, len(chunk), time.perf_counter() - start)
+            yield chunk
+
+    def report(self) -> dict:
+        return {
+            stage: {
+                'rows': entry['rows'],
+                'seconds': round(entry['seconds'], 3),
+                'rows_per_second': round(entry['rows'] / entry['seconds'], 1) if entry['seconds'] > 0 else None,
+            }
+            for stage, entry in self.stages.items()
+        }
+
+    def print_report(self):
+        print("\n--- Resumen del ETL por etapa ---")
+        for stage, entry in self.report().items():
+            rate = f"{entry['rows_per_second']:.0f} filas/s" if entry['rows_per_second'] else "-"
+            print(f"{stage:<32} {entry['rows']:>10} filas  {entry['seconds']:>8.2f} s  {rate}")
+
+
+def chunk_frame(df: pd.DataFrame, chunk_size: int = ETL_CHUNK_SIZE):
+    """Parte un DataFrame ya en memoria en bloques, para el cargador en streaming."""
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+def insert_rows(cursor, table_name: str, df: pd.DataFrame, batch_size: int = ETL_BATCH_SIZE):
+    """Inserta el bloque con sentencias INSERT de `batch_size` filas cada una."""
+    columns = df.columns.tolist()
+    rows = _clean_rows(df)
+    row_sql = f"({', '.join(['%s'] * len(columns))})"
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cursor.execute(
+            f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES {', '.join([row_sql] * len(batch))}",
+            [value for row in batch for value in row]
+        )
+
+
+def _tsv_field(value) -> str:
+    """Valor en el formato por defecto de LOAD DATA (tabuladores, escapes con barra invertida)."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+
+def load_data_infile(cursor, table_name: str, df: pd.DataFrame):
+    """Carga el bloque con LOAD DATA LOCAL INFILE a partir de un archivo temporal."""
+    columns = df.columns.tolist()
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False, encoding='utf-8', newline='') as f:
+        f.writelines('\t'.join(map(_tsv_field, row)) + '\n' for row in _clean_rows(df))
+        path = f.name
+    try:
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {table_name} CHARACTER SET utf8mb4 ({', '.join(columns)})",
+            (path,)
+        )
+    finally:
+        os.remove(path)
+
+
+def create_shadow_tables(cursor):
+    """Crea tablas `*_new` vacías (borrando restos de una carga fallida)."""
+    for table in reversed(TABLES):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}{SHADOW_SUFFIX}")
+    for _, ddl in table_ddl(SHADOW_SUFFIX):
+        cursor.execute(ddl)
+
+
+def swap_shadow_tables(cursor):
+    """
+    Intercambia las tablas sombra por las vigentes con un solo RENAME TABLE
+    (atómico), y después borra las anteriores. Las claves foráneas siguen a las
+    tablas renombradas.
+    """
+    for table in reversed(TABLES):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}{OLD_SUFFIX}")
+    cursor.execute("RENAME TABLE " + ", ".join(
+        f"{table} TO {table}{OLD_SUFFIX}, {table}{SHADOW_SUFFIX} TO {table}" for table in TABLES
+    ))
+    for table in reversed(TABLES):
+        cursor.execute(f"DROP TABLE {table}{OLD_SUFFIX}")
+
+
+def _etl_connection(method: str):
+    if method == 'load_data':
+        # Conexión dedicada: LOAD DATA LOCAL no se habilita en el pool del API
+        return mysql.connector.connect(**DB_CONFIG, allow_local_infile=True)
+    return get_db_connection()
+
+
+def load_data_streaming(destinos_chunks, users_chunks, valoraciones_chunks,
+                        method: str = ETL_LOAD_METHOD, batch_size: int = ETL_BATCH_SIZE) -> dict:
+    """
+    3. Carga (L) en streaming: recibe iterables de DataFrames (p. ej. `iter_clean_chunks()`),
+    los carga por bloques en tablas sombra y las intercambia al final. El API sigue
+    leyendo las tablas anteriores, completas, hasta el RENAME. Devuelve los contadores.
+    """
+    if method not in ('insert', 'load_data'):
+        raise ValueError(f"Método de carga desconocido: '{method}'. Opciones: 'insert', 'load_data'.")
+    stats = ETLStats()
+    conn = _etl_connection(method)
+    try:
+        cursor = conn.cursor()
+        create_shadow_tables(cursor)
+
+        print(f"\n--- Carga en streaming a tablas sombra ({method}) ---")
+        for table, chunks in zip(TABLES, (destinos_chunks, users_chunks, valoraciones_chunks)):
+            loaded = 0
+            for chunk in stats.timed_chunks(f"extract_transform:{table}", chunks):
+                with stats.stage(f"load:{table}", rows=len(chunk)):
+                    if method == 'load_data':
+                        load_data_infile(cursor, table + SHADOW_SUFFIX, chunk)
+                    else:
+                        insert_rows(cursor, table + SHADOW_SUFFIX, chunk, batch_size)
+                    conn.commit()
+                loaded += len(chunk)
+            print(f"Carga en '{table}{SHADOW_SUFFIX}': {loaded} filas.")
+
+        # Conserva los embeddings vigentes; la actualización incremental decide qué re-codificar
+        with stats.stage("carry_embeddings"):
+            cursor.execute(
+                f"UPDATE destinos{SHADOW_SUFFIX} n JOIN destinos d ON n.id_destino = d.id_destino "
+                "SET n.embedding = d.embedding, n.embedding_hash = d.embedding_hash"
+            )
+            conn.commit()
+
+        with stats.stage("swap"):
+            swap_shadow_tables(cursor)
+            conn.commit()
+    except Error as e:
+        print(f"Error de MySQL en la carga en streaming: {e}")
+        raise e
+    finally:
+        conn.close()
+
+    # Los procesos del API recargan el catálogo de destinos en memoria
+    mark_catalog_changed()
+    mark_ratings_changed()
+    stats.print_report()
     print("\nTodos los datos de ETL cargados exitosamente a MySQL.")
+    return stats.report()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ETL de destinos, usuarios y valoraciones.")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Carga por bloques en tablas sombra y las intercambia con RENAME TABLE.")
+    parser.add_argument('--method', choices=['insert', 'load_data'], default=ETL_LOAD_METHOD)
+    parser.add_argument('--batch-size', type=int, default=ETL_BATCH_SIZE)
+    args = parser.parse_args()
+
     print("--- 1. Creación de Tablas ---")
     create_tables()
     
@@ -174,6 +407,12 @@ if __name__ == '__main__':
     
     print("\n--- 3. Carga de Datos a MySQL ---")
     try:
-        load_data_to_db(destinos, users, valoraciones)
+        if args.streaming:
+            load_data_streaming(
+                iter_clean_chunks(), chunk_frame(users), chunk_frame(valoraciones),
+                method=args.method, batch_size=args.batch_size
+            )
+        else:
+            load_data_to_db(destinos, users, valoraciones)
     except Error:
         print("\n**¡ERROR CRÍTICO!** Falló la carga de datos. Revisa la configuración en src/database.py.")
\ No newline at end of file
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+
+# --- ÍNDICE ESPACIAL DE DESTINOS ---
+# Rejilla lat/lng (tipo geohash) sobre las coordenadas del catálogo: cada destino
+# cae en una celda de GEO_CELL_KM de lado (en latitud) y las posiciones se
+# ordenan por (fila, columna). Una consulta por radio recorre solo las filas de
+# celdas que toca el círculo, toma de cada fila un rango contiguo con
+# `searchsorted` y calcula la distancia haversine exacta solo a esos destinos.
+# Son arreglos NumPy que se construyen junto con el catálogo (src/catalog.py).
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+GEO_CELL_KM = float(os.environ.get('GEO_CELL_KM', 25))
+# Mitad de la circunferencia: ningún punto está más lejos
+MAX_DISTANCE_KM = np.pi * EARTH_RADIUS_KM
+
+
+def build_geo_index(lat: np.ndarray, lng: np.ndarray, cell_km: float = GEO_CELL_KM) -> dict:
+    """
+    Construye la rejilla sobre los arreglos del catálogo (índice denso). Los
+    destinos sin coordenadas (NaN) quedan fuera de las búsquedas por cercanía.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    cell_deg = cell_km / KM_PER_DEGREE
+    n_cols = int(np.ceil(360 / cell_deg))
+
+    positions = np.flatnonzero(np.isfinite(lat) & np.isfinite(lng))
+    keys = _cell_rows(lat[positions], cell_deg) * n_cols + _cell_cols(lng[positions], cell_deg, n_cols)
+    order = np.argsort(keys, kind='stable')
+    positions = positions[order]
+    return {
+        'cell_deg': cell_deg,
+        'n_cols': n_cols,
+        'keys': keys[order],
+        'positions': positions,
+        'lat_rad': np.radians(lat[positions]),
+        'lng_rad': np.radians(lng[positions]),
+    }
+
+
+def _cell_rows(lat, cell_deg: float) -> np.ndarray:
+    return np.floor((np.clip(lat, -90, 90) + 90) / cell_deg).astype(np.int64)
+
+
+def _cell_cols(lng, cell_deg: float, n_cols: int) -> np.ndarray:
+    return np.floor((np.mod(lng + 180, 360)) / cell_deg).astype(np.int64) % n_cols
+
+
+def haversine_km(lat: float, lng: float, lat_rad: np.ndarray, lng_rad: np.ndarray) -> np.ndarray:
+    """Distancia en km de (lat, lng) en grados a puntos dados en radianes."""
+    lat0, lng0 = np.radians(lat), np.radians(lng)
+    a = (np.sin((lat_rad - lat0) / 2) ** 2
+         + np.cos(lat0) * np.cos(lat_rad) * np.sin((lng_rad - lng0) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _cell_candidates(geo: dict, lat: float, lng: float, radius_km: float) -> np.ndarray:
+    """Índices (en el orden de la rejilla) de los destinos en celdas que toca el círculo."""
+    cell_deg, n_cols = geo['cell_deg'], geo['n_cols']
+    dlat = radius_km / KM_PER_DEGREE
+    rows = np.arange(_cell_rows(lat - dlat, cell_deg), _cell_rows(lat + dlat, cell_deg) + 1)
+
+    # Ancho en longitud en la latitud más alejada del ecuador que toca el círculo
+    max_abs_lat = min(abs(lat) + dlat, 90.0)
+    cos_lat = np.cos(np.radians(max_abs_lat))
+    dlng = radius_km / (KM_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 360.0
+    if dlng >= 180:
+        col_ranges = [(0, n_cols - 1)]
+    else:
+        first, last = _cell_cols(lng - dlng, cell_deg, n_cols), _cell_cols(lng + dlng, cell_deg, n_cols)
+        # El círculo cruza el antimeridiano: dos rangos de columnas
+        col_ranges = [(first, last)] if first <= last else [(first, n_cols - 1), (0, last)]
+
+    keys = geo['keys']
+    slices = []
+    for first, last in col_ranges:
+        starts = np.searchsorted(keys, rows * n_cols + first, side='left')
+        ends = np.searchsorted(keys, rows * n_cols + last, side='right')
+        slices.extend(np.arange(start, end) for start, end in zip(starts, ends) if end > start)
+    return np.concatenate(slices) if slices else np.zeros(0, dtype=np.int64)
+
+
+def query_radius(geo: dict, lat: float, lng: float, radius_km: float) -> tuple:
+    """
+    Destinos a `radius_km` o menos de (lat, lng). Devuelve (posiciones en el
+    catálogo, distancias en km), ordenadas por posición.
+    """
+    candidates = _cell_candidates(geo, lat, lng, min(radius_km, MAX_DISTANCE_KM))
+    distances = haversine_km(lat, lng, geo['lat_rad'][candidates], geo['lng_rad'][candidates])
+    inside = distances <= radius_km
+    positions, distances = geo['positions'][candidates[inside]], distances[inside]
+    order = np.argsort(positions)
+    return positions[order], distances[order]
+
+
+def query_nearest(geo: dict, lat: float, lng: float, k: int) -> tuple:
+    """
+    Los `k` destinos más cercanos a (lat, lng): el radio se duplica desde una
+    celda hasta reunir k candidatos. Devuelve (posiciones, distancias en km),
+    ordenadas por posición.
+    """
+    k = min(k, len(geo['positions']))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    radius_km = geo['cell_deg'] * KM_PER_DEGREE
+    positions, distances = query_radius(geo, lat, lng, radius_km)
+    while len(positions) < k and radius_km < MAX_DISTANCE_KM:
+        radius_km *= 2
+        positions, distances = query_radius(geo, lat, lng, radius_km)
+    if len(positions) > k:
+        nearest = np.sort(np.argpartition(distances, k - 1)[:k])
+        positions, distances = positions[nearest], distances[nearest]
+    return positions, distances
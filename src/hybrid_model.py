@@ -1,161 +1,435 @@
+import asyncio
 import pandas as pd
 import numpy as np
-from src.cf_model import get_cf_scores 
-from src.cb_model import get_cb_scores
-from src.llm_processor import get_expanded_query
-from src.database import get_db_connection
+from src.cf_model import get_cf_score_arrays
+from src.cb_model import get_cb_score_arrays_batch, cb_batcher
+from src.llm_processor import get_expanded_query, get_expanded_query_async
+from src.database import db_connection, get_db_connection
+from src.catalog import get_catalog, positions_of, nearby_positions
+from src.concurrency import run_io, run_cpu
+from src import metrics
+from src.response_cache import recommendation_cache
+from src import materialize
+from src.user_versions import bump_user_version, get_user_versions
+from src.metrics import CACHE_LOOKUPS
 from mysql.connector import Error
 
 ALPHA_DEFAULT = 0.5 
+ALPHA_QUERY = 0.2
+DEFAULT_PREFERENCES = "cultura, naturaleza, turismo"
+NEUTRAL_SCORE = 3.0  # Valor neutro para destinos sin score CF o CB
 
-def clean_dataframe_for_json(df):
-    """
-    Limpia un DataFrame de valores problemáticos para JSON.
-    """
-    # Reemplazar infinitos con NaN primero
-    df = df.replace([np.inf, -np.inf], np.nan)
-    # Reemplazar NaN con un valor seguro (3.0)
-    df = df.fillna(3.0)
-    return df
 
-def get_hybrid_recommendations(user_id: int, top_n: int = 10, query_text: str = None) -> list:
+def get_hybrid_recommendations(user_id: int, top_n: int = 10, query_text: str = None, conn=None,
+                               location: tuple = None) -> list:
     """
     Implementa el modelo híbrido de recomendación.
     Score Final = alpha * Score_CF + (1 - alpha) * Score_contenido
+
+    Toda la petición usa una sola conexión del pool (o `conn`, si se recibe).
+    `location` = (lat, lng, radius_km o None) limita los candidatos a los
+    destinos cercanos antes de puntuar (ver `_nearby_candidates`).
     """
-    
-    # 1. Ajuste Dinámico de Alpha y Expansión de Consulta
-    if query_text:
-        alpha_dynamic = 0.2
-        try:
+    try:
+        with db_connection(conn) as conn:
+            return _get_hybrid_recommendations(conn, user_id, top_n, query_text, location)
+    except Error as e:
+        print(f"Error al obtener una conexión a MySQL: {e}")
+        return []
+
+
+def _expand_query(query_text: str) -> str:
+    """Expansión de la consulta con el LLM; si falla, se usa la consulta original."""
+    try:
+        with metrics.span('llm_expansion'):
             expanded_query = get_expanded_query(query_text) 
-            if not expanded_query.strip():
-                expanded_query = query_text
-        except Exception as e:
-            print(f"ATENCIÓN: Fallo al llamar al LLM. Usando query original. Error: {e}")
+        if not expanded_query.strip():
             expanded_query = query_text
-    else:
-        alpha_dynamic = ALPHA_DEFAULT 
-        
-        conn = None
-        try:
-            conn = get_db_connection()
+    except Exception as e:
+        print(f"ATENCIÓN: Fallo al llamar al LLM. Usando query original. Error: {e}")
+        expanded_query = query_text
+    return expanded_query
+
+
+async def _expand_query_async(query_text: str) -> str:
+    """Igual que `_expand_query`, pero sin bloquear el event loop."""
+    try:
+        expanded_query = await metrics.timed('llm_expansion', get_expanded_query_async(query_text))
+        if not expanded_query.strip():
+            expanded_query = query_text
+    except Exception as e:
+        print(f"ATENCIÓN: Fallo al llamar al LLM. Usando query original. Error: {e}")
+        expanded_query = query_text
+    return expanded_query
+
+
+def _get_user_preferences(conn, user_id: int) -> tuple:
+    """
+    (texto de preferencias del usuario, versiones) para la consulta CB cuando no
+    hay query. La versión del usuario sale en la misma consulta y se pasa al CF
+    (ver `ratings_index.user_ratings`); vacía si no se pudo leer.
+    """
+    try:
+        with metrics.span('preference_lookup'):
             user_pref_df = pd.read_sql_query(
-                "SELECT preferencias_texto FROM usuarios WHERE id_usuario = %s", 
+                "SELECT preferencias_texto, version_datos FROM usuarios WHERE id_usuario = %s", 
                 conn, 
                 params=(user_id,)
             )
-            expanded_query = user_pref_df['preferencias_texto'].iloc[0] if not user_pref_df.empty else "cultura, naturaleza, turismo"
-        except Exception as e:
-            print(f"ATENCIÓN: Fallo al obtener preferencias del usuario. Usando fallback. Error: {e}")
-            expanded_query = "cultura, naturaleza, turismo" 
-        finally:
-            if conn:
-                conn.close()
-    
-    # 2. Obtener Scores
-    cf_scores = get_cf_scores(user_id) 
-    cb_scores = get_cb_scores(expanded_query)
-    
-    # DEBUG: Verificar Inf INMEDIATAMENTE después de obtener scores
-    print(f"DEBUG - CF tiene Inf: {np.isinf(cf_scores.values).any()}")
-    print(f"DEBUG - CB tiene Inf: {np.isinf(cb_scores.values).any()}")
-    
-    # Limpiar INMEDIATAMENTE después de obtener
-    cf_scores = cf_scores.replace([np.inf, -np.inf], 3.0).fillna(3.0)
-    cb_scores = cb_scores.replace([np.inf, -np.inf], 3.0).fillna(3.0)
-    
-    print(f"DEBUG - CF después de limpiar tiene Inf: {np.isinf(cf_scores.values).any()}")
-    print(f"DEBUG - CB después de limpiar tiene Inf: {np.isinf(cb_scores.values).any()}")
+        if user_pref_df.empty:
+            return DEFAULT_PREFERENCES, {}
+        return user_pref_df['preferencias_texto'].iloc[0], {user_id: _version_or_none(user_pref_df['version_datos'].iloc[0])}
+    except Exception as e:
+        print(f"ATENCIÓN: Fallo al obtener preferencias del usuario. Usando fallback. Error: {e}")
+        return DEFAULT_PREFERENCES, {}
+
+
+def _version_or_none(version):
+    return None if pd.isna(version) else float(version)
+
+
+def _read_user_preferences(user_id: int) -> tuple:
+    """`_get_user_preferences` con su propia conexión, devuelta antes de puntuar."""
+    with metrics.span('db_checkout'):
+        conn = get_db_connection()
+    try:
+        return _get_user_preferences(conn, user_id)
+    finally:
+        conn.close()
+
+
+def update_user_preferences(user_id: int, preferencias_texto: str, conn=None) -> dict:
+    """
+    Actualiza el texto de preferencias del usuario; la versión nueva invalida sus
+    respuestas cacheadas y su top-K precalculado. Lanza LookupError si el usuario no existe.
+    """
+    with db_connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "UPDATE usuarios SET preferencias_texto = %s WHERE id_usuario = %s",
+                (preferencias_texto, user_id)
+            )
+            # MySQL cuenta 0 filas si el texto no cambió: se confirma que el usuario exista
+            if cursor.rowcount == 0:
+                cursor.execute("SELECT 1 FROM usuarios WHERE id_usuario = %s", (user_id,))
+                if cursor.fetchone() is None:
+                    raise LookupError(f"El usuario {user_id} no existe.")
+            # Todos los procesos dejan de servir su top-K precalculado y sus respuestas cacheadas
+            bump_user_version(cursor, user_id)
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+    return {'user_id': user_id, 'preferencias_texto': preferencias_texto}
+
+
+def _nearby_candidates(location: tuple):
+    """
+    Posiciones del catálogo (ordenadas) cerca de `location` = (lat, lng,
+    radius_km); sin radio, los GEO_NEAREST_K destinos más cercanos. None si la
+    petición no tiene ubicación (se puntúa todo el catálogo).
+    """
+    if location is None:
+        return None
+    lat, lng, radius_km = location
+    with metrics.span('geo_filter'):
+        return nearby_positions(get_catalog(), lat, lng, radius_km)
+
+
+def _get_hybrid_recommendations(conn, user_id: int, top_n: int, query_text: str, location: tuple = None) -> list:
     
-    # 3. Fusión y Normalización de Scores
-    merged_scores = pd.merge(
-        cf_scores.reset_index(), 
-        cb_scores.reset_index(), 
-        on='id_destino', 
-        how='outer'
-    )
+    # 0. Candidatos cercanos: CF y CB solo puntúan esos destinos
+    positions = _nearby_candidates(location)
+    if positions is not None and len(positions) == 0:
+        return []
+
+    # 1. Ajuste Dinámico de Alpha y Expansión de Consulta
+    if query_text:
+        alpha_dynamic = ALPHA_QUERY
+        expanded_query = _expand_query(query_text)
+        versions = None
+    else:
+        alpha_dynamic = ALPHA_DEFAULT 
+        expanded_query, versions = _get_user_preferences(conn, user_id)
     
-    # Rellenar faltantes con valor neutro
-    merged_scores['score_cf'] = merged_scores['score_cf'].fillna(3.0)
-    merged_scores['score_contenido'] = merged_scores['score_contenido'].fillna(3.0)
+    # 2. Obtener Scores (arreglos alineados con el catálogo)
+    with metrics.span('cf_scoring'):
+        cf_scores, cf_present = get_cf_score_arrays([user_id], conn=conn, positions=positions, versions=versions)
+    cb_positions, cb_scores = get_cb_score_arrays_batch([expanded_query], positions=[positions])[0]
     
-    # Aplicar la fórmula híbrida
-    merged_scores['score_final'] = (
-        alpha_dynamic * merged_scores['score_cf'] + 
-        (1 - alpha_dynamic) * merged_scores['score_contenido']
+    return _fuse_and_serialize(cf_scores[0], cf_present[0], cb_positions, cb_scores, alpha_dynamic, top_n,
+                               positions)
+
+
+async def get_hybrid_recommendations_async(user_id: int, top_n: int = 10, query_text: str = None,
+                                           location: tuple = None) -> list:
+    """
+    Versión no bloqueante de `get_hybrid_recommendations` para los endpoints de FastAPI.
+    - MySQL corre en el ejecutor de E/S y la fusión en el de CPU; encode/search FAISS se agrupan
+      en micro-lotes (`cb_batcher`) que corren en el ejecutor de CPU.
+    - Con consulta, el scoring CF corre en paralelo con la expansión del LLM.
+    - Sin consulta, CF y CB corren en paralelo tras leer las preferencias.
+    - Con `location`, CF y CB solo puntúan los destinos cercanos.
+    Las conexiones del pool solo las retienen hilos de E/S mientras consultan:
+    nunca se retienen entre `await` (LLM, micro-lote CB).
+    """
+    positions = _nearby_candidates(location)
+    if positions is not None and len(positions) == 0:
+        return []
+
+    if query_text:
+        alpha_dynamic = ALPHA_QUERY
+        (cf_scores, cf_present), expanded_query = await asyncio.gather(
+            metrics.timed('cf_scoring', run_io(get_cf_score_arrays, [user_id], positions=positions)),
+            _expand_query_async(query_text)
+        )
+        # Incluye la espera del micro-lote; encode/search se miden dentro del lote
+        cb_positions, cb_scores = await metrics.timed(
+            'cb_scoring', cb_batcher.get_cb_score_arrays(expanded_query, positions=positions)
+        )
+    else:
+        alpha_dynamic = ALPHA_DEFAULT
+        try:
+            expanded_query, versions = await run_io(_read_user_preferences, user_id)
+        except Error as e:
+            print(f"Error al obtener una conexión a MySQL: {e}")
+            return []
+
+        # El CF ya tiene la versión del usuario: solo toma una conexión si debe releer sus valoraciones
+        (cf_scores, cf_present), (cb_positions, cb_scores) = await asyncio.gather(
+            metrics.timed('cf_scoring', run_io(get_cf_score_arrays, [user_id], positions=positions,
+                                               versions=versions)),
+            metrics.timed('cb_scoring', cb_batcher.get_cb_score_arrays(expanded_query, positions=positions))
+        )
+
+    # La fusión y los metadatos ya no necesitan la conexión (catálogo en memoria)
+    return await run_cpu(
+        _fuse_and_serialize, cf_scores[0], cf_present[0], cb_positions, cb_scores, alpha_dynamic, top_n, positions
     )
+
+
+def _get_materialized_recommendations(user_id: int, top_n: int, versions: dict = None):
+    """Top-N precalculado, ya serializado; None si hay que calcularlo en vivo (sin `versions` lee MySQL: ejecutor de E/S)."""
+    with metrics.span('materialized_lookup'):
+        materialized = materialize.lookup(user_id, top_n, versions=versions)
+        if materialized is None:
+            CACHE_LOOKUPS.inc(cache='materialized', result='misses')
+            return None
+        CACHE_LOOKUPS.inc(cache='materialized', result='hits')
+        destino_ids, final_scores = materialized
+        catalog = get_catalog()
+        positions, found = positions_of(catalog, destino_ids)
+        return _serialize_recommendations(catalog, positions[found], final_scores[found])
+
+
+async def get_user_recommendations_async(user_id: int, top_n: int = 10, location: tuple = None) -> list:
+    """
+    Recomendaciones sin consulta (/recommend/user) con caché de respuestas: se
+    recalculan solo si el usuario valoró algo, cambió sus preferencias o se
+    publicó un modelo/índice nuevo (ver src/response_cache.py). En un fallo de
+    caché se usa el precálculo del job (src/materialize.py) y, si no está o
+    quedó viejo, el scoring en vivo. Con `location` se puntúan en vivo solo los
+    destinos cercanos (ni la caché ni el precálculo dependen de la ubicación).
+    """
+    if location is not None:
+        return await get_hybrid_recommendations_async(user_id, top_n, location=location)
+    # Una sola lectura de la versión del usuario para la caché y el precálculo
+    try:
+        versions = await metrics.timed('user_version', run_io(get_user_versions, [user_id]))
+    except Error as e:
+        print(f"ATENCIÓN: No se pudo leer la versión del usuario {user_id}; se calcula en vivo. Error: {e}")
+        return await get_hybrid_recommendations_async(user_id, top_n)
+    key, cached = await recommendation_cache.lookup_async(user_id, top_n, versions.get(user_id))
+    if cached is not None:
+        return cached
+    recommendations = await run_io(_get_materialized_recommendations, user_id, top_n, versions)
+    if recommendations is None:
+        recommendations = await get_hybrid_recommendations_async(user_id, top_n)
+    # Las respuestas vacías (usuario inexistente, error de BD) no se guardan
+    if recommendations:
+        await recommendation_cache.store_async(key, recommendations)
+    return recommendations
+
+
+def _get_user_preferences_batch(conn, user_ids: list) -> tuple:
+    """
+    Preferencias y versiones de varios usuarios en una sola consulta:
+    (id_usuario -> texto, id_usuario -> versión o None).
+    """
+    if not user_ids:
+        return {}, {}
+    try:
+        format_strings = ','.join(['%s'] * len(user_ids))
+        with metrics.span('preference_lookup'):
+            user_pref_df = pd.read_sql_query(
+                f"SELECT id_usuario, preferencias_texto, version_datos FROM usuarios WHERE id_usuario IN ({format_strings})",
+                conn,
+                params=list(user_ids)
+            )
+        versions = {
+            int(user_id): _version_or_none(version)
+            for user_id, version in zip(user_pref_df['id_usuario'].tolist(), user_pref_df['version_datos'].tolist())
+        }
+        user_pref_df = user_pref_df.dropna(subset=['preferencias_texto'])
+        return dict(zip(user_pref_df['id_usuario'].tolist(), user_pref_df['preferencias_texto'].tolist())), versions
+    except Exception as e:
+        print(f"ATENCIÓN: Fallo al obtener preferencias de los usuarios. Usando fallback. Error: {e}")
+        return {}, {}
+
+
+def get_hybrid_recommendations_batch(requests: list, top_n: int = 10, expanded_queries: dict = None, conn=None) -> list:
+    """
+    Recomendaciones híbridas para muchos usuarios en una sola llamada.
+    `requests` es una lista de dicts {'user_id': int, 'query_text': str opcional}.
+    - Preferencias: una sola consulta SQL para todo el lote.
+    - CF: un producto matriz-matriz (`get_cf_scores_batch`).
+    - CB: un solo encode + `index.search` sobre los textos distintos del lote.
+    - Metadatos: una sola consulta para la unión de todos los top-N.
+    `expanded_queries` permite pasar expansiones del LLM ya calculadas (consulta -> texto).
+    """
+    try:
+        with db_connection(conn) as conn:
+            return _get_hybrid_recommendations_batch(conn, requests, top_n, dict(expanded_queries or {}))
+    except Error as e:
+        print(f"Error al obtener una conexión a MySQL: {e}")
+        return [_batch_result(request, []) for request in requests]
+
+
+def _batch_result(request: dict, recommendations: list) -> dict:
+    return {
+        "user_id": request['user_id'],
+        "query": request.get('query_text'),
+        "total_recommendations": len(recommendations),
+        "recommendations": recommendations
+    }
+
+
+def _get_hybrid_recommendations_batch(conn, requests: list, top_n: int, expanded_queries: dict) -> list:
+    if not requests:
+        return []
+    user_ids = [request['user_id'] for request in requests]
     
-    print(f"DEBUG - merged_scores tiene Inf: {np.isinf(merged_scores.values).any()}")
-    
-    # CRÍTICO: Limpiar Inf/NaN ANTES de ordenar
-    merged_scores = clean_dataframe_for_json(merged_scores)
+    # 1. Alpha y texto CB de cada petición; la misma consulta trae la versión de
+    # todos los usuarios del lote para el CF
+    preferences, versions = _get_user_preferences_batch(conn, list(dict.fromkeys(user_ids)))
     
-    print(f"DEBUG - merged_scores después de clean tiene Inf: {np.isinf(merged_scores.values).any()}")
+    alphas, cb_texts = [], []
+    for request in requests:
+        query_text = request.get('query_text')
+        if query_text:
+            if query_text not in expanded_queries:
+                expanded_queries[query_text] = _expand_query(query_text)
+            alphas.append(ALPHA_QUERY)
+            cb_texts.append(expanded_queries[query_text])
+        else:
+            alphas.append(ALPHA_DEFAULT)
+            cb_texts.append(preferences.get(request['user_id'], DEFAULT_PREFERENCES))
     
-    # 4. Obtener los destinos top
-    final_recommendations = merged_scores.sort_values(
-        by='score_final', 
-        ascending=False
-    ).head(top_n)
+    # 2. Scores CF y CB por lotes
+    with metrics.span('cf_scoring'):
+        cf_scores, cf_present = get_cf_score_arrays(user_ids, conn=conn, versions=versions)
+    unique_texts = list(dict.fromkeys(cb_texts))
+    cb_by_text = dict(zip(unique_texts, get_cb_score_arrays_batch(unique_texts)))
     
-    # 5. Preparar para merge
-    final_scores_for_merge = final_recommendations[['id_destino', 'score_final']].copy()
+    # 3-6. Fusión por usuario; los metadatos salen del catálogo en memoria
+    results = []
+    for i, (request, text, alpha) in enumerate(zip(requests, cb_texts, alphas)):
+        cb_positions, cb_scores = cb_by_text[text]
+        recommendations = _fuse_and_serialize(cf_scores[i], cf_present[i], cb_positions, cb_scores, alpha, top_n)
+        results.append(_batch_result(request, recommendations))
+    return results
+
+
+async def get_hybrid_recommendations_batch_async(requests: list, top_n: int = 10) -> list:
+    """Versión para FastAPI: expande las consultas distintas en paralelo y luego procesa el lote."""
+    queries = list(dict.fromkeys(r['query_text'] for r in requests if r.get('query_text')))
+    expansions = await asyncio.gather(*[_expand_query_async(query) for query in queries])
+    return await run_io(get_hybrid_recommendations_batch, requests, top_n, dict(zip(queries, expansions)))
+
+
+def fuse_scores(cf_scores: np.ndarray, cf_present: np.ndarray, cb_positions: np.ndarray,
+                cb_scores: np.ndarray, alpha: float, top_n: int) -> tuple:
+    """
+    Fusión híbrida sobre arreglos alineados con el catálogo (índice denso):
+        Score Final = alpha * Score_CF + (1 - alpha) * Score_contenido
+    Los candidatos son la unión de los destinos con score CF y los del top-k CB;
+    al que le falte uno de los dos scores recibe el valor neutro. Devuelve
+    (posiciones en el catálogo, scores finales) del top-N, de mayor a menor.
+    """
+    n_destinos = len(cf_present)
+    cb_dense = np.full(n_destinos, NEUTRAL_SCORE)
+    cb_dense[cb_positions] = cb_scores
+    candidates = cf_present.copy()
+    candidates[cb_positions] = True
     
-    print(f"DEBUG - final_scores_for_merge tiene Inf: {np.isinf(final_scores_for_merge.values).any()}")
+    final_scores = alpha * np.where(cf_present, cf_scores, NEUTRAL_SCORE) + (1 - alpha) * cb_dense
+    # Una sola pasada: la misma máscara reemplaza los Inf/NaN y alimenta el contador
+    nonfinite = ~np.isfinite(final_scores)
+    if nonfinite.any():
+        final_scores[nonfinite] = NEUTRAL_SCORE
+        metrics.NONFINITE_SCORES.inc(int(nonfinite.sum()))
     
-    # 6. Obtener datos geográficos
-    conn = None
-    try:
-        conn = get_db_connection()
-        ids_to_fetch = final_scores_for_merge['id_destino'].tolist()
-        
-        if not ids_to_fetch:
-            return []
-        
-        format_strings = ','.join(['%s'] * len(ids_to_fetch))
-        recommendation_list = pd.read_sql_query(
-            f"SELECT id_destino, city, state, lat, lng FROM destinos WHERE id_destino IN ({format_strings})", 
-            conn, 
-            params=ids_to_fetch
+    # Top-N con argpartition (O(n)) y orden solo de esos N
+    candidate_positions = np.flatnonzero(candidates)
+    k = min(top_n, len(candidate_positions))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    candidate_scores = final_scores[candidate_positions]
+    top = np.argpartition(-candidate_scores, k - 1)[:k]
+    top = top[np.argsort(-candidate_scores[top], kind='stable')]
+    return candidate_positions[top], candidate_scores[top]
+
+
+def _serialize_recommendations(catalog: dict, positions: np.ndarray, final_scores: np.ndarray) -> list:
+    """Convierte el top-N a una lista de dicts con tipos nativos de Python para JSON."""
+    lats = catalog['lat'][positions].tolist()
+    lngs = catalog['lng'][positions].tolist()
+    return [
+        {
+            'id_destino': id_destino,
+            'city': city,
+            'state': state,
+            'lat': lat if lat == lat else None,  # NaN -> None
+            'lng': lng if lng == lng else None,
+            'score_final': score
+        }
+        for id_destino, city, state, lat, lng, score in zip(
+            catalog['ids'][positions].tolist(),
+            catalog['city'][positions].tolist(),
+            catalog['state'][positions].tolist(),
+            lats, lngs,
+            final_scores.tolist()
         )
+    ]
+
+
+def _fuse_and_serialize(cf_scores: np.ndarray, cf_present: np.ndarray, cb_positions: np.ndarray,
+                        cb_scores: np.ndarray, alpha: float, top_n: int, candidates: np.ndarray = None) -> list:
+    """
+    Fusiona, selecciona el top-N y lo completa con los datos del catálogo en memoria.
+    Con `candidates` (posiciones del catálogo ordenadas), los arreglos CF están
+    alineados con ese subconjunto y la fusión se hace solo sobre él.
+    """
+    try:
+        catalog = get_catalog()
     except Exception as e:
         print(f"Error al obtener datos geográficos: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
-    
-    print(f"DEBUG - recommendation_list tiene Inf: {np.isinf(recommendation_list.select_dtypes(include=[np.number]).values).any()}")
-    
-    # 7. Merge final
-    final_results = pd.merge(recommendation_list, final_scores_for_merge, on='id_destino')
-    
-    print(f"DEBUG - final_results tiene Inf: {np.isinf(final_results.select_dtypes(include=[np.number]).values).any()}")
-    
-    # 8. CRÍTICO: Limpieza final completa - reemplazar TODOS los valores problemáticos
-    final_results = final_results.replace([np.inf, -np.inf], 3.0)
-    final_results = final_results.fillna(3.0)
-    
-    print(f"DEBUG - final_results después de limpieza final tiene Inf: {np.isinf(final_results.select_dtypes(include=[np.number]).values).any()}")
-    
-    # 9. Convertir a lista de diccionarios con manejo explícito
-    result_list = []
-    for _, row in final_results.iterrows():
-        item = {}
-        for col in final_results.columns:
-            val = row[col]
-            # Convertir tipos numpy a tipos nativos Python
-            if isinstance(val, (np.integer, np.floating)):
-                if np.isnan(val) or np.isinf(val):
-                    val = 3.0
-                else:
-                    val = float(val)
-            elif pd.isna(val):
-                val = None
-            item[col] = val
-        result_list.append(item)
     
-    print(f"DEBUG - Longitud de result_list: {len(result_list)}")
+    n_destinos = len(catalog['ids']) if candidates is None else len(candidates)
+    if len(cf_present) != n_destinos:
+        # CF no disponible (p. ej. error de BD): solo se usa el score CB
+        cf_scores = np.full(n_destinos, NEUTRAL_SCORE)
+        cf_present = np.zeros(n_destinos, dtype=bool)
+    if candidates is not None:
+        # Posiciones CB del catálogo -> columnas del subconjunto
+        cb_positions, found = positions_of({'ids': candidates}, cb_positions)
+        cb_positions, cb_scores = cb_positions[found], cb_scores[found]
     
-    return result_list
\ No newline at end of file
+    with metrics.span('fusion'):
+        positions, final_scores = fuse_scores(cf_scores, cf_present, cb_positions, cb_scores, alpha, top_n)
+    if candidates is not None:
+        positions = candidates[positions]
+    with metrics.span('metadata_fetch'):
+        return _serialize_recommendations(catalog, positions, final_scores)
@@ -0,0 +1,26 @@
+import importlib
+import importlib.util
+import sys
+
+# --- IMPORTACIONES DIFERIDAS ---
+# Las dependencias pesadas (faiss, torch, surprise) se importan la primera vez
+# que se usa un atributo del módulo, no al importar el API. Así arrancar un
+# worker es rápido y el costo se paga en el warm-up (ver src/warmup.py).
+
+
+def lazy_import(name: str):
+    """
+    Devuelve el módulo `name` sin ejecutarlo todavía (importlib.util.LazyLoader).
+    Si ya estaba importado, devuelve el módulo existente.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No se encontró el módulo '{name}'.")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -1,17 +1,25 @@
 import requests
+import httpx
 import json
 import os
+from src.query_cache import ExpansionCache, normalize_query
+from src.metrics import OLLAMA_FAILURES
 
 # --- CONFIGURACIÓN DE OLLAMA ---
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
+OLLAMA_API_URL = os.environ.get("OLLAMA_API_URL", "http://localhost:11434/api/generate")
 # Usa el modelo Águila especificado [cite: 35]
 MODEL_NAME = "llama2:7b"
+OLLAMA_TIMEOUT_SECONDS = float(os.environ.get('OLLAMA_TIMEOUT', 60.0))
 
-def get_expanded_query(user_query: str) -> str:
-    """
-    Usa el LLM Águila (via Ollama) para interpretar y expandir la consulta 
-    en lenguaje natural del usuario. [cite: 35]
-    """
+# Cliente HTTP asíncrono compartido (keep-alive con Ollama entre peticiones)
+_async_client = None
+
+# Caché consulta normalizada -> expansión (memoria + SQLite)
+expansion_cache = ExpansionCache()
+
+
+def _build_request_data(user_query: str) -> dict:
+    """Construye el cuerpo de la petición a Ollama para expandir la consulta."""
     
     # Prompt que define la personalidad y la tarea del LLM
     prompt = f"""
@@ -25,7 +33,7 @@ def get_expanded_query(user_query: str) -> str:
     Palabras clave expandidas:
     """
     
-    data = {
+    return {
         "model": MODEL_NAME,
         "prompt": prompt,
         "stream": False,
@@ -34,17 +42,81 @@ def get_expanded_query(user_query: str) -> str:
         }
     }
 
+
+def _parse_response(result: dict) -> str:
+    expanded_text = result['response'].strip()
+    
+    # Limpieza simple de la salida
+    return expanded_text.split("Palabras clave expandidas:")[-1].strip().replace(':', '')
+
+
+def _cache_key(user_query: str) -> str:
+    # El modelo forma parte de la clave: cambiarlo invalida las expansiones previas
+    return f"{MODEL_NAME}|{normalize_query(user_query)}"
+
+
+def _request_expansion(user_query: str) -> str:
     try:
-        response = requests.post(OLLAMA_API_URL, json=data)
+        response = requests.post(OLLAMA_API_URL, json=_build_request_data(user_query))
         response.raise_for_status()
-        
-        result = response.json()
-        expanded_text = result['response'].strip()
-        
-        # Limpieza simple de la salida
-        return expanded_text.split("Palabras clave expandidas:")[-1].strip().replace(':', '')
+        return _parse_response(response.json())
+    except Exception as e:
+        # Se cuenta aquí (una vez por llamada real) y no en los llamadores colapsados
+        OLLAMA_FAILURES.inc(reason=type(e).__name__)
+        raise
+
+
+def get_expanded_query(user_query: str) -> str:
+    """
+    Usa el LLM Águila (via Ollama) para interpretar y expandir la consulta 
+    en lenguaje natural del usuario. [cite: 35]
+    Las expansiones se cachean; solo se guarda en caché una respuesta exitosa.
+    """
+    try:
+        return expansion_cache.get_or_compute(_cache_key(user_query), lambda: _request_expansion(user_query))
     
     except requests.exceptions.RequestException as e:
         print(f"Error al comunicarse con Ollama. Asegúrate de que el modelo {MODEL_NAME} esté cargado y Ollama esté corriendo en http://localhost:11434.")
         # Fallback de emergencia
-        return user_query
\ No newline at end of file
+        return user_query
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=OLLAMA_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20)
+        )
+    return _async_client
+
+
+async def _request_expansion_async(user_query: str) -> str:
+    try:
+        response = await _get_async_client().post(OLLAMA_API_URL, json=_build_request_data(user_query))
+        response.raise_for_status()
+        return _parse_response(response.json())
+    except Exception as e:
+        OLLAMA_FAILURES.inc(reason=type(e).__name__)
+        raise
+
+
+async def get_expanded_query_async(user_query: str) -> str:
+    """Versión no bloqueante de `get_expanded_query` para el pipeline de FastAPI."""
+    try:
+        return await expansion_cache.get_or_compute_async(
+            _cache_key(user_query), lambda: _request_expansion_async(user_query)
+        )
+    
+    except httpx.HTTPError as e:
+        print(f"Error al comunicarse con Ollama. Asegúrate de que el modelo {MODEL_NAME} esté cargado y Ollama esté corriendo en http://localhost:11434.")
+        # Fallback de emergencia
+        return user_query
+
+
+async def close_async_client():
+    """Cierra el cliente HTTP compartido (al apagar la API)."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
\ No newline at end of file
@@ -0,0 +1,226 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from src.database import db_connection
+from src import model_registry, artifacts
+from src.catalog import CATALOG_ARTIFACT
+from src.user_versions import get_user_versions, changed_since
+from mysql.connector import Error
+
+# --- RECOMENDACIONES PRECALCULADAS POR USUARIO ---
+# Sin consulta, el top-N de un usuario depende solo de datos guardados. Este job
+# (offline) calcula el top-K híbrido de todos los usuarios de `usuarios` por
+# lotes (CF matriz-matriz + un `index.search` por lote sobre las preferencias
+# distintas) en un pool de procesos, y lo guarda como artefacto mapeado en
+# memoria. /recommend/user lo sirve con una búsqueda O(1) por usuario y recurre
+# al scoring en vivo si el usuario no está, si el K guardado es menor que el N
+# pedido o si la entrada quedó vieja:
+# - los modelos, el catálogo o las valoraciones cambiaron desde el job, o
+# - el usuario valoró algo o cambió sus preferencias después: su versión en
+#   `usuarios.version_datos` (src/user_versions.py, visible para todos los
+#   procesos del API) es posterior al inicio del job.
+TOPK_ARTIFACT = 'user_topk'
+MATERIALIZE_TOP_K = int(os.environ.get('MATERIALIZE_TOP_K', 20))
+MATERIALIZE_CHUNK_SIZE = int(os.environ.get('MATERIALIZE_CHUNK_SIZE', 2000))
+MATERIALIZE_WORKERS = int(os.environ.get('MATERIALIZE_WORKERS', os.cpu_count() or 1))
+# Antigüedad máxima del precálculo antes de ignorarlo por completo
+MATERIALIZE_MAX_AGE_SECONDS = float(os.environ.get('MATERIALIZE_MAX_AGE', 24 * 3600))
+# Tabla directa id_usuario -> fila si los ids son densos; si no, búsqueda binaria
+MAX_SLOT_SPAN_FACTOR = 4
+# Artefactos de los que depende el resultado (registrados por sus módulos)
+INPUT_ARTIFACTS = (CATALOG_ARTIFACT, 'ratings', 'cf', 'faiss')
+
+# (models_version, coinciden) del último chequeo de entradas
+_inputs_checked = (None, False)
+
+
+def load_user_topk():
+    """Abre el precálculo vigente (memmaps); None si el job aún no ha corrido."""
+    try:
+        return artifacts.load_artifact(TOPK_ARTIFACT)
+    except FileNotFoundError:
+        return None
+
+
+model_registry.register_artifact(TOPK_ARTIFACT, load_user_topk, [artifacts.current_path(TOPK_ARTIFACT)])
+
+
+def _input_signatures(on_disk: bool = False) -> dict:
+    """Firma de cada artefacto de entrada (cargado en memoria o, con `on_disk`, en disco)."""
+    signatures = {}
+    for name in INPUT_ARTIFACTS:
+        signature = (model_registry.get_disk_signature(name) if on_disk
+                     else model_registry.get_artifact_version(name))
+        signatures[name] = json.dumps(signature)
+    return signatures
+
+
+def _is_fresh(store: dict) -> bool:
+    """
+    ¿El precálculo se hizo con los mismos artefactos que sirve este proceso y no
+    es demasiado antiguo? La comparación de firmas se repite solo tras un swap.
+    """
+    global _inputs_checked
+    meta = store['meta']
+    if time.time() - meta['computed_from'] > MATERIALIZE_MAX_AGE_SECONDS:
+        return False
+    version = model_registry.models_version()
+    if _inputs_checked[0] != version:
+        _inputs_checked = (version, meta['inputs'] == _input_signatures())
+    return _inputs_checked[1]
+
+
+def _slot_of(store: dict, user_id: int) -> int:
+    arrays, meta = store['arrays'], store['meta']
+    if 'user_slots' in arrays:
+        offset = user_id - meta['user_id_base']
+        return int(arrays['user_slots'][offset]) if 0 <= offset < len(arrays['user_slots']) else -1
+    user_ids = arrays['user_ids']
+    slot = int(np.searchsorted(user_ids, user_id))
+    return slot if slot < len(user_ids) and user_ids[slot] == user_id else -1
+
+
+def lookup(user_id: int, top_n: int, conn=None, versions: dict = None):
+    """
+    Top-N precalculado del usuario: (ids de destino, scores) o None si hay que
+    calcularlo en vivo (sin precálculo, K insuficiente, entrada vieja o ausente).
+    Usa la versión del usuario de `versions` (ya leída por el llamador) o la
+    consulta en MySQL (una lectura por clave primaria).
+    """
+    store = model_registry.get_artifact(TOPK_ARTIFACT)
+    if store is None or top_n > store['meta']['top_k'] or not _is_fresh(store):
+        return None
+    slot = _slot_of(store, user_id)
+    if slot < 0:
+        return None
+    try:
+        if versions is None:
+            versions = get_user_versions([user_id], conn=conn)
+        version = versions.get(user_id)
+    except Error as e:
+        print(f"ATENCIÓN: No se pudo leer la versión del usuario {user_id}; se calcula en vivo. Error: {e}")
+        return None
+    if changed_since(version, store['meta']['computed_from']):
+        return None
+    count = min(int(store['arrays']['counts'][slot]), top_n)
+    return (np.asarray(store['arrays']['dest_ids'][slot, :count], dtype=np.int64),
+            np.asarray(store['arrays']['scores'][slot, :count], dtype=np.float64))
+
+
+# --- Job de precálculo ---
+
+def compute_user_topk(user_ids: list, top_k: int = MATERIALIZE_TOP_K) -> tuple:
+    """
+    Top-K híbrido sin consulta de un lote de usuarios, igual que en vivo
+    (alpha por defecto, preferencias como consulta CB). Devuelve (ids de destino
+    (usuarios x K, -1 de relleno), scores float32, cantidad por usuario).
+    """
+    from src.hybrid_model import _get_user_preferences_batch, fuse_scores, ALPHA_DEFAULT, DEFAULT_PREFERENCES
+    from src.cf_model import get_cf_score_arrays
+    from src.cb_model import get_cb_score_arrays_batch
+    from src.catalog import get_catalog
+
+    with db_connection() as conn:
+        preferences, versions = _get_user_preferences_batch(conn, user_ids)
+        cf_scores, cf_present = get_cf_score_arrays(user_ids, conn=conn, versions=versions)
+    catalog_ids = get_catalog()['ids']
+    if cf_scores.shape[1] != len(catalog_ids):
+        raise RuntimeError("No se pudieron calcular los scores CF del lote (ver errores anteriores).")
+
+    texts = [preferences.get(user_id, DEFAULT_PREFERENCES) for user_id in user_ids]
+    unique_texts = list(dict.fromkeys(texts))
+    cb_by_text = dict(zip(unique_texts, get_cb_score_arrays_batch(unique_texts)))
+
+    dest_ids = np.full((len(user_ids), top_k), -1, dtype=np.int32)
+    scores = np.zeros((len(user_ids), top_k), dtype=np.float32)
+    counts = np.zeros(len(user_ids), dtype=np.int32)
+    for i, text in enumerate(texts):
+        cb_positions, cb_scores = cb_by_text[text]
+        positions, final_scores = fuse_scores(cf_scores[i], cf_present[i], cb_positions, cb_scores,
+                                              ALPHA_DEFAULT, top_k)
+        counts[i] = len(positions)
+        dest_ids[i, :len(positions)] = catalog_ids[positions]
+        scores[i, :len(positions)] = final_scores
+    return dest_ids, scores, counts
+
+
+def _load_user_ids() -> np.ndarray:
+    with db_connection() as conn:
+        users_df = pd.read_sql_query("SELECT id_usuario FROM usuarios ORDER BY id_usuario", conn)
+    return users_df['id_usuario'].to_numpy(dtype=np.int64)
+
+
+def build_user_slots(user_ids: np.ndarray):
+    """Tabla directa id_usuario - base -> fila (int32, -1 = ausente), o None si los ids son dispersos."""
+    if len(user_ids) == 0:
+        return 0, None
+    base = int(user_ids[0])
+    span = int(user_ids[-1]) - base + 1
+    if span > MAX_SLOT_SPAN_FACTOR * len(user_ids):
+        return base, None
+    slots = np.full(span, -1, dtype=np.int32)
+    slots[user_ids - base] = np.arange(len(user_ids), dtype=np.int32)
+    return base, slots
+
+
+def materialize_all(top_k: int = MATERIALIZE_TOP_K, workers: int = MATERIALIZE_WORKERS,
+                    chunk_size: int = MATERIALIZE_CHUNK_SIZE) -> str:
+    """
+    Calcula y publica el top-K de todos los usuarios. Con `workers` > 1 los lotes
+    se reparten en un pool de procesos; cada proceso abre los modelos por mmap.
+    Devuelve la versión del artefacto (None si no hay usuarios).
+    """
+    # Registra los artefactos de entrada para poder leer sus firmas
+    import src.cf_model  # noqa: F401
+    import src.cb_model  # noqa: F401
+    import src.ratings_index  # noqa: F401
+
+    start = time.time()
+    inputs = _input_signatures(on_disk=True)
+    user_ids = _load_user_ids()
+    chunks = [user_ids[i:i + chunk_size].tolist() for i in range(0, len(user_ids), chunk_size)]
+    print(f"Precalculando top-{top_k} de {len(user_ids)} usuarios en {len(chunks)} lotes "
+          f"({workers} procesos)...")
+
+    if workers > 1 and len(chunks) > 1:
+        # spawn: los workers no heredan hilos ni el estado de PyTorch/FAISS del padre
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(compute_user_topk, chunks, [top_k] * len(chunks)))
+    else:
+        results = [compute_user_topk(chunk, top_k) for chunk in chunks]
+
+    if not results:
+        print("ATENCIÓN: No hay usuarios que precalcular.")
+        return None
+    dest_ids, scores, counts = (np.concatenate(parts) for parts in zip(*results))
+
+    if _input_signatures(on_disk=True) != inputs:
+        # Se publica igual: al no coincidir las firmas, el API lo ignora hasta el siguiente job
+        print("ATENCIÓN: Los modelos o los datos cambiaron durante el precálculo; quedará marcado como viejo.")
+
+    base, slots = build_user_slots(user_ids)
+    arrays = {'user_ids': user_ids, 'dest_ids': dest_ids, 'scores': scores, 'counts': counts}
+    if slots is not None:
+        arrays['user_slots'] = slots
+    version = artifacts.save_artifact(TOPK_ARTIFACT, arrays=arrays, meta={
+        'top_k': top_k, 'users': len(user_ids), 'user_id_base': base,
+        'computed_from': start, 'inputs': inputs,
+    })
+    model_registry.refresh_artifact(TOPK_ARTIFACT)
+    print(f"Precálculo {version} guardado en {time.time() - start:.1f} s.")
+    return version
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precalcula el top-K híbrido (sin consulta) de todos los usuarios.")
+    parser.add_argument('--top-k', type=int, default=MATERIALIZE_TOP_K,
+                        help="Recomendaciones guardadas por usuario (el API sirve n <= K).")
+    parser.add_argument('--workers', type=int, default=MATERIALIZE_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=MATERIALIZE_CHUNK_SIZE)
+    args = parser.parse_args()
+    materialize_all(args.top_k, args.workers, args.chunk_size)
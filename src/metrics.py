@@ -0,0 +1,196 @@
+import bisect
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# --- MÉTRICAS E INSTRUMENTACIÓN POR ETAPA ---
+# Histogramas y contadores en memoria del proceso, expuestos en formato de texto
+# de Prometheus por `/metrics` (main.py). `span(etapa)` mide una etapa del
+# pipeline; si la petición actual está muestreada (ver `start_trace`), la etapa
+# se agrega además a su traza, que main.py devuelve en el encabezado Server-Timing.
+METRICS_PREFIX = 'recommender'
+# Límites superiores (segundos) de los buckets de latencia
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Fracción de peticiones con traza por etapa (0 = solo las que la piden con TRACE_HEADER)
+TRACE_SAMPLE_RATE = float(os.environ.get('METRICS_TRACE_SAMPLE_RATE', 0.0))
+TRACE_HEADER = 'X-Recommender-Trace'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+_registry_lock = threading.Lock()
+# Traza de la petición actual: lista de (etapa, segundos) o None si no está muestreada.
+# run_io/run_cpu copian el contexto, así que las etapas en los ejecutores también llegan.
+_trace = contextvars.ContextVar('recommender_trace', default=None)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Contador monótono con etiquetas (el nombre debe terminar en `_total`)."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Sin etiquetas, la serie existe desde el inicio (se exporta en 0)
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Histograma con buckets acumulados al exportar, como espera Prometheus."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # etiquetas -> [conteo por bucket (+Inf al final), suma, conteo]
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+
+
+def render() -> str:
+    """Todas las métricas registradas en formato de texto de Prometheus."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- Métricas del pipeline ---
+STAGE_SECONDS = Histogram(
+    'stage_duration_seconds', "Duración de cada etapa del pipeline de recomendación.", ('stage',)
+)
+REQUEST_SECONDS = Histogram(
+    'request_duration_seconds', "Duración total de las peticiones HTTP por ruta.", ('route', 'method')
+)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups_total', "Consultas a cachés por resultado (memory_hits, disk_hits, misses, coalesced, errors).",
+    ('cache', 'result')
+)
+DB_CONNECTIONS = Counter(
+    'db_connections_total', "Conexiones tomadas del pool (o abiertas, con SQLite) por resultado.",
+    ('backend', 'result')
+)
+OLLAMA_FAILURES = Counter(
+    'ollama_failures_total', "Llamadas a Ollama fallidas, por tipo de error.", ('reason',)
+)
+NONFINITE_SCORES = Counter(
+    'nonfinite_scores_total', "Scores finales Inf/NaN reemplazados por el valor neutro en la fusión."
+)
+
+
+# --- Etapas y trazas por petición ---
+
+@contextmanager
+def span(stage: str):
+    """Mide el bloque como la etapa `stage` (histograma + traza de la petición, si la hay)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, seconds))
+
+
+async def timed(stage: str, awaitable):
+    """`await` de `awaitable` medido como la etapa `stage`."""
+    with span(stage):
+        return await awaitable
+
+
+def start_trace(force: bool = False):
+    """
+    Decide si la petición actual lleva traza (muestreo o `force`); si es así,
+    la inicia en el contexto actual y la devuelve. Si no, devuelve None.
+    """
+    if not (force or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE)):
+        return None
+    trace = []
+    _trace.set(trace)
+    return trace
+
+
+def clear_trace():
+    """Desvincula el contexto actual de cualquier traza (trabajo compartido entre peticiones)."""
+    _trace.set(None)
+
+
+def server_timing(trace: list, total_seconds: float = None) -> str:
+    """Traza en formato Server-Timing: `etapa;dur=ms, ...`."""
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in trace]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ', '.join(entries)
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import threading
+import time
+
+# --- REGISTRO DE MODELOS EN MEMORIA ---
+# Cada artefacto (índice FAISS, modelo CF, ...) se registra con un loader y la
+# lista de archivos que lo componen. Se carga una sola vez y se sirve desde
+# memoria; el watcher detecta cambios en disco y lo reemplaza atómicamente.
+
+WATCH_INTERVAL_SECONDS = float(os.environ.get('MODEL_WATCH_INTERVAL', 2.0))
+
+_lock = threading.Lock()
+_load_lock = threading.Lock()
+_loaders = {}      # nombre -> (loader, [rutas])
+_artifacts = {}    # nombre -> {'value': ..., 'signature': ..., 'loaded_at': ...}
+_models_version = None  # caché de models_version(); se borra en cada swap
+_watcher_thread = None
+_watcher_stop = threading.Event()
+
+
+def register_artifact(name: str, loader, paths: list):
+    """
+    Registra un artefacto. `loader` es una función sin argumentos que lo carga
+    desde disco; `paths` son los archivos cuyo cambio dispara una recarga.
+    """
+    with _lock:
+        _loaders[name] = (loader, list(paths))
+
+
+def _file_signature(paths: list) -> tuple:
+    """Firma (mtime, tamaño) de los archivos; None para los que no existen."""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _load(name: str) -> dict:
+    """Carga el artefacto fuera del lock y lo publica con un único swap."""
+    loader, paths = _loaders[name]
+    signature = _file_signature(paths)
+    value = loader()
+    if None in signature:
+        # El loader pudo haber generado los archivos (p. ej. entrenar el modelo CF)
+        signature = _file_signature(paths)
+    entry = {'value': value, 'signature': signature, 'loaded_at': time.time()}
+    _swap(name, entry)
+    return entry
+
+
+def _swap(name: str, entry: dict):
+    global _models_version
+    with _lock:
+        _artifacts[name] = entry
+        _models_version = None
+
+
+def get_artifact(name: str):
+    """Devuelve el artefacto desde memoria; lo carga la primera vez."""
+    entry = _artifacts.get(name)
+    if entry is None:
+        if name not in _loaders:
+            raise KeyError(f"Artefacto '{name}' no registrado.")
+        # Evita que varias peticiones concurrentes carguen el mismo artefacto
+        with _load_lock:
+            entry = _artifacts.get(name) or _load(name)
+    return entry['value']
+
+
+def publish_artifact(name: str, value):
+    """
+    Publica un artefacto recién generado en este proceso (p. ej. tras reentrenar)
+    sin volver a leerlo de disco. La firma se toma de los archivos ya escritos.
+    """
+    _, paths = _loaders[name]
+    entry = {'value': value, 'signature': _file_signature(paths), 'loaded_at': time.time()}
+    _swap(name, entry)
+
+
+def refresh_artifact(name: str):
+    """Recarga un artefacto ya cargado en este proceso (no hace nada si aún no se usó)."""
+    if name in _artifacts:
+        _load(name)
+
+
+def get_artifact_version(name: str):
+    """Firma de archivos del artefacto cargado (None si aún no se ha cargado)."""
+    entry = _artifacts.get(name)
+    return entry['signature'] if entry else None
+
+
+def get_disk_signature(name: str) -> tuple:
+    """Firma actual en disco de un artefacto registrado (esté o no cargado en este proceso)."""
+    _, paths = _loaders[name]
+    return _file_signature(paths)
+
+
+def models_version() -> str:
+    """
+    Huella de los artefactos cargados (sus firmas de archivos): cambia con cada
+    swap y coincide entre procesos que comparten `models/`. La usa la caché de
+    respuestas (src/response_cache.py) como versión del modelo.
+    """
+    global _models_version
+    with _lock:
+        if _models_version is None:
+            signatures = sorted((name, entry['signature']) for name, entry in _artifacts.items())
+            _models_version = hashlib.sha1(repr(signatures).encode('utf-8')).hexdigest()[:16]
+        return _models_version
+
+
+def artifact_status() -> dict:
+    """Nombre -> True si el artefacto registrado ya está cargado en este proceso."""
+    return {name: name in _artifacts for name in list(_loaders)}
+
+
+def load_all():
+    """Carga todos los artefactos registrados (usado al iniciar el proceso)."""
+    for name in list(_loaders):
+        try:
+            get_artifact(name)
+            print(f"Artefacto '{name}' cargado en memoria.")
+        except Exception as e:
+            print(f"ATENCIÓN: No se pudo cargar el artefacto '{name}'. Error: {e}")
+
+
+def check_for_updates():
+    """
+    Recarga los artefactos cuyos archivos cambiaron en disco. Solo recarga cuando
+    la firma es estable entre dos lecturas, para no leer archivos a medio escribir.
+    """
+    for name, (loader, paths) in list(_loaders.items()):
+        entry = _artifacts.get(name)
+        if entry is None:
+            continue
+        signature = _file_signature(paths)
+        if signature == entry['signature'] or None in signature:
+            continue
+        time.sleep(0.1)
+        if _file_signature(paths) != signature:
+            continue
+        try:
+            _load(name)
+            print(f"Artefacto '{name}' recargado desde disco.")
+        except Exception as e:
+            # Se mantiene la versión anterior en memoria
+            print(f"ATENCIÓN: Falló la recarga de '{name}'. Se conserva la versión actual. Error: {e}")
+
+
+def _watch_loop(interval: float):
+    while not _watcher_stop.wait(interval):
+        check_for_updates()
+
+
+def start_watcher(interval: float = WATCH_INTERVAL_SECONDS):
+    """Inicia (una sola vez) el hilo que vigila los archivos de `models/`."""
+    global _watcher_thread
+    if _watcher_thread and _watcher_thread.is_alive():
+        return
+    _watcher_stop.clear()
+    _watcher_thread = threading.Thread(target=_watch_loop, args=(interval,), daemon=True, name="model-watcher")
+    _watcher_thread.start()
+
+
+def stop_watcher():
+    _watcher_stop.set()
+
+
+def atomic_write(writes: dict):
+    """
+    Escribe varios archivos de forma atómica. `writes` mapea ruta final ->
+    función que escribe en una ruta temporal; todos los temporales se escriben
+    primero y luego se renombran juntos, para que el watcher nunca vea una
+    versión a medias.
+    """
+    pending = []
+    for path, write_fn in writes.items():
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        write_fn(tmp_path)
+        pending.append((tmp_path, path))
+    for tmp_path, path in pending:
+        os.replace(tmp_path, path)
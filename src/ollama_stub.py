@@ -0,0 +1,74 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- SERVIDOR OLLAMA SIMULADO ---
+# Responde POST /api/generate con el mismo formato que Ollama (stream=False)
+# tras una latencia configurable. Para benchmarks sin un LLM real:
+#   OLLAMA_API_URL=http://127.0.0.1:11435/api/generate
+STUB_KEYWORDS = "cultura, historia, playa, naturaleza, gastronomía, pueblos mágicos"
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/api/generate':
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        delay = server.latency + random.uniform(0, server.jitter)
+        time.sleep(delay)
+        with server.lock:
+            server.requests_served += 1
+
+        body = json.dumps({
+            'model': request.get('model'),
+            'response': f"Palabras clave expandidas: {STUB_KEYWORDS}",
+            'done': True,
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(host: str = '127.0.0.1', port: int = 0, latency_ms: float = 200.0,
+               jitter_ms: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Inicia el servidor en un hilo (port=0 elige un puerto libre). La URL para
+    OLLAMA_API_URL queda en `server.url`; detenerlo con `server.shutdown()`.
+    """
+    server = ThreadingHTTPServer((host, port), _OllamaHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    server.jitter = jitter_ms / 1000
+    server.lock = threading.Lock()
+    server.requests_served = 0
+    server.url = f"http://{host}:{server.server_address[1]}/api/generate"
+    threading.Thread(target=server.serve_forever, daemon=True, name="ollama-stub").start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Servidor Ollama simulado con latencia configurable.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency-ms', type=float, default=200.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_stub(args.host, args.port, args.latency_ms, args.jitter_ms)
+    print(f"Ollama simulado en {server.url} (latencia {args.latency_ms} ms). Ctrl+C para detener.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,229 @@
+import asyncio
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from src.concurrency import run_io
+from src.metrics import CACHE_LOOKUPS
+
+# --- CACHÉ DE EXPANSIONES DEL LLM ---
+# Nivel 1: LRU en memoria con TTL. Nivel 2: SQLite en disco (sobrevive reinicios).
+# Las consultas idénticas concurrentes se colapsan en una sola llamada a Ollama.
+CACHE_DB_PATH = os.environ.get('LLM_CACHE_PATH', os.path.join('cache', 'llm_expansions.sqlite3'))
+MEMORY_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 2048))
+MEMORY_TTL_SECONDS = float(os.environ.get('LLM_CACHE_TTL', 6 * 3600))
+DISK_TTL_SECONDS = float(os.environ.get('LLM_CACHE_DISK_TTL', 30 * 24 * 3600))
+
+
+def normalize_query(query: str) -> str:
+    """Normaliza la consulta para usarla como clave: minúsculas, sin espacios ni puntuación sobrantes."""
+    query = unicodedata.normalize('NFKC', query).lower()
+    query = re.sub(r'\s+', ' ', query)
+    return query.strip(' .,;:!?¡¿"\'')
+
+
+class _Flight:
+    """Llamada en curso para una clave (single-flight entre hilos)."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ExpansionCache:
+    """Caché de dos niveles consulta normalizada -> expansión, con contadores de aciertos."""
+
+    def __init__(self, db_path: str = CACHE_DB_PATH, max_entries: int = MEMORY_MAX_ENTRIES,
+                 ttl: float = MEMORY_TTL_SECONDS, disk_ttl: float = DISK_TTL_SECONDS,
+                 name: str = 'llm_expansion'):
+        self.name = name  # etiqueta `cache` en /metrics
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        self._memory = OrderedDict()  # clave -> (expansión, expira_en)
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk = None
+        self._inflight = {}        # clave -> _Flight (llamadas síncronas)
+        self._inflight_async = {}  # clave -> asyncio.Task (llamadas asíncronas)
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+
+    def _count(self, event: str):
+        # Se llama con `self._lock` tomado
+        self._stats[event] += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result=event)
+
+    # --- Nivel en disco (SQLite) ---
+
+    def _get_disk(self):
+        if self._disk is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            self._disk = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS expansions ("
+                " query_key TEXT PRIMARY KEY, expansion TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+        return self._disk
+
+    def _disk_get(self, key: str):
+        try:
+            with self._disk_lock:
+                row = self._get_disk().execute(
+                    "SELECT expansion, created_at FROM expansions WHERE query_key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"ATENCIÓN: Falló la lectura de la caché en disco. Error: {e}")
+            return None
+        if row is None or time.time() - row[1] > self.disk_ttl:
+            return None
+        return row[0]
+
+    def _disk_set(self, key: str, value: str):
+        try:
+            with self._disk_lock:
+                disk = self._get_disk()
+                disk.execute(
+                    "INSERT OR REPLACE INTO expansions (query_key, expansion, created_at) VALUES (?, ?, ?)",
+                    (key, value, time.time())
+                )
+                disk.commit()
+        except sqlite3.Error as e:
+            print(f"ATENCIÓN: Falló la escritura de la caché en disco. Error: {e}")
+
+    # --- Nivel en memoria (LRU + TTL) ---
+
+    def _memory_get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self._count('memory_hits')
+            return value
+
+    def _memory_set(self, key: str, value: str):
+        with self._lock:
+            self._memory[key] = (value, time.monotonic() + self.ttl)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _promote_from_disk(self, key: str, value):
+        if value is not None:
+            with self._lock:
+                self._count('disk_hits')
+            self._memory_set(key, value)
+        return value
+
+    def _store(self, key: str, value: str):
+        # No se guardan expansiones vacías: el pipeline las trata como fallo
+        if value and value.strip():
+            self._memory_set(key, value)
+            self._disk_set(key, value)
+
+    # --- API pública ---
+
+    def get_or_compute(self, key: str, compute):
+        """
+        Devuelve la expansión de `key`; en caso de fallo de caché ejecuta `compute()`.
+        Los hilos concurrentes con la misma clave esperan a una sola llamada.
+        Las excepciones de `compute` se propagan y no se guardan en caché.
+        """
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        value = self._promote_from_disk(key, self._disk_get(key))
+        if value is not None:
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self._count('misses')
+            else:
+                self._count('coalesced')
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+            self._store(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._count('errors')
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    async def get_or_compute_async(self, key: str, compute):
+        """Versión asíncrona: `compute` es una función que devuelve una corrutina."""
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        value = self._promote_from_disk(key, await run_io(self._disk_get, key))
+        if value is not None:
+            return value
+
+        task = self._inflight_async.get(key)
+        if task is not None:
+            with self._lock:
+                self._count('coalesced')
+        else:
+            with self._lock:
+                self._count('misses')
+            # La llamada corre en su propia tarea, no en la de quien la inició:
+            # si esa petición se cancela, las demás siguen esperando el mismo resultado
+            task = asyncio.ensure_future(self._compute_and_store(key, compute))
+            self._inflight_async[key] = task
+            task.add_done_callback(functools.partial(self._flight_done, key))
+        # shield: cancelar a un solicitante (líder o no) no cancela la tarea compartida
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, key: str, compute):
+        try:
+            value = await compute()
+            await run_io(self._store, key, value)
+            return value
+        except Exception:
+            with self._lock:
+                self._count('errors')
+            raise
+
+    def _flight_done(self, key: str, task):
+        if self._inflight_async.get(key) is task:
+            del self._inflight_async[key]
+        # Evita el aviso "exception was never retrieved" si todos los solicitantes se fueron
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
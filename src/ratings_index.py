@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from src.database import db_connection
+from src import model_registry
+from src.user_versions import get_user_versions, changed_since
+
+# --- ÍNDICE DE VALORACIONES EN MEMORIA ---
+# Valoraciones por usuario en formato CSR (usuarios ordenados, indptr, destinos
+# y puntuaciones de cada fila), más la suma y el conteo para la media global.
+# Se construye una vez al cargar y las valoraciones nuevas se aplican encima
+# (overlay), así el costo por petición no depende del tamaño de `valoraciones`.
+# Los usuarios que el índice no conoce se consultan en MySQL por id_usuario y se
+# incorporan al overlay. Las valoraciones hechas en otro proceso del API se
+# detectan con la versión compartida del usuario (src/user_versions.py): si es
+# posterior a la carga del índice o a la última lectura de su fila, la fila se
+# vuelve a leer de `valoraciones`. El ETL toca el archivo de versión para que
+# todos los procesos reconstruyan el índice.
+# Costo por petición: leer la versión es una búsqueda por clave primaria en
+# `usuarios`, no un recorrido de `valoraciones`. Los llamadores que ya consultan
+# `usuarios` (preferencias, caché de respuestas) traen version_datos en esa misma
+# consulta y la pasan en `versions`, así no hay una consulta extra; solo quien
+# no la tiene (p. ej. /recommend/query, que no lee preferencias) la pide aparte.
+RATINGS_ARTIFACT = 'ratings'
+RATINGS_VERSION_FILE = os.path.join('models', 'ratings.version')
+RATINGS_LOAD_CHUNK_SIZE = int(os.environ.get('RATINGS_LOAD_CHUNK_SIZE', 500000))
+
+
+def build_ratings_index(ratings_df: pd.DataFrame) -> dict:
+    """Arreglos CSR a partir de un DataFrame (id_usuario, id_destino, puntuacion)."""
+    users = ratings_df['id_usuario'].to_numpy(dtype=np.int64)
+    items = ratings_df['id_destino'].to_numpy(dtype=np.int64)
+    ratings = pd.to_numeric(ratings_df['puntuacion']).to_numpy(dtype=np.float32)
+    order = np.lexsort((items, users))
+    users, items, ratings = users[order], items[order], ratings[order]
+    user_ids, starts = np.unique(users, return_index=True)
+    return {
+        'user_ids': user_ids,
+        'indptr': np.append(starts, len(users)).astype(np.int64),
+        'item_ids': items.astype(np.int32),
+        'ratings': ratings,
+        'rating_sum': float(ratings.sum(dtype=np.float64)),
+        'rating_count': int(len(ratings)),
+    }
+
+
+def load_ratings_index() -> dict:
+    """Lee `valoraciones` por bloques (una sola vez por versión) y construye el índice."""
+    loaded_at = time.time()
+    with db_connection() as conn:
+        chunks = list(pd.read_sql_query(
+            "SELECT id_usuario, id_destino, puntuacion FROM valoraciones",
+            conn, chunksize=RATINGS_LOAD_CHUNK_SIZE
+        ))
+    ratings_df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(
+        columns=['id_usuario', 'id_destino', 'puntuacion']
+    )
+    index = build_ratings_index(ratings_df)
+    index['loaded_at'] = loaded_at
+    return index
+
+
+model_registry.register_artifact(RATINGS_ARTIFACT, load_ratings_index, [RATINGS_VERSION_FILE])
+
+
+def get_ratings_index() -> dict:
+    return model_registry.get_artifact(RATINGS_ARTIFACT)
+
+
+# Valoraciones posteriores a la carga: id_usuario -> {id_destino: puntuacion},
+# y la versión del usuario con la que se leyó cada fila de MySQL.
+# Se descartan cuando el registro publica un índice nuevo.
+_overlay_lock = threading.Lock()
+_overlay = {'index': None, 'users': {}, 'versions': {}, 'sum': 0.0, 'count': 0}
+
+
+def _current_overlay(index: dict) -> dict:
+    global _overlay
+    if _overlay['index'] is not index:
+        with _overlay_lock:
+            if _overlay['index'] is not index:
+                _overlay = {'index': index, 'users': {}, 'versions': {}, 'sum': 0.0, 'count': 0}
+    return _overlay
+
+
+def _base_ratings(index: dict, user_id: int):
+    """(destinos, puntuaciones) del usuario en el índice base, o None si no aparece."""
+    user_ids = index['user_ids']
+    pos = np.searchsorted(user_ids, user_id)
+    if pos >= len(user_ids) or user_ids[pos] != user_id:
+        return None
+    begin, end = index['indptr'][pos], index['indptr'][pos + 1]
+    return index['item_ids'][begin:end].astype(np.int64), index['ratings'][begin:end].astype(np.float64)
+
+
+def _set_rating(overlay: dict, index: dict, user_id: int, destino_id: int, puntuacion: float):
+    """Aplica una valoración al overlay (con _overlay_lock tomado), ajustando suma y conteo."""
+    user_overlay = overlay['users'].get(user_id)
+    if user_overlay is None:
+        base = _base_ratings(index, user_id)
+        user_overlay = dict(zip(base[0].tolist(), base[1].tolist())) if base is not None else {}
+        overlay['users'][user_id] = user_overlay
+    previous = user_overlay.get(destino_id)
+    if previous is None:
+        overlay['count'] += 1
+        overlay['sum'] += puntuacion
+    else:
+        overlay['sum'] += puntuacion - previous
+    user_overlay[destino_id] = puntuacion
+
+
+def record_rating(user_id: int, destino_id: int, puntuacion: float):
+    """Incorpora una valoración recién guardada en MySQL (inserción o actualización)."""
+    index = get_ratings_index()
+    overlay = _current_overlay(index)
+    with _overlay_lock:
+        _set_rating(overlay, index, int(user_id), int(destino_id), float(puntuacion))
+
+
+def _fetch_users(index: dict, overlay: dict, user_ids: list, versions: dict, conn=None):
+    """
+    Lee de MySQL las filas completas de `user_ids` y reemplaza las del overlay
+    (ajustando suma y conteo). Los usuarios sin valoraciones quedan con una fila
+    vacía, así un usuario en Cold Start no vuelve a consultar MySQL en cada petición.
+    """
+    if not user_ids:
+        return
+    with db_connection(conn) as conn:
+        format_strings = ','.join(['%s'] * len(user_ids))
+        rated_df = pd.read_sql_query(
+            f"SELECT id_usuario, id_destino, puntuacion FROM valoraciones WHERE id_usuario IN ({format_strings})",
+            conn,
+            params=list(user_ids)
+        )
+    rows = {user_id: {} for user_id in user_ids}
+    for user_id, destino_id, puntuacion in rated_df.itertuples(index=False):
+        rows[int(user_id)][int(destino_id)] = float(puntuacion)
+
+    with _overlay_lock:
+        for user_id, row in rows.items():
+            previous = overlay['users'].get(user_id)
+            if previous is None:
+                base = _base_ratings(index, user_id)
+                previous = dict(zip(base[0].tolist(), base[1].tolist())) if base is not None else {}
+            overlay['count'] += len(row) - len(previous)
+            overlay['sum'] += sum(row.values()) - sum(previous.values())
+            overlay['users'][user_id] = row
+            overlay['versions'][user_id] = versions.get(user_id)
+
+
+def _needs_fetch(index: dict, overlay: dict, user_id: int, version) -> bool:
+    """¿Hay que (re)leer la fila del usuario? Si el índice no lo conoce o cambió en otro proceso."""
+    if user_id in overlay['users']:
+        seen = overlay['versions'].get(user_id)
+        return version is not None and (seen is None or version > seen)
+    return _base_ratings(index, user_id) is None or changed_since(version, index['loaded_at'])
+
+
+def user_ratings(user_ids, conn=None, versions: dict = None) -> dict:
+    """
+    id_usuario -> (destinos, puntuaciones) para cada usuario con valoraciones.
+    Los usuarios sin valoraciones no aparecen en el resultado. Solo relee
+    `valoraciones` para los usuarios que cambiaron. `versions` (id_usuario ->
+    versión o None) son las que el llamador ya leyó en esta petición; las de los
+    usuarios que no vienen ahí se leen con una consulta.
+    """
+    index = get_ratings_index()
+    overlay = _current_overlay(index)
+    user_ids = [int(user_id) for user_id in dict.fromkeys(user_ids)]
+    versions = dict(versions or {})
+    unread = [user_id for user_id in user_ids if user_id not in versions]
+    if unread:
+        versions.update(get_user_versions(unread, conn=conn))
+    stale = [
+        user_id for user_id in user_ids
+        if _needs_fetch(index, overlay, user_id, versions.get(user_id))
+    ]
+    _fetch_users(index, overlay, stale, versions, conn=conn)
+
+    result = {}
+    with _overlay_lock:
+        for user_id in user_ids:
+            user_overlay = overlay['users'].get(user_id)
+            if user_overlay is not None:
+                if user_overlay:
+                    items = np.fromiter(user_overlay.keys(), dtype=np.int64, count=len(user_overlay))
+                    ratings = np.fromiter(user_overlay.values(), dtype=np.float64, count=len(user_overlay))
+                    result[user_id] = (items, ratings)
+                continue
+            base = _base_ratings(index, user_id)
+            if base is not None:
+                result[user_id] = base
+    return result
+
+
+def user_version(user_id: int):
+    """Versión del usuario con la que se leyó su fila del overlay (None si se usa el índice base)."""
+    index = get_ratings_index()
+    return _current_overlay(index)['versions'].get(int(user_id))
+
+
+def global_mean(default: float = None):
+    """Media de todas las valoraciones (índice + overlay); `default` si no hay ninguna."""
+    index = get_ratings_index()
+    overlay = _current_overlay(index)
+    count = index['rating_count'] + overlay['count']
+    return (index['rating_sum'] + overlay['sum']) / count if count else default
+
+
+def mark_ratings_changed():
+    """
+    Llamar tras recargar `valoraciones` (ETL). Actualiza el archivo de versión
+    para que los procesos del API reconstruyan el índice, y lo recarga en este.
+    """
+    def write_version(path):
+        with open(path, 'w') as f:
+            f.write(str(time.time()))
+
+    model_registry.atomic_write({RATINGS_VERSION_FILE: write_version})
+    model_registry.refresh_artifact(RATINGS_ARTIFACT)
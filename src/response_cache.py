@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from src import model_registry
+from src.concurrency import run_io
+from src.metrics import CACHE_LOOKUPS
+
+# --- CACHÉ DE RESPUESTAS DE /recommend/user ---
+# Clave: (usuario, n, versión de los modelos, versión de los datos del usuario).
+# - Versión de los modelos: huella de los artefactos en memoria
+#   (model_registry.models_version); cambia al publicar o recargar cualquiera.
+# - Versión del usuario: `usuarios.version_datos` (src/user_versions.py), que
+#   cambia en la misma transacción que cada valoración o cambio de preferencias,
+#   sin importar qué proceso del API lo atendió. El llamador la lee en MySQL
+#   antes de calcular y la pasa a `lookup`.
+# Al cambiar cualquiera de las dos, las entradas anteriores dejan de ser
+# alcanzables y el LRU las desaloja. Como la versión no vive en el backend, la
+# caché en memoria es correcta con varios workers: cada uno guarda sus propias
+# respuestas, pero ninguno sirve una anterior al último cambio del usuario.
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 20000))
+# Límite de seguridad para cambios que no pasan por la API (p. ej. UPDATE manual en MySQL)
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+# Backend compartido entre procesos/réplicas (p. ej. redis://localhost:6379/0); vacío = memoria local
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', '')
+KEY_PREFIX = 'recommender:responses'
+
+
+class MemoryBackend:
+    """LRU en memoria del proceso con TTL; también sirve de sustituto local del backend compartido."""
+
+    local = True
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # clave -> (valor, expira_en)
+        self._lock = threading.Lock()
+
+    def _get_locked(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_locked(self, key: str, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        with self._lock:
+            return self._get_locked(key)
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._set_locked(key, value)
+
+    def setdefault(self, key: str, value):
+        """Guarda `value` solo si la clave no existe; devuelve el valor vigente."""
+        with self._lock:
+            current = self._get_locked(key)
+            if current is None:
+                self._set_locked(key, value)
+                current = value
+            return current
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """
+    Backend compartido sobre Redis (requiere el paquete `redis`). La memoria se
+    acota en el servidor: configure `maxmemory` con `maxmemory-policy allkeys-lru`.
+    """
+
+    local = False
+
+    def __init__(self, url: str, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("Para RESPONSE_CACHE_URL instale 'redis', o deje la variable vacía (caché en memoria).")
+        self.ttl = max(int(ttl), 1)
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        value = self._client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value):
+        self._client.set(key, json.dumps(value), ex=self.ttl)
+
+    def setdefault(self, key: str, value):
+        self._client.set(key, json.dumps(value), ex=self.ttl, nx=True)
+        current = self.get(key)
+        return value if current is None else current
+
+    def clear(self):
+        for key in self._client.scan_iter(f"{KEY_PREFIX}:*"):
+            self._client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self._client.scan_iter(f"{KEY_PREFIX}:*"))
+
+
+def create_backend(url: str = RESPONSE_CACHE_URL):
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBackend(url)
+    if url:
+        raise ValueError(f"Backend de caché no soportado: {url}")
+    return MemoryBackend()
+
+
+class ResponseCache:
+    """Caché versionada de recomendaciones por usuario, con contadores de aciertos."""
+
+    def __init__(self, backend=None, enabled: bool = RESPONSE_CACHE_ENABLED):
+        self.enabled = enabled
+        self._backend = backend
+        self._backend_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'errors': 0}
+
+    @property
+    def backend(self):
+        # Se crea al primer uso: importar el módulo no abre conexiones
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    self._backend = create_backend()
+        return self._backend
+
+    def _count(self, event: str):
+        with self._stats_lock:
+            self._stats[event] += 1
+        if event in ('hits', 'misses'):
+            CACHE_LOOKUPS.inc(cache='responses', result=event)
+
+    def lookup(self, user_id: int, top_n: int, user_version) -> tuple:
+        """
+        Devuelve (clave, respuesta o None). `user_version` es la versión del
+        usuario leída antes de calcular (None si nunca cambió), así que una
+        respuesta calculada durante una escritura queda bajo la versión anterior
+        y nunca se sirve. Si el backend falla, se trata como fallo de caché.
+        """
+        if not self.enabled:
+            return None, None
+        try:
+            key = (f"{KEY_PREFIX}:rec:{user_id}:{top_n}:"
+                   f"{model_registry.models_version()}:{0 if user_version is None else repr(user_version)}")
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"ATENCIÓN: Falló la lectura de la caché de respuestas. Error: {e}")
+            self._count('errors')
+            return None, None
+        self._count('misses' if value is None else 'hits')
+        return key, value
+
+    def store(self, key: str, value):
+        if key is None:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            print(f"ATENCIÓN: Falló la escritura de la caché de respuestas. Error: {e}")
+            self._count('errors')
+
+    async def lookup_async(self, user_id: int, top_n: int, user_version) -> tuple:
+        """Igual que `lookup`; con un backend remoto la llamada corre en el ejecutor de E/S."""
+        if not self.enabled or self.backend.local:
+            return self.lookup(user_id, top_n, user_version)
+        return await run_io(self.lookup, user_id, top_n, user_version)
+
+    async def store_async(self, key: str, value):
+        if not self.enabled or self.backend.local:
+            return self.store(key, value)
+        return await run_io(self.store, key, value)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['backend'] = type(self._backend).__name__ if self._backend is not None else None
+        return stats
+
+    def clear(self):
+        self.backend.clear()
+
+
+recommendation_cache = ResponseCache()
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import re
+import sqlite3
+from mysql.connector import Error, errorcode
+
+# --- BACKEND SQLITE (SUSTITUTO LOCAL DE MYSQL) ---
+# Implementa la interfaz de conexión que usa el proyecto (cursor, commit,
+# rollback, close, ping) sobre un archivo SQLite, traduciendo el dialecto MySQL
+# de las consultas existentes. Pensado para benchmarks y desarrollo sin MySQL
+# (DB_BACKEND=sqlite); los errores se lanzan como mysql.connector.Error para que
+# el manejo de errores del resto del código no cambie.
+SQLITE_DB_PATH = os.environ.get('SQLITE_DB_PATH', os.path.join('cache', 'recommender.sqlite3'))
+SQLITE_TIMEOUT_SECONDS = float(os.environ.get('SQLITE_TIMEOUT', 30.0))
+
+# (patrón, reemplazo) aplicados en orden a cada sentencia
+_REWRITES = [
+    (re.compile(r'\)\s*ENGINE=\w+\s*;?\s*$', re.S), ')'),
+    (re.compile(r'\bCREATE TEMPORARY TABLE\b'), 'CREATE TEMP TABLE'),
+    (re.compile(r'\bDROP TEMPORARY TABLE\b'), 'DROP TABLE'),
+    (re.compile(r'^\s*SET FOREIGN_KEY_CHECKS\s*=\s*0\s*;?\s*$'), 'PRAGMA foreign_keys = OFF'),
+    (re.compile(r'^\s*SET FOREIGN_KEY_CHECKS\s*=\s*1\s*;?\s*$'), 'PRAGMA foreign_keys = ON'),
+    (re.compile(r'^\s*TRUNCATE TABLE (\w+)'), r'DELETE FROM \1'),
+    (re.compile(r'\bVALUES\((\w+)\)'), r'excluded.\1'),
+    (re.compile(r'\bON DUPLICATE KEY UPDATE\b'), 'ON CONFLICT DO UPDATE SET'),
+    (re.compile(r'\bGREATEST\('), 'MAX('),
+    (re.compile(r'%s'), '?'),
+]
+# UPDATE a x JOIN b y ON x.k = y.k SET x.c = y.c, ...  ->  UPDATE a SET c = y.c, ... FROM b y WHERE a.k = y.k
+_UPDATE_JOIN = re.compile(
+    r'^\s*UPDATE (\w+) (\w+) JOIN (\w+) (\w+) ON \2\.(\w+) = \4\.(\w+) SET (.+)$', re.S
+)
+_RENAME_TABLE = re.compile(r'^\s*RENAME TABLE (.+)$', re.S)
+
+
+def _rewrite_update_join(match) -> str:
+    table, alias, other, other_alias, key, other_key, assignments = match.groups()
+    assignments = re.sub(rf'\b{alias}\.(\w+)\s*=', r'\1 =', assignments)
+    return f"UPDATE {table} SET {assignments} FROM {other} {other_alias} WHERE {table}.{key} = {other_alias}.{other_key}"
+
+
+def translate(sql: str) -> list:
+    """Traduce una sentencia MySQL del proyecto a una o más sentencias SQLite."""
+    rename = _RENAME_TABLE.match(sql)
+    if rename:
+        pairs = [pair.split(' TO ') for pair in rename.group(1).split(',')]
+        return [f"ALTER TABLE {old.strip()} RENAME TO {new.strip()}" for old, new in pairs]
+    if sql.lstrip().upper().startswith('LOAD DATA'):
+        raise Error(msg="LOAD DATA no está disponible con DB_BACKEND=sqlite; use el método 'insert'.")
+    sql = _UPDATE_JOIN.sub(_rewrite_update_join, sql)
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return [sql]
+
+
+def _as_mysql_error(e: sqlite3.Error) -> Error:
+    """Convierte el error de SQLite al error de MySQL equivalente (errno incluido)."""
+    message = str(e)
+    errno = None
+    if 'FOREIGN KEY constraint failed' in message:
+        errno = errorcode.ER_NO_REFERENCED_ROW_2
+    elif 'duplicate column name' in message:
+        errno = errorcode.ER_DUP_FIELDNAME
+    elif 'UNIQUE constraint failed' in message:
+        errno = errorcode.ER_DUP_ENTRY
+    return Error(msg=message, errno=errno)
+
+
+def _sha2(value, bits):
+    return None if value is None else hashlib.sha256(str(value).encode('utf-8')).hexdigest()
+
+
+def _concat(*values):
+    return None if any(value is None for value in values) else ''.join(map(str, values))
+
+
+class SQLiteCursor:
+    def __init__(self, connection: sqlite3.Connection):
+        self._cursor = connection.cursor()
+
+    def execute(self, sql, params=None):
+        try:
+            for statement in translate(sql):
+                self._cursor.execute(statement, tuple(params or ()))
+        except sqlite3.Error as e:
+            raise _as_mysql_error(e) from e
+
+    def executemany(self, sql, rows):
+        try:
+            (statement,) = translate(sql)
+            self._cursor.executemany(statement, rows)
+        except sqlite3.Error as e:
+            raise _as_mysql_error(e) from e
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Conexión con la misma interfaz que las del pool de MySQL (`close()` la cierra)."""
+
+    def __init__(self, path: str = None):
+        path = path or SQLITE_DB_PATH
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT_SECONDS, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.create_function('SHA2', 2, _sha2, deterministic=True)
+        self._connection.create_function('CONCAT', -1, _concat, deterministic=True)
+
+    def cursor(self, *args, **kwargs):
+        return SQLiteCursor(self._connection)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+    def is_connected(self) -> bool:
+        return True
+
+    def ping(self, reconnect: bool = False, attempts: int = 1, delay: int = 0):
+        pass
+
+
+def connect(path: str = None) -> SQLiteConnection:
+    try:
+        return SQLiteConnection(path)
+    except sqlite3.Error as e:
+        raise _as_mysql_error(e) from e
@@ -0,0 +1,259 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from src.etl import load_and_clean_data, load_data_streaming, ETL_LOAD_METHOD
+from src.database import create_tables
+
+# --- GENERADOR SINTÉTICO A GRAN ESCALA (PRUEBAS DE CARGA) ---
+# Totalmente vectorizado y por bloques de usuarios: cada bloque usa su propio
+# generador aleatorio derivado de (semilla, bloque), así que el resultado es
+# reproducible y los bloques se pueden generar por separado y en streaming.
+DEFAULT_CHUNK_USERS = int(os.environ.get('SYNTHETIC_CHUNK_USERS', 50000))
+
+# Gustos por grupo de preferencia; se usan como `preferencias_texto` de los
+# usuarios (y como descripción de los destinos sintéticos).
+PREFERENCE_CLUSTERS = [
+    'cultura, historia, comida tradicional',
+    'playa, aventura, naturaleza, relax',
+    'arquitectura colonial, museos, arte',
+    'montaña, bosque, senderismo, ecoturismo',
+    'gastronomía, mezcal, mercados, artesanías',
+    'zonas arqueológicas, pirámides, cultura prehispánica',
+    'pueblos tranquilos, aguas termales, descanso',
+    'fiestas, tradiciones, música, danza',
+]
+
+MEXICO_STATES = [
+    'Aguascalientes', 'Baja California', 'Chiapas', 'Chihuahua', 'Coahuila', 'Estado de México',
+    'Guanajuato', 'Hidalgo', 'Jalisco', 'Michoacán', 'Oaxaca', 'Puebla', 'Querétaro',
+    'Quintana Roo', 'San Luis Potosí', 'Sonora', 'Veracruz', 'Yucatán', 'Zacatecas',
+]
+
+
+class SyntheticConfig:
+    """Parámetros del generador."""
+
+    def __init__(self, num_users: int = 100, ratings_mean: float = 5.0, ratings_sigma: float = 0.6,
+                 min_ratings: int = 1, max_ratings: int = 200, popularity_skew: float = 1.1,
+                 num_clusters: int = 2, cluster_affinity: float = 4.0, min_rating: float = 1.0,
+                 max_rating: float = 5.0, num_destinos: int = None, seed: int = 42,
+                 chunk_users: int = DEFAULT_CHUNK_USERS):
+        """
+        - ratings_mean / ratings_sigma: valoraciones por usuario ~ lognormal (cola larga),
+          recortadas a [min_ratings, max_ratings].
+        - popularity_skew: exponente Zipf de la popularidad de destinos (0 = uniforme).
+        - num_clusters / cluster_affinity: grupos de preferencia; un usuario elige destinos
+          de su grupo `cluster_affinity` veces más y los puntúa más alto.
+        - num_destinos: None usa el catálogo real del CSV; un número genera destinos sintéticos.
+        """
+        self.num_users = num_users
+        self.ratings_mean = ratings_mean
+        self.ratings_sigma = ratings_sigma
+        self.min_ratings = min_ratings
+        self.max_ratings = max_ratings
+        self.popularity_skew = popularity_skew
+        self.num_clusters = max(1, min(num_clusters, len(PREFERENCE_CLUSTERS)))
+        self.cluster_affinity = cluster_affinity
+        self.min_rating = min_rating
+        self.max_rating = max_rating
+        self.num_destinos = num_destinos
+        self.seed = seed
+        self.chunk_users = chunk_users
+
+
+def _rng(config: SyntheticConfig, stream: int, chunk: int = 0) -> np.random.Generator:
+    return np.random.default_rng([config.seed, stream, chunk])
+
+
+def generate_destinos(config: SyntheticConfig) -> pd.DataFrame:
+    """Catálogo real (CSV) o `num_destinos` destinos sintéticos con el mismo esquema."""
+    if config.num_destinos is None:
+        return load_and_clean_data()
+    rng = _rng(config, 0)
+    n = config.num_destinos
+    clusters = rng.integers(0, config.num_clusters, n)
+    states = np.asarray(MEXICO_STATES, dtype=object)[rng.integers(0, len(MEXICO_STATES), n)]
+    cities = pd.Series(np.arange(n)).map('Destino_{}'.format)
+    themes = pd.Series(np.asarray(PREFERENCE_CLUSTERS, dtype=object)[clusters])
+    return pd.DataFrame({
+        'id_destino': np.arange(n),
+        'city': cities,
+        'state': states,
+        'lat': np.round(rng.uniform(14.5, 32.7, n), 7),
+        'lng': np.round(rng.uniform(-117.1, -86.7, n), 7),
+        'full_description': "Destino " + cities + ", en " + pd.Series(states) + ". Ideal para: " + themes + ".",
+    })
+
+
+class _CatalogModel:
+    """Popularidad, grupo y calidad de cada destino (fijos para toda la generación)."""
+
+    def __init__(self, config: SyntheticConfig, destino_ids: np.ndarray):
+        rng = _rng(config, 1)
+        n = len(destino_ids)
+        self.ids = np.asarray(destino_ids, dtype=np.int64)
+        # Popularidad Zipf sobre un orden aleatorio de los destinos
+        popularity = 1.0 / np.arange(1, n + 1) ** config.popularity_skew
+        self.popularity = popularity[rng.permutation(n)]
+        self.cluster = rng.integers(0, config.num_clusters, n)
+        self.quality = rng.normal(0.0, 0.5, n)
+        # Probabilidad de elegir cada destino según el grupo del usuario
+        self.probs = np.empty((config.num_clusters, n))
+        for c in range(config.num_clusters):
+            weights = self.popularity * np.where(self.cluster == c, config.cluster_affinity, 1.0)
+            self.probs[c] = weights / weights.sum()
+
+
+def _user_clusters(config: SyntheticConfig, chunk: int, n_users: int) -> np.ndarray:
+    return _rng(config, 2, chunk).integers(0, config.num_clusters, n_users)
+
+
+def generate_users_chunk(config: SyntheticConfig, chunk: int) -> pd.DataFrame:
+    """Usuarios del bloque `chunk` (ids consecutivos desde 1)."""
+    start = chunk * config.chunk_users
+    user_ids = np.arange(start + 1, min(start + config.chunk_users, config.num_users) + 1)
+    clusters = _user_clusters(config, chunk, len(user_ids))
+    return pd.DataFrame({
+        'id_usuario': user_ids,
+        'nombre': pd.Series(user_ids).map('User_{}'.format),
+        'preferencias_texto': np.asarray(PREFERENCE_CLUSTERS, dtype=object)[clusters],
+    })
+
+
+def generate_ratings_chunk(config: SyntheticConfig, catalog: _CatalogModel, chunk: int) -> pd.DataFrame:
+    """
+    Valoraciones del bloque `chunk`. Se muestrea con reemplazo por grupo y luego se
+    quitan los pares repetidos, así que un usuario puede quedar con algunas menos
+    valoraciones de las sorteadas (nunca menos de una).
+    """
+    rng = _rng(config, 3, chunk)
+    start = chunk * config.chunk_users
+    user_ids = np.arange(start + 1, min(start + config.chunk_users, config.num_users) + 1)
+    clusters = _user_clusters(config, chunk, len(user_ids))
+    n_destinos = len(catalog.ids)
+
+    # Número de valoraciones por usuario: lognormal con media ~ratings_mean
+    mu = np.log(max(config.ratings_mean, 1e-9)) - config.ratings_sigma ** 2 / 2
+    counts = np.rint(rng.lognormal(mu, config.ratings_sigma, len(user_ids))).astype(np.int64)
+    counts = np.clip(counts, config.min_ratings, min(config.max_ratings, n_destinos))
+
+    rating_users = np.repeat(np.arange(len(user_ids)), counts)
+    rating_clusters = np.repeat(clusters, counts)
+    items = np.empty(len(rating_users), dtype=np.int64)
+    for c in range(config.num_clusters):
+        mask = rating_clusters == c
+        items[mask] = rng.choice(n_destinos, size=int(mask.sum()), p=catalog.probs[c])
+
+    # Pares (usuario, destino) únicos
+    _, first = np.unique(rating_users * n_destinos + items, return_index=True)
+    rating_users, items, rating_clusters = rating_users[first], items[first], rating_clusters[first]
+
+    # Puntuación: sesgo del usuario + calidad del destino + afinidad de grupo + ruido
+    midpoint = (config.min_rating + config.max_rating) / 2
+    user_bias = rng.normal(0.0, 0.4, len(user_ids))
+    affinity = np.where(catalog.cluster[items] == rating_clusters, 1.0, -0.3)
+    scores = (midpoint + user_bias[rating_users] + catalog.quality[items] + affinity
+              + rng.normal(0.0, 0.6, len(items)))
+    scores = np.round(np.clip(scores, config.min_rating, config.max_rating), 2)
+
+    return pd.DataFrame({
+        'id_usuario': user_ids[rating_users],
+        'id_destino': catalog.ids[items],
+        'puntuacion': scores,
+    })
+
+
+def num_chunks(config: SyntheticConfig) -> int:
+    return (config.num_users + config.chunk_users - 1) // config.chunk_users
+
+
+def iter_users(config: SyntheticConfig):
+    for chunk in range(num_chunks(config)):
+        yield generate_users_chunk(config, chunk)
+
+
+def iter_ratings(config: SyntheticConfig, destino_ids: np.ndarray):
+    catalog = _CatalogModel(config, destino_ids)
+    for chunk in range(num_chunks(config)):
+        yield generate_ratings_chunk(config, catalog, chunk)
+
+
+def _write_chunks(chunks, out_dir: str, name: str, fmt: str) -> int:
+    """Escribe bloques a `name.csv` (uno solo) o a `name/part-NNNNN.parquet`."""
+    total = 0
+    if fmt == 'csv':
+        path = os.path.join(out_dir, f"{name}.csv")
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            total += len(chunk)
+    else:
+        part_dir = os.path.join(out_dir, name)
+        os.makedirs(part_dir, exist_ok=True)
+        for i, chunk in enumerate(chunks):
+            chunk.to_parquet(os.path.join(part_dir, f"part-{i:05d}.parquet"), index=False)
+            total += len(chunk)
+    return total
+
+
+def write_to_files(config: SyntheticConfig, out_dir: str, fmt: str = 'csv') -> dict:
+    """Genera el conjunto completo en archivos CSV o Parquet (requiere pyarrow o fastparquet)."""
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            try:
+                import fastparquet  # noqa: F401
+            except ImportError:
+                raise ImportError("Para escribir Parquet instale 'pyarrow' (o 'fastparquet'), o use --output csv.")
+    os.makedirs(out_dir, exist_ok=True)
+    destinos = generate_destinos(config)
+    counts = {'destinos': _write_chunks([destinos], out_dir, 'destinos', fmt)}
+    counts['usuarios'] = _write_chunks(iter_users(config), out_dir, 'usuarios', fmt)
+    counts['valoraciones'] = _write_chunks(iter_ratings(config, destinos['id_destino'].to_numpy()),
+                                           out_dir, 'valoraciones', fmt)
+    return counts
+
+
+def load_to_db(config: SyntheticConfig, method: str = ETL_LOAD_METHOD) -> dict:
+    """Genera y carga directamente con el ETL en streaming (tablas sombra + RENAME)."""
+    destinos = generate_destinos(config)
+    return load_data_streaming(
+        [destinos], iter_users(config), iter_ratings(config, destinos['id_destino'].to_numpy()), method=method
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genera usuarios y valoraciones sintéticos para pruebas de carga.")
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--ratings-mean', type=float, default=20.0, help="Media de valoraciones por usuario.")
+    parser.add_argument('--ratings-sigma', type=float, default=0.8, help="Dispersión lognormal por usuario.")
+    parser.add_argument('--max-ratings', type=int, default=500)
+    parser.add_argument('--skew', type=float, default=1.1, help="Exponente Zipf de la popularidad.")
+    parser.add_argument('--clusters', type=int, default=4, help="Grupos de preferencia.")
+    parser.add_argument('--affinity', type=float, default=4.0)
+    parser.add_argument('--destinos', type=int, default=None,
+                        help="Generar N destinos sintéticos (por defecto, el catálogo real).")
+    parser.add_argument('--chunk-users', type=int, default=DEFAULT_CHUNK_USERS)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', choices=['db', 'csv', 'parquet'], default='csv')
+    parser.add_argument('--out-dir', default=os.path.join('data', 'synthetic'))
+    parser.add_argument('--method', choices=['insert', 'load_data'], default=ETL_LOAD_METHOD)
+    args = parser.parse_args()
+
+    config = SyntheticConfig(
+        num_users=args.users, ratings_mean=args.ratings_mean, ratings_sigma=args.ratings_sigma,
+        max_ratings=args.max_ratings, popularity_skew=args.skew, num_clusters=args.clusters,
+        cluster_affinity=args.affinity, num_destinos=args.destinos, seed=args.seed,
+        chunk_users=args.chunk_users,
+    )
+    start = time.perf_counter()
+    if args.output == 'db':
+        create_tables()
+        load_to_db(config, method=args.method)
+    else:
+        counts = write_to_files(config, args.out_dir, args.output)
+        elapsed = time.perf_counter() - start
+        print(f"Datos sintéticos escritos en {args.out_dir}: {counts} en {elapsed:.1f} s "
+              f"({counts['valoraciones'] / max(elapsed, 1e-9):.0f} valoraciones/s).")
@@ -0,0 +1,51 @@
+import os
+import time
+from src.database import db_connection
+
+# --- VERSIÓN DE LOS DATOS DE CADA USUARIO (COMPARTIDA ENTRE PROCESOS) ---
+# `usuarios.version_datos` guarda el instante (epoch, estrictamente creciente por
+# usuario) de su última valoración o cambio de preferencias hecho por el API. Se
+# escribe en la misma transacción que el cambio, así que cualquier proceso que
+# lea la versión nueva también ve el dato nuevo. Los estados en memoria de cada
+# proceso (top-K precalculado, overlay de valoraciones, fold-in) la comparan con
+# el momento en que se calcularon para saber si quedaron viejos.
+# Margen para transacciones en curso al tomar una foto y para el desfase de
+# relojes entre hosts: un cambio hasta este tiempo antes de la foto cuenta como posterior.
+USER_VERSION_MARGIN_SECONDS = float(os.environ.get('USER_VERSION_MARGIN', 5))
+
+
+def bump_user_version(cursor, user_id: int) -> float:
+    """
+    Registra un cambio en los datos del usuario con el cursor (y la transacción)
+    del llamador. Devuelve la versión nueva (None si el usuario no existe).
+    """
+    cursor.execute(
+        "UPDATE usuarios SET version_datos = GREATEST(COALESCE(version_datos, 0) + 0.000001, %s) "
+        "WHERE id_usuario = %s",
+        (time.time(), user_id)
+    )
+    cursor.execute("SELECT version_datos FROM usuarios WHERE id_usuario = %s", (user_id,))
+    row = cursor.fetchone()
+    return float(row[0]) if row is not None and row[0] is not None else None
+
+
+def get_user_versions(user_ids, conn=None) -> dict:
+    """id_usuario -> versión para los usuarios con algún cambio registrado (una consulta)."""
+    user_ids = [int(user_id) for user_id in dict.fromkeys(user_ids)]
+    if not user_ids:
+        return {}
+    format_strings = ','.join(['%s'] * len(user_ids))
+    with db_connection(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT id_usuario, version_datos FROM usuarios "
+            f"WHERE id_usuario IN ({format_strings}) AND version_datos IS NOT NULL",
+            user_ids
+        )
+        rows = cursor.fetchall()
+    return {int(user_id): float(version) for user_id, version in rows}
+
+
+def changed_since(version, since: float) -> bool:
+    """¿La versión es posterior (con margen) a una foto tomada en `since`?"""
+    return version is not None and version >= since - USER_VERSION_MARGIN_SECONDS
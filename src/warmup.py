@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from src import model_registry
+from src.database import create_tables
+from src.catalog import get_catalog
+from src.cb_model import get_cb_score_arrays_batch
+from src.cf_model import score_users, CF_ARTIFACT
+
+# --- WARM-UP Y READINESS DEL API ---
+# Importar el API ya no carga modelos ni toca MySQL. Al iniciar, el warm-up crea
+# las tablas, carga los artefactos y ejecuta una vez cada ruta costosa
+# (encode, búsqueda FAISS, scoring CF) para que la primera petición real no
+# pague la inicialización. /health/ready responde 503 hasta que termina.
+WARMUP_IN_BACKGROUND = os.environ.get('WARMUP_IN_BACKGROUND', '1') == '1'
+WARMUP_QUERY = "cultura, historia, playa"
+# Pasos sin los que el proceso no puede atender peticiones
+REQUIRED_STEPS = ('models', 'embeddings', 'cf')
+
+_state = {'status': 'pending', 'started_at': None, 'finished_at': None, 'steps': {}}
+_thread = None
+
+
+def _run_step(name: str, fn):
+    start = time.perf_counter()
+    try:
+        fn()
+        result = {'ok': True}
+    except Exception as e:
+        print(f"ATENCIÓN: Falló el paso de warm-up '{name}'. Error: {e}")
+        result = {'ok': False, 'error': str(e)}
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    _state['steps'][name] = result
+
+
+def _warm_models():
+    """Catálogo, modelo CF e índice FAISS en memoria (mmap)."""
+    model_registry.load_all()
+    missing = [name for name, loaded in model_registry.artifact_status().items() if not loaded]
+    if missing:
+        raise RuntimeError(f"Artefactos sin cargar: {', '.join(missing)}")
+
+
+def _warm_embeddings():
+    """Construye el SentenceTransformer y ejecuta un encode + búsqueda FAISS."""
+    get_cb_score_arrays_batch([WARMUP_QUERY], top_k=10)
+
+
+def _warm_cf():
+    """Un scoring CF contra todo el catálogo (recorre las páginas mapeadas de qi/bi)."""
+    factors = model_registry.get_artifact(CF_ARTIFACT)
+    if factors is None:
+        raise RuntimeError("No hay modelo CF entrenado.")
+    score_users(factors, factors['user_ids_sorted'][:1], get_catalog()['ids'])
+
+
+def warm_up() -> dict:
+    """Ejecuta todos los pasos del warm-up y deja el estado en 'ready' o 'failed'."""
+    _state.update(status='warming', started_at=time.time(), finished_at=None, steps={})
+    # Si MySQL no responde se intenta igual: las tablas pueden existir ya
+    _run_step('database', create_tables)
+    _run_step('models', _warm_models)
+    _run_step('embeddings', _warm_embeddings)
+    _run_step('cf', _warm_cf)
+    ok = all(_state['steps'][name]['ok'] for name in REQUIRED_STEPS)
+    _state.update(status='ready' if ok else 'failed', finished_at=time.time())
+    print(f"Warm-up {'completado' if ok else 'incompleto'} en "
+          f"{_state['finished_at'] - _state['started_at']:.1f} s.")
+    return readiness()
+
+
+def start_warm_up(background: bool = WARMUP_IN_BACKGROUND):
+    """Lanza el warm-up (una sola vez). En segundo plano, /health/live responde de inmediato."""
+    global _thread
+    if _thread is not None or _state['status'] != 'pending':
+        return
+    if not background:
+        warm_up()
+        return
+    _thread = threading.Thread(target=warm_up, daemon=True, name="warm-up")
+    _thread.start()
+
+
+def readiness() -> dict:
+    """Estado del warm-up; `ready` exige que haya terminado y que los artefactos sigan cargados."""
+    artifacts = model_registry.artifact_status()
+    return {
+        'ready': _state['status'] == 'ready' and all(artifacts.values()),
+        'status': _state['status'],
+        'steps': dict(_state['steps']),
+        'artifacts': artifacts,
+    }
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.query_cache import ExpansionCache
+
+
+class AsyncSingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    """Single-flight asíncrono de ExpansionCache: una sola llamada por clave aunque se cancelen solicitantes."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cache = ExpansionCache(db_path=os.path.join(self._tmp.name, 'expansions.sqlite3'))
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    def tearDown(self):
+        if self.cache._disk is not None:
+            self.cache._disk.close()
+        self._tmp.cleanup()
+
+    async def _compute(self):
+        self.calls += 1
+        await self.release.wait()
+        return 'playa, mar, arena'
+
+    async def _wait_for_stat(self, name: str, value: int):
+        while self.cache.stats()[name] < value:
+            await asyncio.sleep(0)
+
+    async def test_cancelled_leader_does_not_cancel_followers(self):
+        leader = asyncio.create_task(self.cache.get_or_compute_async('playa', self._compute))
+        await self._wait_for_stat('misses', 1)
+        follower = asyncio.create_task(self.cache.get_or_compute_async('playa', self._compute))
+        await self._wait_for_stat('coalesced', 1)
+
+        leader.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(await follower, 'playa, mar, arena')
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache._inflight_async, {})
+        # La expansión quedó en caché: la siguiente petición no vuelve a calcular
+        self.assertEqual(await self.cache.get_or_compute_async('playa', self._compute), 'playa, mar, arena')
+        self.assertEqual(self.calls, 1)
+
+    async def test_computation_finishes_when_every_waiter_is_cancelled(self):
+        waiter = asyncio.create_task(self.cache.get_or_compute_async('playa', self._compute))
+        await self._wait_for_stat('misses', 1)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+        while self.cache._inflight_async:
+            await asyncio.sleep(0)
+
+        self.assertEqual(self.cache._memory_get('playa'), 'playa, mar, arena')
+        self.assertEqual(self.calls, 1)
+
+    async def test_error_reaches_every_waiter_and_is_not_cached(self):
+        async def failing():
+            self.calls += 1
+            await self.release.wait()
+            raise ConnectionError('Ollama no responde')
+
+        first = asyncio.create_task(self.cache.get_or_compute_async('playa', failing))
+        await self._wait_for_stat('misses', 1)
+        second = asyncio.create_task(self.cache.get_or_compute_async('playa', failing))
+        await self._wait_for_stat('coalesced', 1)
+        self.release.set()
+
+        for task in (first, second):
+            with self.assertRaises(ConnectionError):
+                await task
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache.stats()['errors'], 1)
+        self.assertEqual(self.cache._inflight_async, {})
+        self.assertIsNone(self.cache._memory_get('playa'))
+
+
+if __name__ == '__main__':
+    unittest.main()